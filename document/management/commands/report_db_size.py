@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import models
+from django.db.models.functions import Length
+
+from document.models import DocumentContent
+
+
+class Command(BaseCommand):
+    """Report the size of the database, the largest tables and the stored document content"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, help='The number of largest tables to show.', default=10)
+
+    def handle(self, *args, **options):
+        self.stdout.write('database: {}'.format(Command.format_size(Command.get_database_size())))
+        for table, size in Command.get_table_sizes()[:options['tables']]:
+            self.stdout.write('{}: {}'.format(table, Command.format_size(size)))
+        if DocumentContent._meta.db_table not in connection.introspection.table_names():
+            return  # not migrated yet, the content is part of the document table
+        content = DocumentContent.objects.aggregate(
+            count=models.Count('document'),
+            size=models.Sum('size'),
+            size_compressed=models.Sum(Length('content_html_zlib'))
+        )
+        self.stdout.write('document content: {} documents, {} html, {} compressed'.format(
+            content['count'], Command.format_size(content['size'] or 0), Command.format_size(content['size_compressed'] or 0)
+        ))
+
+    @staticmethod
+    def get_database_size():
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_database_size(current_database())')
+                return cursor.fetchone()[0]
+            if connection.vendor == 'sqlite':
+                cursor.execute('PRAGMA page_count')
+                page_count = cursor.fetchone()[0]
+                cursor.execute('PRAGMA page_size')
+                return page_count * cursor.fetchone()[0]
+        return 0
+
+    @staticmethod
+    def get_table_sizes():
+        """ returns (table, size in bytes) for all tables, largest first, including indexes and toast data """
+        if connection.vendor != 'postgresql':
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname, pg_total_relation_size(relid) FROM pg_catalog.pg_statio_user_tables "
+                "ORDER BY pg_total_relation_size(relid) DESC"
+            )
+            return cursor.fetchall()
+
+    @staticmethod
+    def format_size(size):
+        return '{:.1f} MB'.format(size / (1024 * 1024))
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:46
+
+import logging
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+
+
+def move_content_to_document_content(apps, schema_editor):
+    Document = apps.get_model('document', 'Document')
+    DocumentContent = apps.get_model('document', 'DocumentContent')
+    size_total = 0
+    size_compressed_total = 0
+    batch = []
+    documents = Document.objects.exclude(content_html='').values_list('id', 'content_html').order_by('id')
+    for document_id, content_html in documents.iterator(chunk_size=BATCH_SIZE):
+        content = content_html.encode('utf-8')
+        content_zlib = zlib.compress(content)
+        size_total += len(content)
+        size_compressed_total += len(content_zlib)
+        batch.append(DocumentContent(document_id=document_id, content_html_zlib=content_zlib, size=len(content)))
+        if len(batch) >= BATCH_SIZE:
+            DocumentContent.objects.bulk_create(batch)
+            batch = []
+    DocumentContent.objects.bulk_create(batch)
+    logger.info('document content moved: {} MB html, {} MB compressed'.format(
+        size_total // (1024 * 1024), size_compressed_total // (1024 * 1024)
+    ))
+
+
+def move_content_to_document(apps, schema_editor):
+    Document = apps.get_model('document', 'Document')
+    DocumentContent = apps.get_model('document', 'DocumentContent')
+    for content in DocumentContent.objects.all().iterator(chunk_size=BATCH_SIZE):
+        Document.objects.filter(id=content.document_id).update(
+            content_html=zlib.decompress(content.content_html_zlib).decode('utf-8')
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0066_auto_20251116_1520'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentContent',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='content', serialize=False, to='document.Document')),
+                ('content_html_zlib', models.BinaryField()),
+                ('size', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(move_content_to_document_content, move_content_to_document),
+        migrations.RemoveField(
+            model_name='document',
+            name='content_html',
+        ),
+    ]
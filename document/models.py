@@ -1,6 +1,6 @@
 import datetime
 import logging
-import requests
+import zlib
 from itertools import chain
 
 from django.db import models
@@ -18,6 +18,8 @@ from parliament.models import Commissie
 
 from government.models import GovernmentMember
 
+import scraper.session
+
 logger = logging.getLogger(__name__)
 
 
@@ -204,7 +206,7 @@ class Dossier(models.Model):
 
     @staticmethod
     def get_lines_from_url(url):
-        response = requests.get(url, timeout=60)
+        response = scraper.session.get(url, timeout=60)
         return response.content.decode('utf-8').splitlines()
 
 
@@ -219,9 +221,30 @@ class Document(models.Model):
     publisher = models.CharField(max_length=200, blank=True)
     date_published = models.DateField(blank=True, null=True, db_index=True)
     source_url = models.URLField(max_length=1000)
-    content_html = models.CharField(max_length=10000000, blank=True)
     date_updated = models.DateTimeField(auto_now=True)
 
+    @property
+    def content_html(self):
+        """ the html content is stored separately, in DocumentContent, and loaded when needed """
+        if '_content_html' not in self.__dict__:
+            self.__dict__['_content_html'] = DocumentContent.get_content_html(self.pk) if self.pk is not None else ''
+        return self.__dict__['_content_html']
+
+    @content_html.setter
+    def content_html(self, value):
+        self.__dict__['_content_html'] = value if value else ''
+        self.__dict__['_content_html_changed'] = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.__dict__.pop('_content_html_changed', False):
+            DocumentContent.set_content_html(self, self.content_html)
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.__dict__.pop('_content_html', None)
+        self.__dict__.pop('_content_html_changed', None)
+
     @cached_property
     def submitters(self):
         return Submitter.objects.filter(document=self, type=Submitter.SUBMITTER).exclude(person__surname='').select_related('person', 'document')
@@ -251,6 +274,36 @@ class Document(models.Model):
         ordering = ['-date_published']
 
 
+class DocumentContent(models.Model):
+    """
+    The html content of a document, zlib compressed.
+    Separate from Document to keep document queries small, the content is only needed to show or parse a single document.
+    """
+    document = models.OneToOneField(Document, primary_key=True, related_name='content', on_delete=models.CASCADE)
+    content_html_zlib = models.BinaryField()
+    size = models.IntegerField(default=0)  # uncompressed, in bytes
+
+    @staticmethod
+    def compress(content_html):
+        return zlib.compress(content_html.encode('utf-8'))
+
+    @staticmethod
+    def decompress(content_html_zlib):
+        return zlib.decompress(content_html_zlib).decode('utf-8')
+
+    @staticmethod
+    def get_content_html(document_id):
+        content_html_zlib = DocumentContent.objects.filter(document_id=document_id).values_list('content_html_zlib', flat=True).first()
+        return DocumentContent.decompress(content_html_zlib) if content_html_zlib is not None else ''
+
+    @staticmethod
+    def set_content_html(document, content_html):
+        DocumentContent.objects.update_or_create(
+            document=document,
+            defaults={'content_html_zlib': DocumentContent.compress(content_html), 'size': len(content_html.encode('utf-8'))}
+        )
+
+
 class Submitter(models.Model):
     SUBMITTER = 'submitter'
     RECEIVER = 'receiver'
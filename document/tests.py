@@ -3,6 +3,7 @@ import datetime
 from django.test import TestCase
 
 from document.models import Document
+from document.models import DocumentContent
 from document.models import Dossier
 from document.models import Submitter
 from document.models import CategoryDossier
@@ -144,3 +145,26 @@ class TestVoting(TestCase):
         ParliamentMember.objects.all().delete()
         vote = VoteIndividual.objects.filter(id=vote.id)
         self.assertEqual(vote, vote)
+
+
+class TestDocumentContent(TestCase):
+
+    def test_content_html(self):
+        content_html = '<div>' + 'tekst van het document ' * 1000 + '</div>'
+        document = Document.objects.create(document_id='kst-1-1', content_html=content_html)
+        content = DocumentContent.objects.get(document=document)
+        self.assertEqual(len(content_html), content.size)
+        self.assertLess(len(content.content_html_zlib), content.size / 10)
+        document = Document.objects.get(id=document.id)
+        self.assertNotIn('_content_html', document.__dict__)
+        self.assertEqual(content_html, document.content_html)
+        document.content_html = '<div>nieuw</div>'
+        document.save()
+        document.refresh_from_db()
+        self.assertEqual('<div>nieuw</div>', document.content_html)
+        self.assertEqual(1, DocumentContent.objects.count())
+
+    def test_no_content_html(self):
+        document = Document.objects.create(document_id='kst-1-2')
+        self.assertEqual('', Document.objects.get(id=document.id).content_html)
+        self.assertFalse(DocumentContent.objects.exists())
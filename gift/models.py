@@ -46,6 +46,7 @@ class Gift(models.Model):
     date = models.DateField(null=True, blank=True)
     value_euro = models.FloatField(null=True, blank=True)
     type = models.CharField(max_length=4, choices=TYPE_CHOICES, default=ONBEKEND, db_index=True)
+    tk_id = models.CharField(max_length=200, blank=True, db_index=True)
 
     def save(self, *args, **kwargs):
         self.person_position, created = PersonPosition.objects.get_or_create(
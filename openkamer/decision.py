@@ -4,18 +4,43 @@ from typing import List
 from django.db import transaction
 
 from tkapi.util import queries
+from tkapi.besluit import Besluit as TKBesluit
 
 from document.models import Dossier
 from document.models import Decision
 from document.models import Kamerstuk
 
+from openkamer.prefetch import TKDossierData
+from openkamer.update import UpdateSummary
+from openkamer.update import update_if_changed
+
 logger = logging.getLogger(__name__)
 
 
+def get_decision_properties(tk_besluit: TKBesluit, dossier: Dossier, kamerstuk: Kamerstuk):
+    return {
+        'dossier': dossier,
+        'kamerstuk': kamerstuk,
+        'status': tk_besluit.status.name,
+        'text': tk_besluit.tekst,
+        'type': tk_besluit.soort,
+        'note': tk_besluit.opmerking,
+        'datetime': tk_besluit.agendapunt.activiteit.datum,
+    }
+
+
+def get_dossier_besluiten(dossier_id_main: str, dossier_id_sub: str, tk_data: TKDossierData = None) -> List[TKBesluit]:
+    if tk_data is not None:
+        return tk_data.get_besluiten()
+    return queries.get_dossier_besluiten(nummer=dossier_id_main, toevoeging=dossier_id_sub)
+
+
 @transaction.atomic
-def create_dossier_decisions(dossier_id_main: str, dossier_id_sub: str, dossier: Dossier) -> List[Decision]:
+def create_dossier_decisions(
+        dossier_id_main: str, dossier_id_sub: str, dossier: Dossier, tk_data: TKDossierData = None
+) -> List[Decision]:
     logger.info('BEGIN')
-    tk_besluiten = queries.get_dossier_besluiten(nummer=dossier_id_main, toevoeging=dossier_id_sub)
+    tk_besluiten = get_dossier_besluiten(dossier_id_main, dossier_id_sub, tk_data)
     decisions = []
     for tk_besluit in tk_besluiten:
         if not tk_besluit.tekst:
@@ -26,14 +51,46 @@ def create_dossier_decisions(dossier_id_main: str, dossier_id_sub: str, dossier:
         ).first()
         decision, created = Decision.objects.update_or_create(
             tk_id=tk_besluit.id,
-            dossier=dossier,
-            kamerstuk=kamerstuk,
-            status=tk_besluit.status.name,
-            text=tk_besluit.tekst,
-            type=tk_besluit.soort,
-            note=tk_besluit.opmerking,
-            datetime=tk_besluit.agendapunt.activiteit.datum,
+            **get_decision_properties(tk_besluit, dossier, kamerstuk)
         )
         decisions.append(decision)
     logger.info('END: {} decisions created'.format(len(decisions)))
     return decisions
+
+
+def update_dossier_decisions(
+        dossier_id_main: str, dossier_id_sub: str, dossier: Dossier, summary: UpdateSummary, tk_data: TKDossierData = None
+):
+    """ Creates, updates and deletes only the decisions that differ from the TK API, matched on their TK id """
+    logger.info('BEGIN')
+    tk_besluiten = get_dossier_besluiten(dossier_id_main, dossier_id_sub, tk_data)
+    properties_new = {}
+    kamerstukken = {}
+    for kamerstuk in Kamerstuk.objects.filter(id_main=dossier.dossier_id):
+        kamerstukken.setdefault(kamerstuk.id_sub, kamerstuk)
+    for tk_besluit in tk_besluiten:
+        if not tk_besluit.tekst:
+            continue
+        kamerstuk = kamerstukken.get(str(tk_besluit.zaak.volgnummer))
+        properties_new[tk_besluit.id] = get_decision_properties(tk_besluit, dossier, kamerstuk)
+
+    with transaction.atomic():
+        decisions = {}
+        decisions_removed = []
+        for decision in Decision.objects.filter(dossier=dossier):
+            if decision.tk_id in properties_new and decision.tk_id not in decisions:
+                decisions[decision.tk_id] = decision
+            else:
+                decisions_removed.append(decision)
+        for tk_id, properties in properties_new.items():
+            if tk_id not in decisions:
+                Decision.objects.create(tk_id=tk_id, **properties)
+                summary.add('decision', UpdateSummary.CREATED)
+            elif update_if_changed(decisions[tk_id], properties):
+                summary.add('decision', UpdateSummary.UPDATED)
+            else:
+                summary.add('decision', UpdateSummary.UNCHANGED)
+        for decision in decisions_removed:
+            decision.delete()
+        summary.add('decision', UpdateSummary.DELETED, len(decisions_removed))
+    logger.info('END')
@@ -1,10 +1,13 @@
+import collections
+import functools
 import logging
 from typing import List
 
-import lxml
+import lxml.html
 import re
 
 from django.db import transaction
+from django.db.models import Max
 from django.urls import resolve, Resolver404
 from django.urls import reverse
 
@@ -17,15 +20,21 @@ from tkapi.zaak import ZaakActorRelatieSoort as TKZaakActorRelatieSoort
 
 import scraper.documents
 
+import openkamer.parallel
+from openkamer.models import DocumentLinkState
+from openkamer.update import UpdateSummary
+
 from person.util import parse_name_surname_initials
 from person.models import Person
 
 from government.models import GovernmentMember
 from parliament.models import ParliamentMember
-from parliament.models import PartyMember
+from parliament.models import MembershipsAtDate
+from parliament.models import PoliticalParty
 
 from document.models import CategoryDocument
 from document.models import Document
+from document.models import DocumentContent
 from document.models import Dossier
 from document.models import Kamerstuk
 from document.models import Submitter
@@ -41,7 +50,12 @@ class DocumentData(object):
         self.tk_document = tk_document
         self.tk_zaak = tk_zaak
         self._metadata = metadata
-        self.content_html = update_document_html_links(content_html)
+        self.content = content_html if isinstance(content_html, DocumentHtml) else DocumentHtml.from_html(content_html)
+        self.content.update_links()
+
+    @property
+    def content_html(self):
+        return self.content.html
 
     @property
     def url(self):
@@ -86,18 +100,30 @@ class DocumentData(object):
 
 class DocumentFactory(object):
 
-    def get_document_data(self, tk_document: TKDocument, overheidnl_document_id) -> DocumentData:
+    @staticmethod
+    def fetch_document_content(overheidnl_document_id):
+        """ Downloads the metadata and html content of a document. Does not touch the database. """
         logger.info(overheidnl_document_id)
         metadata = scraper.documents.get_metadata(overheidnl_document_id)
         overheidnl_document_id = metadata['overheidnl_document_id'] if metadata['overheidnl_document_id'] else overheidnl_document_id
-        content_html = scraper.documents.get_html_content(overheidnl_document_id)
+        content = DocumentHtml(scraper.documents.get_html_content_tree(overheidnl_document_id))
+        return overheidnl_document_id, metadata, content
+
+    def get_document_data(self, tk_document: TKDocument, overheidnl_document_id, document_content=None) -> DocumentData:
+        """
+        :param document_content: the (overheidnl_document_id, metadata, content) of fetch_document_content,
+            if already downloaded
+        """
+        if document_content is None:
+            document_content = self.fetch_document_content(overheidnl_document_id)
+        overheidnl_document_id, metadata, content = document_content
         tk_zaak = tk_document.zaken[0] if tk_document.zaken else None
         return DocumentData(
             overheidnl_document_id,
             tk_document=tk_document,
             tk_zaak=tk_zaak,
             metadata=metadata,
-            content_html=content_html
+            content_html=content
         )
 
     def create_document(self, tk_document: TKDocument, overheidnl_document_id, dossier_id=None, dossier=None) -> Document:
@@ -121,9 +147,14 @@ class DocumentFactory(object):
         logger.info('END')
         return document
 
-    def create_kamervraag_document(self, tk_document: TKDocument, overheidnl_document_id):
+    def create_kamervraag_document(self, tk_document: TKDocument, overheidnl_document_id, document_content=None):
+        document, document_data = self.create_kamervraag_document_data(tk_document, overheidnl_document_id, document_content)
+        return document, document_data._metadata['vraagnummer']
+
+    def create_kamervraag_document_data(self, tk_document: TKDocument, overheidnl_document_id, document_content=None):
+        """ returns the document and its DocumentData, with the parsed content for further processing """
         logger.info('BEGIN')
-        document_data = self.get_document_data(tk_document, overheidnl_document_id)
+        document_data = self.get_document_data(tk_document, overheidnl_document_id, document_content=document_content)
 
         properties = {
             'dossier': None,
@@ -137,10 +168,11 @@ class DocumentFactory(object):
 
         document = self.create_or_update_document(document_data, properties)
         logger.info('END')
-        return document, document_data._metadata['vraagnummer']
+        return document, document_data
 
     @staticmethod
-    def create_or_update_document(document_data: DocumentData, properties) -> Document:
+    def create_or_update_document(document_data: DocumentData, properties, submitter_builder: 'SubmitterBuilder' = None) -> Document:
+        """ :param submitter_builder: adds the submitters to this builder instead of creating them immediately """
         if not document_data.date_published:
             logger.error('No published date for document: ' + str(document_data.document_id))
 
@@ -150,7 +182,10 @@ class DocumentFactory(object):
         )
         category_list = get_categories(text=document_data.category, category_class=CategoryDocument)
         document.categories.add(*category_list)
-        SubmitterFactory.create_submitters(document, document_data)
+        if submitter_builder is not None:
+            submitter_builder.add_document(document, document_data)
+        else:
+            SubmitterFactory.create_submitters(document, document_data)
         return document
 
     @staticmethod
@@ -162,86 +197,353 @@ class DocumentFactory(object):
         return dossier
 
 
-def update_document_html_links(content_html):
+OFFICIELEBEKENDMAKINGEN_URL = 'https://zoek.officielebekendmakingen.nl'
+LINK_KAMERSTUK_PATTERN = re.compile(r'(?:{}/)?kst-(\d+)-(\d+)'.format(re.escape(OFFICIELEBEKENDMAKINGEN_URL)))
+LINK_DOSSIER_PATTERN = re.compile(r'(?:{})?/dossier/(\d+)'.format(re.escape(OFFICIELEBEKENDMAKINGEN_URL)))
+LINK_REFERENCE_PATTERN = re.compile(r'kst-(\d+)-(\d+)|/dossier/(\d+)')
+
+
+class LinkTargets(object):
+    """
+    The kamerstukken (id_main, id_sub) and dossiers that exist, of the links in documents.
+    Loaded with one query per type for the links of a document, or for all kamerstukken and dossiers for bulk updates.
+    """
+
+    def __init__(self, kamerstukken, dossiers):
+        self.kamerstukken = kamerstukken
+        self.dossiers = dossiers
+
+    @staticmethod
+    def get_kamerstuk_reference(url):
+        """ returns the (dossier id, sub id) of a link to a kamerstuk on officielebekendmakingen.nl, or None """
+        match = LINK_KAMERSTUK_PATTERN.match(url)
+        return (match.group(1), match.group(2)) if match else None
+
+    @staticmethod
+    def get_dossier_reference(url):
+        match = LINK_DOSSIER_PATTERN.match(url)
+        return match.group(1) if match else None
+
+    @staticmethod
+    def for_urls(urls):
+        kamerstuk_references = set()
+        dossier_references = set()
+        for url in urls:
+            kamerstuk_reference = LinkTargets.get_kamerstuk_reference(url)
+            dossier_reference = LinkTargets.get_dossier_reference(url)
+            if kamerstuk_reference:
+                kamerstuk_references.add(kamerstuk_reference)
+            elif dossier_reference:
+                dossier_references.add(dossier_reference)
+        kamerstukken = set()
+        if kamerstuk_references:
+            kamerstukken = set(Kamerstuk.objects.filter(
+                id_main__in={id_main for id_main, id_sub in kamerstuk_references},
+                id_sub__in={id_sub for id_main, id_sub in kamerstuk_references}
+            ).values_list('id_main', 'id_sub')) & kamerstuk_references
+        dossiers = set()
+        if dossier_references:
+            dossiers = set(Dossier.objects.filter(dossier_id__in=dossier_references).values_list('dossier_id', flat=True))
+        return LinkTargets(kamerstukken, dossiers)
+
+    @staticmethod
+    def load_all():
+        return LinkTargets(
+            kamerstukken=set(Kamerstuk.objects.values_list('id_main', 'id_sub')),
+            dossiers=set(Dossier.objects.values_list('dossier_id', flat=True))
+        )
+
+    @staticmethod
+    def load_created_after(kamerstuk_id, dossier_id):
+        """ the kamerstukken and dossiers with an id larger than the given ids """
+        return LinkTargets(
+            kamerstukken=set(Kamerstuk.objects.filter(id__gt=kamerstuk_id).values_list('id_main', 'id_sub')),
+            dossiers=set(Dossier.objects.filter(id__gt=dossier_id).values_list('dossier_id', flat=True))
+        )
+
+    def is_empty(self):
+        return not self.kamerstukken and not self.dossiers
+
+    def is_referenced(self, content_html):
+        """ returns True if the html may link to one of the targets, a search in the raw html, without parsing it """
+        for match in LINK_REFERENCE_PATTERN.finditer(content_html):
+            if match.group(3) is not None:
+                if match.group(3) in self.dossiers:
+                    return True
+            elif (match.group(1), match.group(2)) in self.kamerstukken:
+                return True
+        return False
+
+    def get_new_url(self, url):
+        """ returns the openkamer url of a link to an existing kamerstuk or dossier, otherwise None """
+        kamerstuk_reference = self.get_kamerstuk_reference(url)
+        if kamerstuk_reference:
+            if kamerstuk_reference in self.kamerstukken:
+                return reverse('kamerstuk', args=kamerstuk_reference)
+            return None
+        dossier_reference = self.get_dossier_reference(url)
+        if dossier_reference and dossier_reference in self.dossiers:
+            return reverse('dossier-timeline', args=(dossier_reference,))
+        return None
+
+
+def get_html_links(tree):
+    return [element for element in tree.xpath('//a') if 'href' in element.attrib]
+
+
+class DocumentHtml(object):
+    """
+    The html content of a document, parsed once.
+    All processing steps (link rewriting, extraction of vragen, antwoorden, footnotes and mededelingen) work on the same tree,
+    the html is serialized once, when needed.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self._html = None
+
+    @staticmethod
+    def from_html(content_html):
+        return DocumentHtml(lxml.html.fromstring(content_html) if content_html else None)
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._html = lxml.html.tostring(self.tree, with_tail=False).decode('utf-8') if self.tree is not None else ''
+        return self._html
+
+    def update_links(self, link_targets: LinkTargets = None):
+        if self.tree is None:
+            return
+        update_html_links(self.tree, link_targets)
+        self._html = None
+
+
+def update_document_html_links(content_html, link_targets: LinkTargets = None):
+    """
+    Replaces links to kamerstukken and dossiers that exist in openkamer with openkamer links,
+    and relative links with officielebekendmakingen.nl links.
+    :param link_targets: the existing link targets, loaded for the links of this document if not given
+    """
     if not content_html:
         return content_html
-    tree = lxml.html.fromstring(content_html)
-    a_elements = tree.xpath('//a')
+    content = DocumentHtml.from_html(content_html)
+    content.update_links(link_targets)
+    return content.html
+
+
+def update_html_links(tree, link_targets: LinkTargets = None):
+    """ update_document_html_links on a parsed tree, changes the tree """
+    a_elements = get_html_links(tree)
+    if link_targets is None:
+        link_targets = LinkTargets.for_urls([element.attrib['href'] for element in a_elements])
     for element in a_elements:
-        if not 'href' in element.attrib:
-            continue
-        url = element.attrib['href']
-        new_url = create_new_url(url)
-        element.attrib['href'] = new_url
-    return lxml.html.tostring(tree).decode('utf-8')
-
-
-def create_new_url(url):
-    match_kamerstuk = re.match("kst-(\d+)-(\d+)", url)
-    match_dossier = re.match("/dossier/(\d+)", url)
-    new_url = ''
-    if match_kamerstuk:
-        dossier_id = match_kamerstuk.group(1)
-        sub_id = match_kamerstuk.group(2)
-        kamerstukken = Kamerstuk.objects.filter(id_main=dossier_id, id_sub=sub_id)
-        if kamerstukken.exists():
-            new_url = reverse('kamerstuk', args=(dossier_id, sub_id,))
-    elif match_dossier:
-        dossier_id = match_dossier.group(1)
-        if Dossier.objects.filter(dossier_id=dossier_id).exists():
-            new_url = reverse('dossier-timeline', args=(dossier_id,))
+        element.attrib['href'] = create_new_url(element.attrib['href'], link_targets)
+
+
+@functools.lru_cache(maxsize=10000)
+def is_openkamer_url(url):
+    try:
+        resolve(url)
+        return True
+    except Resolver404:
+        return False
+
+
+def create_new_url(url, link_targets: LinkTargets = None):
+    if link_targets is None:
+        link_targets = LinkTargets.for_urls([url])
+    new_url = link_targets.get_new_url(url)
     if not new_url:
-        try:
-            resolve(url)
-            openkamer_url = True
-        except Resolver404:
-            openkamer_url = False
-        if openkamer_url or url[0] == '#' or 'http' in url:  # openkamer, anchor or external url
+        if is_openkamer_url(url) or url[0] == '#' or 'http' in url:  # openkamer, anchor or external url
             new_url = url
         else:
             if url[0] != '/':
                 url = '/' + url
-            new_url = 'https://zoek.officielebekendmakingen.nl' + url
+            new_url = OFFICIELEBEKENDMAKINGEN_URL + url
     return new_url
 
 
-class SubmitterFactory(object):
+def has_new_links(tree, link_targets: LinkTargets):
+    """ returns True if the parsed document has links that are not yet, but can be, replaced with openkamer links """
+    for element in get_html_links(tree):
+        url = element.attrib['href']
+        if create_new_url(url, link_targets) != url:
+            return True
+    return False
 
-    @staticmethod
-    @transaction.atomic
-    def create_submitters(document: Document, document_data: DocumentData):
-        Submitter.objects.filter(document=document).delete()
+
+_bulk_link_targets = None
+_bulk_new_link_targets = None
+
+
+def update_documents_html_links_chunk(document_ids):
+    """ updates the links of the documents, returns the number of updated documents """
+    counter = 0
+    for content in DocumentContent.objects.filter(document_id__in=document_ids).select_related('document'):
+        content_html = DocumentContent.decompress(content.content_html_zlib)
+        if _bulk_new_link_targets is not None and not _bulk_new_link_targets.is_referenced(content_html):
+            continue
+        document_html = DocumentHtml.from_html(content_html)
+        if document_html.tree is None or not has_new_links(document_html.tree, _bulk_link_targets):
+            continue
+        document_html.update_links(_bulk_link_targets)
+        DocumentContent.set_content_html(content.document, document_html.html)
+        counter += 1
+    return counter
+
+
+def update_documents_html_links(chunk_size=500, workers=1, full=False):
+    """
+    Updates the links in all documents, for example to link to kamerstukken and dossiers that are created later.
+    Only documents with a link that changes are saved. The documents are processed in chunks by multiple processes.
+    Links are created when a document is created, so after the first run only documents that link to
+    a kamerstuk or dossier that is created since the previous run are parsed, unless full is True.
+    """
+    global _bulk_link_targets
+    global _bulk_new_link_targets
+    logger.info('BEGIN')
+    state = DocumentLinkState.objects.first() or DocumentLinkState()
+    kamerstuk_id_max = Kamerstuk.objects.aggregate(Max('id'))['id__max'] or 0
+    dossier_id_max = Dossier.objects.aggregate(Max('id'))['id__max'] or 0
+    new_link_targets = None
+    if state.id is not None and not full:
+        new_link_targets = LinkTargets.load_created_after(state.kamerstuk_id_max, state.dossier_id_max)
+        if new_link_targets.is_empty():
+            logger.info('END - no kamerstukken or dossiers created since {}'.format(state.date_updated))
+            return 0
+    _bulk_link_targets = LinkTargets.load_all()  # loaded once, inherited by the worker processes
+    _bulk_new_link_targets = new_link_targets
+    document_ids = list(DocumentContent.objects.filter(size__gt=0).order_by('document_id').values_list('document_id', flat=True))
+    chunks = [document_ids[i:i + chunk_size] for i in range(0, len(document_ids), chunk_size)]
+    updated = 0
+    try:
+        for i, chunk_updated in enumerate(openkamer.parallel.map_unordered(update_documents_html_links_chunk, chunks, workers)):
+            updated += chunk_updated
+            logger.info('chunk {}/{} done, {} documents updated'.format(i + 1, len(chunks), updated))
+    finally:
+        _bulk_link_targets = None
+        _bulk_new_link_targets = None
+    state.kamerstuk_id_max = kamerstuk_id_max
+    state.dossier_id_max = dossier_id_max
+    state.save()
+    logger.info('END - {} of {} documents updated'.format(updated, len(document_ids)))
+    return updated
+
+
+class SubmitterBuilder(object):
+    """
+    Creates the submitters of a set of documents in bulk.
+    Add the submitters of the documents, write() then resolves all persons and party slugs at once,
+    and only creates, updates or deletes the submitters that differ from the stored submitters.
+    The added submitters replace all stored submitters of the same document and type.
+    """
+
+    def __init__(self):
+        self._documents = {}
+        self._entries = collections.OrderedDict()  # (document id, type) to a list of (tk_person, name)
+
+    def add_document(self, document: Document, document_data: DocumentData):
+        """ adds the submitters of a document, also if it has none, to remove the stored submitters """
+        self.add_key(document, Submitter.SUBMITTER)
         if document_data.tk_document.soort in [TKDocumentSoort.ANTWOORD_SCHRIFTELIJKE_VRAGEN, TKDocumentSoort.ANTWOORD_SCHRIFTELIJKE_VRAGEN_NADER]:
-            SubmitterFactory.create_submitters_kamerantwoord(document, document_data.tk_zaak)
+            for actor in document_data.tk_zaak.actors:
+                # The receivers of the zaak (or question) are the ones who answer the question,
+                # so they are the (true) submitters of the answer
+                if actor.relatie == TKZaakActorRelatieSoort.GERICHT_AAN and actor.persoon is not None:
+                    self.add(document, tk_person=actor.persoon, name=actor.naam)
         elif document_data.submitters:
             for submitter in document_data.submitters:
-                SubmitterFactory.create_submitter(document, tk_person=submitter)
+                self.add(document, tk_person=submitter)
         else:
             for name in document_data.submitters_names:
                 if 'commissie' in name.lower():
                     # TODO BR: extend submitters to be a commissie instead of person only
                     continue
-                SubmitterFactory.create_submitter(document, name=name)
+                self.add(document, name=name)
+
+    def add(self, document: Document, tk_person: TKPersoon = None, name: str = None, submitter_type=Submitter.SUBMITTER):
+        self.add_key(document, submitter_type).append((tk_person, name))
+
+    def add_key(self, document: Document, submitter_type):
+        """ replaces the stored submitters of this document and type, also if no submitters are added """
+        self._documents[document.id] = document
+        return self._entries.setdefault((document.id, submitter_type), [])
 
-    @staticmethod
     @transaction.atomic
-    def create_submitters_kamerantwoord(document, tk_zaak: TKZaak):
-        for actor in tk_zaak.actors:
-            # The receivers of the zaak (or question) are the ones who answer the question,
-            # so they are the (true) submitters of the answer
-            if actor.relatie == TKZaakActorRelatieSoort.GERICHT_AAN and actor.persoon is not None:
-                SubmitterFactory.create_submitter(document, tk_person=actor.persoon, name=actor.naam)
+    def write(self) -> UpdateSummary:
+        summary = UpdateSummary('submitters')
+        if not self._entries:
+            return summary
+        tk_ids = {tk_person.id for entries in self._entries.values() for tk_person, name in entries if tk_person}
+        persons_by_tk_id = {}
+        for person in Person.objects.filter(tk_id__in=tk_ids).order_by('-id'):
+            persons_by_tk_id[person.tk_id] = person  # the lowest id is stored last
+        persons = {}
+        for key, entries in self._entries.items():
+            document = self._documents[key[0]]
+            persons[key] = [SubmitterFactory.get_person(document, tk_person, name, persons_by_tk_id) for tk_person, name in entries]
+        memberships = MembershipsAtDate(person_ids={person.id for key_persons in persons.values() for person in key_persons})
+        party_slugs = dict(PoliticalParty.objects.values_list('id', 'slug'))
+        date_field = Document._meta.get_field('date_published')
+
+        existing = {}
+        for submitter in Submitter.objects.filter(document_id__in=self._documents.keys()):
+            existing.setdefault((submitter.document_id, submitter.type), {})[submitter.person_id] = submitter
+        new_submitters = []
+        changed_submitters = []
+        deleted_ids = []
+        for key, key_persons in persons.items():
+            document_id, submitter_type = key
+            date = date_field.to_python(self._documents[document_id].date_published)
+            key_existing = existing.get(key, {})
+            person_ids = set()
+            for person in key_persons:
+                if person.id in person_ids:
+                    continue
+                person_ids.add(person.id)
+                party_id = memberships.get_party_id(person.id, date) if date else None
+                party_slug = party_slugs.get(party_id, '') if party_id else ''
+                submitter = key_existing.get(person.id)
+                if submitter is None:
+                    new_submitters.append(Submitter(person=person, document_id=document_id, type=submitter_type, party_slug=party_slug))
+                elif submitter.party_slug != party_slug:
+                    submitter.party_slug = party_slug
+                    changed_submitters.append(submitter)
+                else:
+                    summary.add('submitter', UpdateSummary.UNCHANGED)
+            deleted_ids += [submitter.id for person_id, submitter in key_existing.items() if person_id not in person_ids]
+        Submitter.objects.filter(id__in=deleted_ids).delete()
+        Submitter.objects.bulk_create(new_submitters)
+        Submitter.objects.bulk_update(changed_submitters, ['party_slug'])
+        summary.add('submitter', UpdateSummary.DELETED, len(deleted_ids))
+        summary.add('submitter', UpdateSummary.CREATED, len(new_submitters))
+        summary.add('submitter', UpdateSummary.UPDATED, len(changed_submitters))
+        self._documents = {}
+        self._entries = collections.OrderedDict()
+        return summary
+
+
+class SubmitterFactory(object):
+
+    @staticmethod
+    def create_submitters(document: Document, document_data: DocumentData):
+        builder = SubmitterBuilder()
+        builder.add_document(document, document_data)
+        builder.write()
 
     @staticmethod
-    def get_person(document: Document, tk_person: TKPersoon = None, name: str = None):
+    def get_person(document: Document, tk_person: TKPersoon = None, name: str = None, persons_by_tk_id=None):
+        """ :param persons_by_tk_id: the persons of the tk persons, if already loaded """
         person = None
 
         if not tk_person:
             logger.warning('No document submitter found for document: {}'.format(document.document_id))
         else:
-            persons = Person.objects.filter(tk_id=tk_person.id)
-            if len(persons):
-                person = persons[0]
+            if persons_by_tk_id is not None:
+                person = persons_by_tk_id.get(tk_person.id)
+            else:
+                person = Person.objects.filter(tk_id=tk_person.id).first()
 
             if person is None:
                 logger.warning('No person found for tk_persoon: {} ({})'.format(tk_person.achternaam, tk_person.initialen))
@@ -254,38 +556,15 @@ class SubmitterFactory(object):
             else:
                 initials, surname, surname_prefix = parse_name_surname_initials(name)
             person = Person.find_surname_initials(surname=surname, initials=initials)
+            if not person and openkamer.parallel.acquire_shared_lookup_lock():
+                # the person may have been created by another worker process in the meantime
+                person = Person.find_surname_initials(surname=surname, initials=initials)
 
         if not person:
             logger.warning('Cannot find person: {} ({}). Creating new person!'.format(surname, initials))
             person = Person.objects.create(surname=surname, surname_prefix=surname_prefix, initials=initials)
         return person
 
-    @staticmethod
-    def get_party_slug(person, document):
-        party_members = PartyMember.get_at_date(person, document.date_published)
-        return party_members[0].party.slug if party_members else ''
-
-    @staticmethod
-    @transaction.atomic
-    def create_submitter(
-        document: Document,
-        tk_person: TKPersoon = None,
-        name: str = None,
-        submitter_type = Submitter.SUBMITTER
-    ) -> Submitter:
-        document.refresh_from_db()
-        person = SubmitterFactory.get_person(document, tk_person, name)
-        party_slug = SubmitterFactory.get_party_slug(person, document)
-        submitter, created = Submitter.objects.get_or_create(
-            person=person, document=document, type=submitter_type,
-            defaults={'party_slug': party_slug}
-        )
-        if not created:
-            if submitter.party_slug != party_slug:
-                submitter.party_slug = party_slug
-                submitter.save()
-        return submitter
-
     @staticmethod
     def get_active_persons(date):
         pms = ParliamentMember.active_at_date(date)
@@ -305,6 +584,9 @@ def get_categories(text, category_class=CategoryDocument, sep_char='|'):
     for category_name in category_list:
         name = category_name.lower().strip()
         if name:
-            category, created = category_class.objects.get_or_create(name=name)
+            category = category_class.objects.filter(name=name).first()
+            if category is None:
+                openkamer.parallel.acquire_shared_lookup_lock()
+                category, created = category_class.objects.get_or_create(name=name)
             categories.append(category)
     return categories
@@ -1,13 +1,19 @@
+import collections
+import functools
 import logging
+import os
 import re
+import threading
+import traceback
 
-import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from requests.exceptions import ConnectTimeout
 from requests.exceptions import ConnectionError
 
 from django.db import transaction
+from django.utils import timezone
 
 from tkapi import TKApi
 from tkapi.util import queries
@@ -23,63 +29,80 @@ import scraper.documents
 
 from document.create import get_dossier_ids, DossierId
 from document.models import CategoryDossier
+from document.models import Document
+from document.models import DocumentContent
 from document.models import Dossier
 from document.models import Kamerstuk
 
 from openkamer.document import DocumentFactory
 from openkamer.document import DocumentData
+from openkamer.document import DocumentHtml
+from openkamer.document import SubmitterBuilder
 from openkamer.document import get_categories
 from openkamer.decision import create_dossier_decisions
+from openkamer.decision import update_dossier_decisions
 from openkamer.kamerstuk import create_kamerstuk
+from openkamer.models import ImportRun
+from openkamer.prefetch import TKDossierData
+from openkamer.prefetch import prefetch_dossiers
+from openkamer.settings import DOCUMENT_FETCH_MAX_WORKERS
+from openkamer.settings import DOSSIER_PREFETCH_BATCH_SIZE
+from openkamer.settings import IMPORT_WORKERS
+from openkamer.sync import get_changed_dossiers
+from openkamer.sync import set_dossier_synced
+from openkamer.update import UpdateSummary
+from openkamer.update import update_if_changed
 from openkamer.voting import VotingFactory
+import openkamer.journal
+import openkamer.parallel
 
 logger = logging.getLogger(__name__)
 
 
-def create_dossier_retry_on_error(dossier_id, max_tries=3):
+def create_dossier_retry_on_error(dossier_id, max_tries=3, incremental=False, tk_data: TKDossierData = None):
+    """ :param tk_data: the prefetched TK API data of the dossier, requested per dossier if None """
     dossier_id = str(dossier_id)
     tries = 0
     while True:
         try:
             tries += 1
-            create_or_update_dossier(dossier_id)
+            if incremental:
+                update_dossier(dossier_id, tk_data=tk_data)
+            else:
+                create_or_update_dossier(dossier_id, tk_data=tk_data)
         except (ConnectionError, ConnectTimeout) as error:
-            logger.exception(error)
-            time.sleep(5)  # wait 5 seconds for external servers to relax
+            logger.exception(error)  # requests are already retried with backoff by scraper.session
             if tries < max_tries:
                 logger.error('trying again!')
                 continue
             logger.error('max tries reached, skipping dossier: ' + dossier_id)
-        break
+            return False
+        return True
 
 
 @transaction.atomic
-def create_or_update_dossier(dossier_id):
+def create_or_update_dossier(dossier_id, tk_data: TKDossierData = None):
     logger.info('BEGIN - dossier id: {}'.format(dossier_id))
     Dossier.objects.filter(dossier_id=dossier_id).delete()
     dossier_url = 'https://zoek.officielebekendmakingen.nl/dossier/{}'.format(dossier_id)
     dossier_id_main, dossier_id_sub = Dossier.split_dossier_id(dossier_id)
 
-    dossier_filter = TKDossier.create_filter()
-    dossier_filter.filter_nummer(dossier_id_main)
-    if dossier_id_sub:
-        dossier_filter.filter_toevoeging(dossier_id_sub)
-    dossiers = TKApi.get_dossiers(filter=dossier_filter)
+    if tk_data is not None:
+        dossiers = tk_data.tk_dossiers
+    else:
+        dossier_filter = TKDossier.create_filter()
+        dossier_filter.filter_nummer(dossier_id_main)
+        if dossier_id_sub:
+            dossier_filter.filter_toevoeging(dossier_id_sub)
+        dossiers = TKApi.get_dossiers(filter=dossier_filter)
 
     if len(dossiers) != 1:
         logger.error('{} dossiers found while one expected for {}'.format(len(dossiers), dossier_id))
 
     tk_dossier = dossiers[0]
 
-    # TODO BR: create a list of related dossier decisions instead of one, see dossier 34792 for example
     logger.info('dossier id main: {} | dossier id sub: {}'.format(dossier_id_main, dossier_id_sub))
-    last_besluit = get_besluit_last_with_voting(dossier_id_main, dossier_id_sub)
-    if not last_besluit:
-        last_besluit = get_besluit_last(dossier_id_main, dossier_id_sub)
-
-    decision_text = 'Onbekend'
-    if last_besluit:
-        decision_text = last_besluit.tekst.replace('.', '')
+    decision_text = get_dossier_decision_text(dossier_id_main, dossier_id_sub, tk_data=tk_data)
 
     dossier_new = Dossier.objects.create(
         dossier_id=dossier_id,
@@ -89,74 +112,265 @@ def create_or_update_dossier(dossier_id):
         url=dossier_url,
         decision_text=decision_text
     )
-    create_dossier_documents(dossier_new, dossier_id)
-    create_dossier_decisions(dossier_id_main, dossier_id_sub, dossier_new)
+    create_dossier_documents(dossier_new, dossier_id, tk_data=tk_data)
+    create_dossier_decisions(dossier_id_main, dossier_id_sub, dossier_new, tk_data=tk_data)
     voting_factory = VotingFactory()
-    voting_factory.create_votings(dossier_id)
+    voting_factory.create_votings(dossier_id, tk_data=tk_data)
     dossier_new.set_derived_fields()
     logger.info('END - dossier id: ' + str(dossier_id))
     return dossier_new
 
 
-def get_document_data(tk_document: TKDocument, tk_zaak: Zaak, dossier_id):
+def update_dossier(dossier_id, tk_data: TKDossierData = None) -> UpdateSummary:
+    """
+    Incremental alternative to create_or_update_dossier.
+    Compares the TK API state with the stored dossier and only creates, updates or deletes
+    the documents, kamerstukken, decisions, votings and votes that have changed.
+    Existing documents are not downloaded again, unless their content is missing.
+    """
+    logger.info('BEGIN - dossier id: {}'.format(dossier_id))
+    summary = UpdateSummary(dossier_id)
+    dossier_id_main, dossier_id_sub = Dossier.split_dossier_id(dossier_id)
+    try:
+        if tk_data is not None:
+            tk_dossier = tk_data.get_dossier()
+        else:
+            tk_dossier = queries.get_dossier(nummer=dossier_id_main, toevoeging=dossier_id_sub)
+    except IndexError:
+        tk_dossier = None
+    if tk_dossier is None:
+        logger.error('no dossier found for {}, the dossier is not updated'.format(dossier_id))
+        logger.info('END - {}'.format(summary))
+        return summary
+    properties = {
+        'dossier_main_id': dossier_id_main,
+        'dossier_sub_id': dossier_id_sub,
+        'url': 'https://zoek.officielebekendmakingen.nl/dossier/{}'.format(dossier_id),
+        'decision_text': get_dossier_decision_text(dossier_id_main, dossier_id_sub, tk_data=tk_data),
+    }
+    dossier = Dossier.objects.filter(dossier_id=dossier_id).first()
+    if dossier is None:
+        dossier = Dossier.objects.create(dossier_id=dossier_id, title=tk_dossier.titel, **properties)
+        summary.add('dossier', UpdateSummary.CREATED)
+    elif update_if_changed(dossier, properties):
+        summary.add('dossier', UpdateSummary.UPDATED)
+    else:
+        summary.add('dossier', UpdateSummary.UNCHANGED)
+
+    update_dossier_documents(dossier, dossier_id, summary, tk_data=tk_data)
+    update_dossier_decisions(dossier_id_main, dossier_id_sub, dossier, summary, tk_data=tk_data)
+    voting_factory = VotingFactory()
+    voting_factory.update_votings(dossier_id, summary, tk_data=tk_data)
+    if summary.has_changes:
+        dossier = Dossier.objects.get(id=dossier.id)
+        dossier.set_derived_fields()
+    logger.info('END - {}'.format(summary))
+    return summary
+
+
+def get_dossier_decision_text(dossier_id_main, dossier_id_sub, tk_data: TKDossierData = None):
+    # TODO BR: create a list of related dossier decisions instead of one, see dossier 34792 for example
+    last_besluit = get_besluit_last_with_voting(dossier_id_main, dossier_id_sub, tk_data=tk_data)
+    if not last_besluit:
+        last_besluit = get_besluit_last(dossier_id_main, dossier_id_sub, tk_data=tk_data)
+    decision_text = 'Onbekend'
+    if last_besluit:
+        decision_text = last_besluit.tekst.replace('.', '')
+    return decision_text
+
+
+def get_overheid_document_id(tk_document: TKDocument, dossier_id):
     dossier_id = re.sub(r'-\(.*\)', '', dossier_id)  # Rijkswet ID is not used in url
-    overheid_document_id = 'kst-{}-{}'.format(dossier_id, tk_document.volgnummer)
-    metadata = scraper.documents.get_metadata(overheid_document_id)
+    return 'kst-{}-{}'.format(dossier_id, tk_document.volgnummer)
 
+
+def get_document_content(overheid_document_id):
+    """ Downloads the metadata and html content of a document. Does not touch the database. """
+    metadata = scraper.documents.get_metadata(overheid_document_id)
     try:
-        content_html = scraper.documents.get_html_content(overheid_document_id)
+        content = DocumentHtml(scraper.documents.get_html_content_tree(overheid_document_id))
     except:
         logger.exception('error getting document html for document id: {}'.format(overheid_document_id))
-        content_html = ''
+        content = DocumentHtml(None)
+    return metadata, content
+
+
+def get_document_data(tk_document: TKDocument, tk_zaak: Zaak, dossier_id):
+    overheid_document_id = get_overheid_document_id(tk_document, dossier_id)
+    metadata, content = get_document_content(overheid_document_id)
     document_data = DocumentData(
         document_id=overheid_document_id,
         tk_document=tk_document,
         tk_zaak=tk_zaak,
         metadata=metadata,
-        content_html=content_html,
+        content_html=content,
     )
     return document_data
 
 
-@transaction.atomic
-def create_dossier_documents(dossier, dossier_id):
-    logger.info('create_dossier_documents - BEGIN')
+_document_executor = None
+_document_executor_lock = threading.Lock()
+
+
+def get_document_executor() -> ThreadPoolExecutor:
+    """
+    The threads that download documents, shared by all dossiers of a process.
+    The http sessions are per thread, so their connections are reused for the next dossiers.
+    """
+    global _document_executor
+    with _document_executor_lock:
+        if _document_executor is None:
+            _document_executor = ThreadPoolExecutor(
+                max_workers=max(1, DOCUMENT_FETCH_MAX_WORKERS), thread_name_prefix='document-fetch'
+            )
+        return _document_executor
+
+
+def _reset_document_executor():
+    """ the threads of the executor do not exist in a forked process """
+    global _document_executor, _document_executor_lock
+    _document_executor = None
+    _document_executor_lock = threading.Lock()
+
 
-    tk_dossier = queries.get_dossier(nummer=dossier.dossier_main_id, toevoeging=dossier.dossier_sub_id)
+os.register_at_fork(after_in_child=_reset_document_executor)
 
+
+def get_documents_data(tk_documents, dossier_id, executor: ThreadPoolExecutor = None) -> List[DocumentData]:
+    """
+    Downloads the documents of a dossier in parallel.
+    Only the downloads are done by the executor, the DocumentData objects are created in the calling thread,
+    in the given order, as these do database queries (link rewriting).
+    :param tk_documents: list of (TKDocument, Zaak) tuples
+    :param executor: the executor that downloads the documents, the shared document executor if None
+    """
+    if executor is None:
+        executor = get_document_executor()
+    overheid_document_ids = [get_overheid_document_id(tk_document, dossier_id) for tk_document, tk_zaak in tk_documents]
+    futures = [executor.submit(get_document_content, document_id) for document_id in overheid_document_ids]
     outputs = []
+    try:
+        for (tk_document, tk_zaak), document_id, future in zip(tk_documents, overheid_document_ids, futures):
+            metadata, content = future.result()
+            outputs.append(DocumentData(
+                document_id=document_id,
+                tk_document=tk_document,
+                tk_zaak=tk_zaak,
+                metadata=metadata,
+                content_html=content,
+            ))
+    except BaseException:
+        for future in futures:  # the downloads of a failed dossier are not needed anymore
+            future.cancel()
+        raise
+    return outputs
+
+
+def get_dossier_tk_documents(dossier: Dossier, tk_data: TKDossierData = None):
+    """ returns a list of (TKDocument, Zaak) tuples of the dossier documents that are published at overheid.nl """
+    if tk_data is not None:
+        tk_dossier = tk_data.get_dossier()
+    else:
+        tk_dossier = queries.get_dossier(nummer=dossier.dossier_main_id, toevoeging=dossier.dossier_sub_id)
+    tk_documents = []
     for tk_zaak in tk_dossier.zaken:
         for doc in tk_zaak.documenten:
             if int(doc.volgnummer) == -1:
                 # TODO BR: this document is not found at overheid.nl, fix this
                 continue
-            outputs.append(get_document_data(doc, tk_zaak, dossier_id))
+            tk_documents.append((doc, tk_zaak))
+    return tk_documents
 
-    logger.info('create_dossier_documents - outputs: {}'.format(len(outputs)))
 
+def get_dossier_document_properties(dossier: Dossier, tk_document: TKDocument):
+    return {
+        'dossier': dossier,
+        'title_full': tk_document.onderwerp,
+        'title_short': tk_document.onderwerp,
+        'publication_type': tk_document.soort.value,
+        'date_published': tk_document.datum,
+    }
+
+
+@transaction.atomic
+def create_dossier_documents(dossier, dossier_id, tk_data: TKDossierData = None):
+    logger.info('create_dossier_documents - BEGIN')
+    tk_documents = get_dossier_tk_documents(dossier, tk_data=tk_data)
+    outputs = get_documents_data(tk_documents, dossier_id)
+    logger.info('create_dossier_documents - outputs: {}'.format(len(outputs)))
+    submitter_builder = SubmitterBuilder()
     for data in outputs:
-        properties = {
-            'dossier': dossier,
-            'title_full': data.tk_document.onderwerp,
-            'title_short': data.tk_document.onderwerp,
-            'publication_type': data.tk_document.soort.value,
-            'date_published': data.tk_document.datum,
-            'source_url': data.url,
-            'content_html': data.content_html,
-        }
-
-        document = DocumentFactory.create_or_update_document(data, properties)
-
-        if not Kamerstuk.objects.filter(id_main=dossier_id, id_sub=data.tk_document.volgnummer).exists():
-            create_kamerstuk(
-                document=document,
-                dossier_id=dossier_id,
-                number=data.tk_document.volgnummer,
-                type_long=data.tk_document.onderwerp,
-                type_short=data.tk_document.soort.value
-            )
-            category_list = get_categories(text=data.category, category_class=CategoryDossier, sep_char='|')
-            dossier.categories.add(*category_list)
+        create_dossier_document(dossier, dossier_id, data, submitter_builder)
+    submitter_builder.write()
+
+
+def create_dossier_document(dossier, dossier_id, data: DocumentData, submitter_builder: SubmitterBuilder = None):
+    properties = get_dossier_document_properties(dossier, data.tk_document)
+    properties['source_url'] = data.url
+    properties['content_html'] = data.content_html
+
+    document = DocumentFactory.create_or_update_document(data, properties, submitter_builder)
+
+    if not Kamerstuk.objects.filter(id_main=dossier_id, id_sub=data.tk_document.volgnummer).exists():
+        create_kamerstuk(
+            document=document,
+            dossier_id=dossier_id,
+            number=data.tk_document.volgnummer,
+            type_long=data.tk_document.onderwerp,
+            type_short=data.tk_document.soort.value
+        )
+        category_list = get_categories(text=data.category, category_class=CategoryDossier, sep_char='|')
+        dossier.categories.add(*category_list)
+
+
+def update_dossier_documents(dossier, dossier_id, summary: UpdateSummary, tk_data: TKDossierData = None):
+    """
+    Only downloads and creates the documents that are new or have no content yet,
+    updates the TK API properties of existing documents and kamerstukken if changed,
+    and deletes documents that are no longer part of the dossier.
+    """
+    logger.info('BEGIN')
+    tk_documents = collections.OrderedDict()
+    for tk_document, tk_zaak in get_dossier_tk_documents(dossier, tk_data=tk_data):
+        tk_documents[get_overheid_document_id(tk_document, dossier_id)] = (tk_document, tk_zaak)
+
+    documents = {document.document_id: document for document in Document.objects.filter(dossier=dossier)}
+    document_ids_with_content = set(
+        DocumentContent.objects.filter(document__dossier=dossier, size__gt=0).values_list('document_id', flat=True)
+    )
+    kamerstukken = {}
+    for kamerstuk in Kamerstuk.objects.filter(id_main=dossier_id):
+        kamerstukken.setdefault(kamerstuk.id_sub, kamerstuk)
+
+    tk_documents_download = []
+    with transaction.atomic():
+        for document_id, (tk_document, tk_zaak) in tk_documents.items():
+            document = documents.get(document_id)
+            if document is None or document.id not in document_ids_with_content:
+                tk_documents_download.append((tk_document, tk_zaak))
+                continue
+            changed = update_if_changed(document, get_dossier_document_properties(dossier, tk_document))
+            kamerstuk = kamerstukken.get(str(tk_document.volgnummer))
+            if kamerstuk is not None:
+                changed |= update_if_changed(kamerstuk, {
+                    'type_long': tk_document.onderwerp,
+                    'type_short': tk_document.soort.value,
+                })
+            summary.add('document', UpdateSummary.UPDATED if changed else UpdateSummary.UNCHANGED)
+
+        documents_removed = [document for document_id, document in documents.items() if document_id not in tk_documents]
+        for document in documents_removed:
+            document.delete()
+        summary.add('document', UpdateSummary.DELETED, len(documents_removed))
+
+    outputs = get_documents_data(tk_documents_download, dossier_id)
+    with transaction.atomic():
+        submitter_builder = SubmitterBuilder()
+        for data in outputs:
+            create_dossier_document(dossier, dossier_id, data, submitter_builder)
+            summary.add('document', UpdateSummary.UPDATED if data.document_id in documents else UpdateSummary.CREATED)
+        submitter_builder.write()
+    logger.info('END')
 
 
 def get_inactive_dossier_ids(year=None) -> List[DossierId]:
@@ -173,7 +387,9 @@ def get_inactive_dossier_ids(year=None) -> List[DossierId]:
     return [DossierId(*Dossier.split_dossier_id(dossier_id)) for dossier_id in dossier_ids_inactive]
 
 
-def create_wetsvoorstellen_active(skip_existing=False, max_tries=3):
+def create_wetsvoorstellen_active(
+        skip_existing=False, max_tries=3, incremental=False, only_changed=False, workers=IMPORT_WORKERS
+):
     logger.info('BEGIN')
     dossiers = get_dossier_ids()
     logger.info('active dossiers found: {}'.format(len(dossiers)))
@@ -185,51 +401,188 @@ def create_wetsvoorstellen_active(skip_existing=False, max_tries=3):
             dossier_ids_active.append(dossier)
     dossier_ids_active.reverse()
     logger.info('dossiers active: {}'.format(dossier_ids_active))
-    failed_dossiers = create_wetsvoorstellen(dossier_ids_active, skip_existing=skip_existing, max_tries=max_tries)
+    failed_dossiers = create_wetsvoorstellen(
+        dossier_ids_active, skip_existing=skip_existing, max_tries=max_tries,
+        incremental=incremental, only_changed=only_changed, workers=workers
+    )
     logger.info('END')
     return failed_dossiers
 
 
-def create_wetsvoorstellen_inactive(year=None, skip_existing=False, max_tries=3):
+def create_wetsvoorstellen_inactive(
+        year=None, skip_existing=False, max_tries=3, incremental=False, only_changed=False, workers=IMPORT_WORKERS
+):
     logger.info('BEGIN - year: {}'.format(year))
     dossier_ids_inactive = get_inactive_dossier_ids(year=year)
     dossier_ids_inactive.reverse()
     logger.info('inactive dossiers found: {}'.format(len(dossier_ids_inactive)))
-    failed_dossiers = create_wetsvoorstellen(dossier_ids_inactive, skip_existing=skip_existing, max_tries=max_tries)
+    failed_dossiers = create_wetsvoorstellen(
+        dossier_ids_inactive, skip_existing=skip_existing, max_tries=max_tries,
+        incremental=incremental, only_changed=only_changed, workers=workers
+    )
     logger.info('END')
     return failed_dossiers
 
 
-def create_wetsvoorstellen_all(skip_existing=False, max_tries=3):
+def create_wetsvoorstellen_all(
+        skip_existing=False, max_tries=3, incremental=False, only_changed=False, resume=False, workers=IMPORT_WORKERS
+):
+    """
+    Every dossier and its status is recorded in an import journal.
+    :param resume: continue the last run, only the dossiers that are not yet imported or have failed are imported
+    """
     logger.info('BEGIN')
-    dossier_ids = get_dossier_ids()
-    dossier_ids.reverse()
-    failed_dossiers = create_wetsvoorstellen(dossier_ids, skip_existing=skip_existing, max_tries=max_tries)
+    import_run = None
+    if resume:
+        import_run = openkamer.journal.get_resumable_run(ImportRun.WETSVOORSTELLEN_ALL)
+        if import_run is None:
+            logger.info('no import run to resume, start a new run')
+    if import_run is None:
+        dossier_ids = get_dossier_ids()
+        dossier_ids.reverse()
+        import_run = openkamer.journal.start_run(ImportRun.WETSVOORSTELLEN_ALL, [str(dossier_id) for dossier_id in dossier_ids])
+    else:
+        dossier_ids = [DossierId(*Dossier.split_dossier_id(dossier_id)) for dossier_id in import_run.get_todo_dossier_ids()]
+    failed_dossiers = create_wetsvoorstellen(
+        dossier_ids, skip_existing=skip_existing, max_tries=max_tries,
+        incremental=incremental, only_changed=only_changed, import_run=import_run, workers=workers
+    )
+    openkamer.journal.finish_run(import_run)
     logger.info('END')
     return failed_dossiers
 
 
-def create_wetsvoorstellen(dossier_ids: List[DossierId], skip_existing=False, max_tries=3):
+def import_dossier(dossier_id, max_tries=3, incremental=False, tk_data: TKDossierData = None):
+    """
+    Imports a single dossier, can be run in a worker process.
+    :return: tuple of (dossier_id, error, start datetime), error is None on success
+    """
+    sync_start = timezone.now()
+    error = None
+    try:
+        if not create_dossier_retry_on_error(dossier_id=dossier_id, max_tries=max_tries, incremental=incremental, tk_data=tk_data):
+            error = 'max tries reached'
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('error for dossier id: ' + str(dossier_id))
+    return dossier_id, error, sync_start
+
+
+def import_dossier_prefetched(dossier_id_and_data, max_tries=3, incremental=False):
+    """ import_dossier for a (dossier_id, TKDossierData) tuple, only the data of its own dossier is sent to a worker """
+    dossier_id, tk_data = dossier_id_and_data
+    return import_dossier(dossier_id, max_tries=max_tries, incremental=incremental, tk_data=tk_data)
+
+
+def prefetch_dossiers_batch(dossier_ids):
+    """ returns (dossier_id, TKDossierData) tuples, the data is None if not prefetched, then it is requested per dossier """
+    try:
+        dossiers_data = prefetch_dossiers(dossier_ids)
+    except Exception:
+        logger.exception('prefetch failed, request the TK API data per dossier for {} dossiers'.format(len(dossier_ids)))
+        dossiers_data = {}
+    return [(dossier_id, dossiers_data.get(dossier_id)) for dossier_id in dossier_ids]
+
+
+def iter_dossiers_prefetched(dossier_ids, batch_size, slots: threading.Semaphore, stop: threading.Event):
+    """
+    Yields (dossier_id, TKDossierData) tuples, the next batch is prefetched in a thread while the current batch is imported.
+    A slot is acquired for each yielded dossier, release a slot when a dossier is done to limit the data in memory.
+    Stops when the stop event is set, also while waiting for a slot.
+    """
+    batches = [dossier_ids[i:i + batch_size] for i in range(0, len(dossier_ids), batch_size)]
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(prefetch_dossiers_batch, batches[0])
+        for i in range(len(batches)):
+            batch = future.result()
+            if i + 1 < len(batches):
+                future = executor.submit(prefetch_dossiers_batch, batches[i + 1])
+            for dossier_id_and_data in batch:
+                while not slots.acquire(timeout=1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                yield dossier_id_and_data
+
+
+def import_dossiers_prefetched(import_function, dossier_ids, batch_size, workers):
+    """
+    Yields import_function((dossier_id, TKDossierData)) for all dossiers, imported in the given number of workers.
+    With workers, the dossiers are prefetched by a thread of the worker pool that waits for a slot,
+    the prefetching is stopped when the caller stops iterating, for example on an error, otherwise the pool can not terminate.
+    """
+    slots = threading.Semaphore(max(batch_size, workers))
+    stop = threading.Event()
+    dossiers_prefetched = iter_dossiers_prefetched(dossier_ids, batch_size, slots, stop)
+    results = openkamer.parallel.map_unordered(import_function, dossiers_prefetched, workers)
+    try:
+        for result in results:
+            slots.release()
+            yield result
+    finally:
+        stop.set()
+        results.close()
+
+
+def create_wetsvoorstellen(
+        dossier_ids: List[DossierId], skip_existing=False, max_tries=3, incremental=False, only_changed=False,
+        import_run=None, workers=IMPORT_WORKERS, prefetch_batch_size=DOSSIER_PREFETCH_BATCH_SIZE
+):
+    """
+    :param only_changed: only import dossiers that have changed in the TK API since their last import
+    :param import_run: the ImportRun to record the status of each dossier in
+    :param workers: number of processes that import dossiers in parallel, a single process is used for SQLite
+    :param prefetch_batch_size: number of dossiers of which the TK API data is requested at once
+    """
     logger.info('BEGIN')
     failed_dossiers = []
+    dossiers_changed = {}
+    if only_changed:
+        dossier_ids_str = [Dossier.create_dossier_id(dossier.dossier_id, dossier.dossier_sub_id) for dossier in dossier_ids]
+        dossiers_changed = get_changed_dossiers(dossier_ids_str)
+    n_fetched = 0
+    n_skipped = 0
+    progress = openkamer.journal.ImportProgress(total=len(dossier_ids))
+    dossier_ids_todo = []
     for dossier in dossier_ids:
         dossier_id = Dossier.create_dossier_id(dossier.dossier_id, dossier.dossier_sub_id)
-        logger.info('dossier id: {}'.format(dossier_id))
-        dossiers = Dossier.objects.filter(dossier_id=dossier_id)
-        if skip_existing and dossiers.exists():
-            logger.info('dossier already exists, skip')
+        if skip_existing and Dossier.objects.filter(dossier_id=dossier_id).exists():
+            logger.info('dossier {} already exists, skip'.format(dossier_id))
+        elif only_changed and dossier_id not in dossiers_changed:
+            logger.info('dossier {} has not changed since last import, skip'.format(dossier_id))
+        else:
+            dossier_ids_todo.append(dossier_id)
             continue
-        try:
-            create_dossier_retry_on_error(dossier_id=dossier_id, max_tries=max_tries)
-        except Exception as error:
+        n_skipped += 1
+        if import_run is not None:
+            openkamer.journal.set_done(import_run, dossier_id)
+        progress.step()
+
+    import_function = functools.partial(import_dossier_prefetched, max_tries=max_tries, incremental=incremental)
+    for dossier_id, error, sync_start in import_dossiers_prefetched(import_function, dossier_ids_todo, prefetch_batch_size, workers):
+        if error is None:
+            set_dossier_synced(dossier_id, dossiers_changed.get(dossier_id), sync_start)
+            n_fetched += 1
+        else:
             failed_dossiers.append(dossier_id)
-            logger.exception('error for dossier id: ' + str(dossier_id))
-    logger.info('END')
+        if import_run is not None:
+            if error is None:
+                openkamer.journal.set_done(import_run, dossier_id)
+            else:
+                openkamer.journal.set_failed(import_run, dossier_id, error)
+        progress.step()
+    logger.info('END - dossiers fetched: {}, skipped: {}, failed: {}'.format(n_fetched, n_skipped, len(failed_dossiers)))
     return failed_dossiers
 
 
-def get_tk_besluiten_dossier_main(dossier_id_main, dossier_id_sub=None) -> List[TKBesluit]:
-    tk_besluiten = queries.get_dossier_besluiten(nummer=dossier_id_main, toevoeging=dossier_id_sub)
+def get_tk_besluiten_dossier_main(dossier_id_main, dossier_id_sub=None, tk_data: TKDossierData = None) -> List[TKBesluit]:
+    if tk_data is not None:
+        tk_besluiten = tk_data.get_besluiten()
+    else:
+        tk_besluiten = queries.get_dossier_besluiten(nummer=dossier_id_main, toevoeging=dossier_id_sub)
     besluiten_dossier = []
     # only get main dossier besluiten; ignore kamerstuk besluiten (motie, amendement, etc)
     for tk_besluit in tk_besluiten:
@@ -238,8 +591,8 @@ def get_tk_besluiten_dossier_main(dossier_id_main, dossier_id_sub=None) -> List[
     return besluiten_dossier
 
 
-def get_besluit_last(dossier_id_main, dossier_id_sub=None, filter_has_votings=False) -> TKBesluit:
-    tk_besluiten = get_tk_besluiten_dossier_main(dossier_id_main=dossier_id_main, dossier_id_sub=dossier_id_sub)
+def get_besluit_last(dossier_id_main, dossier_id_sub=None, filter_has_votings=False, tk_data: TKDossierData = None) -> TKBesluit:
+    tk_besluiten = get_tk_besluiten_dossier_main(dossier_id_main=dossier_id_main, dossier_id_sub=dossier_id_sub, tk_data=tk_data)
     last_besluit = None
     for tk_besluit in tk_besluiten:
         if filter_has_votings and not tk_besluit.stemmingen:
@@ -252,8 +605,8 @@ def get_besluit_last(dossier_id_main, dossier_id_sub=None, filter_has_votings=Fa
     return last_besluit
 
 
-def get_besluit_last_with_voting(dossier_id_main, dossier_id_sub=None) -> TKBesluit:
-    return get_besluit_last(dossier_id_main=dossier_id_main, dossier_id_sub=dossier_id_sub, filter_has_votings=True)
+def get_besluit_last_with_voting(dossier_id_main, dossier_id_sub=None, tk_data: TKDossierData = None) -> TKBesluit:
+    return get_besluit_last(dossier_id_main=dossier_id_main, dossier_id_sub=dossier_id_sub, filter_has_votings=True, tk_data=tk_data)
 
 
 def get_zaken_dossier_main(dossier_id_main, dossier_id_sub=None) -> List[Zaak]:
@@ -7,36 +7,60 @@ from tkapi import TKApi
 from tkapi.persoon import PersoonGeschenk
 
 from person.models import Person
+from parliament.models import MembershipsAtDate
 from gift.models import Gift, PersonPosition
 
+from openkamer.update import UpdateSummary
+from openkamer.update import get_or_create_person_positions
+from openkamer.update import upsert_by_tk_id
+
 logger = logging.getLogger(__name__)
 
 
+MIN_EXPECTED_GIFTS = 1000
+
+
 @transaction.atomic
 def create_gifts(max_items=None):
-    gifts = TKApi.get_items(PersoonGeschenk, max_items=max_items)
-    logger.info('{} gifts found.'.format(len(gifts)))
-    if len(gifts) < 1000:
-        logger.error('Only {} gifts found. This is unexpected. Skip re-creating gifts.'.format(len(gifts)))
-    Gift.objects.all().delete()
-    PersonPosition.objects.all().delete()
-    for gift in gifts:
-        value = find_gift_value(gift.omschrijving)
-        gift_type = find_gift_type(gift.omschrijving)
-        person = Person.find_surname_initials(gift.persoon.achternaam, gift.persoon.initialen)
+    """
+    Creates, updates and deletes gifts to match the gifts of the TK API, by TK id.
+    Unchanged gifts are not written. Gifts are only deleted for a complete import.
+    """
+    logger.info('BEGIN')
+    summary = UpdateSummary('gifts')
+    tk_gifts = TKApi.get_items(PersoonGeschenk, max_items=max_items)
+    logger.info('{} gifts found.'.format(len(tk_gifts)))
+    delete_missing = max_items is None and len(tk_gifts) >= MIN_EXPECTED_GIFTS
+    if max_items is None and not delete_missing:
+        logger.error('Only {} gifts found. This is unexpected. Skip deleting gifts.'.format(len(tk_gifts)))
+    date_field = Gift._meta.get_field('date')
+    items = {}
+    for tk_gift in tk_gifts:
+        person = Person.find_surname_initials(tk_gift.persoon.achternaam, tk_gift.persoon.initialen)
         if person is None:
-            logger.warning('No person found for gift: {}'.format(gift.id))
+            logger.warning('No person found for gift: {}'.format(tk_gift.id))
             continue
-        if gift.datum is None:
-            logger.warning('No date found for gift: {}'.format(gift.id))
+        if tk_gift.datum is None:
+            logger.warning('No date found for gift: {}'.format(tk_gift.id))
             continue
-        Gift.objects.create(
-            person=person,
-            value_euro=value,
-            description=gift.omschrijving,
-            date=gift.datum,
-            type=gift_type,
-        )
+        items[tk_gift.id] = {
+            'person_id': person.id,
+            'value_euro': find_gift_value(tk_gift.omschrijving),
+            'description': tk_gift.omschrijving,
+            'date': date_field.to_python(tk_gift.datum),
+            'type': find_gift_type(tk_gift.omschrijving),
+        }
+    positions = get_or_create_person_positions(
+        PersonPosition, [(item['person_id'], item['date']) for item in items.values()], MembershipsAtDate(), summary
+    )
+    for item in items.values():
+        item['person_position_id'] = positions[(item['person_id'], item['date'])]
+    upsert_by_tk_id(Gift, items, summary, delete_missing=delete_missing, legacy_fields=('person_id', 'date', 'description'))
+    if delete_missing:
+        PersonPosition.objects.filter(gift__isnull=True).delete()
+    logger.info(summary)
+    logger.info('END')
+    return summary
 
 
 def find_gift_value(text):
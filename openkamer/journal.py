@@ -0,0 +1,82 @@
+import logging
+import time
+from typing import List
+
+from django.db.models import F
+from django.utils import timezone
+
+from openkamer.models import ImportJournalEntry
+from openkamer.models import ImportRun
+
+logger = logging.getLogger(__name__)
+
+
+class ImportProgress(object):
+    """ Logs the progress, throughput (dossiers/min) and estimated time remaining of an import """
+
+    def __init__(self, total):
+        self.total = total
+        self.processed = 0
+        self.time_start = time.time()
+
+    @property
+    def rate_per_minute(self):
+        minutes = (time.time() - self.time_start) / 60.0
+        if minutes <= 0:
+            return 0.0
+        return self.processed / minutes
+
+    @property
+    def minutes_remaining(self):
+        rate = self.rate_per_minute
+        if rate <= 0:
+            return None
+        return (self.total - self.processed) / rate
+
+    def step(self):
+        self.processed += 1
+        minutes_remaining = self.minutes_remaining
+        logger.info('progress: {}/{} ({:.1f}%) | {:.1f} dossiers/min | remaining: {}'.format(
+            self.processed,
+            self.total,
+            100.0 * self.processed / self.total if self.total else 100.0,
+            self.rate_per_minute,
+            '{:.0f} min'.format(minutes_remaining) if minutes_remaining is not None else 'unknown'
+        ))
+
+
+def start_run(name, dossier_ids: List[str]) -> ImportRun:
+    run = ImportRun.objects.create(name=name)
+    ImportJournalEntry.objects.bulk_create(
+        [ImportJournalEntry(run=run, dossier_id=dossier_id) for dossier_id in dossier_ids],
+        batch_size=500
+    )
+    logger.info('import run {} started with {} dossiers'.format(run.id, len(dossier_ids)))
+    return run
+
+
+def get_resumable_run(name) -> ImportRun or None:
+    """ returns the last run with the given name if it has dossiers that are not done, otherwise None """
+    run = ImportRun.get_last(name)
+    if run is None or not run.get_todo_dossier_ids():
+        return None
+    logger.info('resume import run {}: {}'.format(run.id, run.get_status_counts()))
+    return run
+
+
+def set_done(run: ImportRun, dossier_id):
+    ImportJournalEntry.objects.filter(run=run, dossier_id=dossier_id).update(
+        status=ImportJournalEntry.DONE, error='', tries=F('tries') + 1, date_updated=timezone.now()
+    )
+
+
+def set_failed(run: ImportRun, dossier_id, error):
+    ImportJournalEntry.objects.filter(run=run, dossier_id=dossier_id).update(
+        status=ImportJournalEntry.FAILED, error=str(error), tries=F('tries') + 1, date_updated=timezone.now()
+    )
+
+
+def finish_run(run: ImportRun):
+    run.date_finished = timezone.now()
+    run.save()
+    logger.info('import run {} finished: {}'.format(run.id, run.get_status_counts()))
@@ -1,6 +1,10 @@
+import asyncio
+import concurrent.futures
 import logging
+import queue
 import re
-import lxml
+import threading
+import lxml.html
 import datetime
 from typing import List
 
@@ -23,20 +27,35 @@ from document.models import FootNote
 from document.models import Submitter
 
 from openkamer.document import DocumentFactory
-from openkamer.document import SubmitterFactory
+from openkamer.document import SubmitterBuilder
+from openkamer.settings import KAMERVRAAG_FETCH_CONCURRENCY
+from openkamer.settings import KAMERVRAAG_WRITE_BATCH_SIZE
 
 logger = logging.getLogger(__name__)
 
 
-def create_kamervragen(year, max_n=None, skip_if_exists=False):
+KAMERVRAAG_DOCUMENT_SOORTEN = (
+    DocumentSoort.SCHRIFTELIJKE_VRAGEN,
+    DocumentSoort.ANTWOORD_SCHRIFTELIJKE_VRAGEN,
+    DocumentSoort.MEDEDELING_UITSTEL_ANTWOORD,
+)
+
+
+def create_kamervragen(year, max_n=None, skip_if_exists=False, concurrency=KAMERVRAAG_FETCH_CONCURRENCY):
     logger.info('BEGIN')
     year = int(year)
     month = 1
     begin_datetime = datetime.datetime(year=year, month=month, day=1)
     end_datetime = datetime.datetime(year=year+1, month=month, day=1)
     tk_zaken = get_tk_kamervraag_zaken(begin_datetime, end_datetime)
+    if max_n:
+        tk_zaken = tk_zaken[:max_n]
+
+    if concurrency > 1:
+        kamervragen, kamerantwoorden = create_for_zaken_pipeline(tk_zaken, skip_if_exists, concurrency=concurrency)
+        logger.info('END')
+        return kamervragen, kamerantwoorden
 
-    counter = 1
     kamervragen = []
     kamerantwoorden = []
     for tk_zaak in tk_zaken:
@@ -47,30 +66,167 @@ def create_kamervragen(year, max_n=None, skip_if_exists=False):
         except Exception as error:
             logger.error('error for kamervraag zaak nummber: {}'.format(tk_zaak.nummer))
             logger.exception(error)
-        if max_n and counter >= max_n:
-            return kamervragen, kamerantwoorden
-        counter += 1
     logger.info('END')
     return kamervragen, kamerantwoorden
 
 
+class ZaakPayload(object):
+    """
+    The downloaded data of a kamervraag zaak, produced by the fetch stage and consumed by the writer stage.
+    documents_content maps a TK document id to its (overheidnl_document_id, document_content) tuple.
+    """
+
+    def __init__(self, tk_zaak: tkapi.zaak.Zaak, documents_content=None, error=None):
+        self.tk_zaak = tk_zaak
+        self.documents_content = documents_content if documents_content is not None else {}
+        self.error = error
+
+
+def prefetch_zaak(tk_zaak: tkapi.zaak.Zaak) -> List[TKDocument]:
+    """
+    Requests the TK API items that are needed to create the kamervraag documents of the zaak.
+    The tkapi caches related items, the writer stage does not have to request them again.
+    """
+    tk_documents = [tk_doc for tk_doc in tk_zaak.documenten if tk_doc.soort in KAMERVRAAG_DOCUMENT_SOORTEN]
+    for tk_doc in tk_documents:
+        for zaak in tk_doc.zaken:
+            for actor in zaak.actors:
+                actor.persoon
+        for actor in tk_doc.actors:
+            actor.persoon
+    return tk_documents
+
+
+def fetch_document(tk_document: TKDocument, skip_overheidnl_document_ids):
+    overheid_id = get_overheidnl_id(tk_document)
+    if overheid_id in skip_overheidnl_document_ids:
+        return overheid_id, None
+    return overheid_id, DocumentFactory.fetch_document_content(overheid_id)
+
+
+async def fetch_zaken(tk_zaken, output_queue: queue.Queue, concurrency, skip_overheidnl_document_ids):
+    """
+    Downloads the documents of all zaken, with at most concurrency requests at the same time, and puts a ZaakPayload per zaak
+    in the output queue. The tkapi and scrapers are blocking, requests are done in a thread pool.
+    A fixed number of fetchers take the next zaak only after the payload of their previous zaak is in the queue,
+    at most concurrency zaken are in flight, downloads wait if the writer is behind.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    async def run_blocking(function, *args):
+        async with semaphore:
+            return await loop.run_in_executor(executor, function, *args)
+
+    async def fetch_zaak(tk_zaak):
+        try:
+            tk_documents = await run_blocking(prefetch_zaak, tk_zaak)
+            results = await asyncio.gather(
+                *[run_blocking(fetch_document, tk_doc, skip_overheidnl_document_ids) for tk_doc in tk_documents]
+            )
+            payload = ZaakPayload(tk_zaak, {tk_doc.id: result for tk_doc, result in zip(tk_documents, results)})
+        except Exception as error:
+            logger.error('error while fetching kamervraag zaak nummer: {}'.format(tk_zaak.nummer))
+            logger.exception(error)
+            payload = ZaakPayload(tk_zaak, error=error)
+        await loop.run_in_executor(None, output_queue.put, payload)  # blocks if the writer is behind
+
+    zaken = iter(tk_zaken)
+
+    async def fetch_next_zaken():
+        for tk_zaak in zaken:  # shared by the fetchers, each zaak is taken once
+            await fetch_zaak(tk_zaak)
+
+    try:
+        await asyncio.gather(*[fetch_next_zaken() for i in range(max(1, concurrency))])
+    finally:
+        executor.shutdown(wait=True)
+
+
+def get_existing_overheidnl_document_ids():
+    return set(Kamervraag.objects.values_list('document__document_id', flat=True)) | \
+        set(Kamerantwoord.objects.values_list('document__document_id', flat=True))
+
+
+def create_for_zaken_pipeline(tk_zaken, skip_if_exists=False, concurrency=KAMERVRAAG_FETCH_CONCURRENCY, batch_size=KAMERVRAAG_WRITE_BATCH_SIZE):
+    """
+    Creates the kamervragen of the given zaken in two stages.
+    The fetch stage downloads the documents of many zaken concurrently in a separate thread.
+    The calling thread writes to the database in batches of zaken, each batch in a single transaction.
+    A zaak that fails in either stage is logged and skipped.
+    """
+    logger.info('BEGIN - {} zaken, concurrency: {}'.format(len(tk_zaken), concurrency))
+    output_queue = queue.Queue(maxsize=batch_size * 2)
+    skip_overheidnl_document_ids = get_existing_overheidnl_document_ids() if skip_if_exists else set()
+
+    def produce():
+        try:
+            asyncio.run(fetch_zaken(tk_zaken, output_queue, concurrency, skip_overheidnl_document_ids))
+        finally:
+            output_queue.put(None)
+
+    producer = threading.Thread(target=produce, name='kamervraag-fetch', daemon=True)
+    producer.start()
+
+    kamervragen = []
+    kamerantwoorden = []
+    finished = False
+    while not finished:
+        batch = []
+        while len(batch) < batch_size:
+            payload = output_queue.get()
+            if payload is None:
+                finished = True
+                break
+            batch.append(payload)
+        for kamervraag, kamerantwoord in write_payloads(batch, skip_if_exists):
+            kamervragen.append(kamervraag)
+            kamerantwoorden.append(kamerantwoord)
+    producer.join()
+    logger.info('END - {} kamervragen'.format(len(kamervragen)))
+    return kamervragen, kamerantwoorden
+
+
+@transaction.atomic
+def write_payloads(payloads: List[ZaakPayload], skip_if_exists=False):
+    results = []
+    for payload in payloads:
+        if payload.error is not None:
+            continue
+        try:
+            results.append(create_for_zaak(payload.tk_zaak, skip_if_exists, documents_content=payload.documents_content))
+        except Exception as error:
+            logger.error('error for kamervraag zaak nummber: {}'.format(payload.tk_zaak.nummer))
+            logger.exception(error)
+    return results
+
+
 @transaction.atomic
-def create_for_zaak(tk_zaak: tkapi.zaak.Zaak, skip_if_exists=False):
+def create_for_zaak(tk_zaak: tkapi.zaak.Zaak, skip_if_exists=False, documents_content=None):
+    """
+    :param documents_content: the downloaded (overheidnl_document_id, document_content) per TK document id,
+        documents that are not in it are downloaded
+    """
     logger.info('BEGIN: {}'.format(tk_zaak.nummer))
     kamervraag = None
     kamerantwoord = None
     mededelingen = []
+    documents_content = documents_content if documents_content is not None else {}
 
     for tk_doc in tk_zaak.documenten:
+        if tk_doc.soort not in KAMERVRAAG_DOCUMENT_SOORTEN:
+            continue
+        if tk_doc.id in documents_content:
+            overheid_id, document_content = documents_content[tk_doc.id]
+        else:
+            overheid_id, document_content = get_overheidnl_id(tk_doc), None
         if tk_doc.soort == DocumentSoort.SCHRIFTELIJKE_VRAGEN:
-            overheid_id = get_overheidnl_id(tk_doc)
-            kamervraag = create_kamervraag(tk_doc, overheid_id, skip_if_exists=skip_if_exists)
+            kamervraag = create_kamervraag(tk_doc, overheid_id, skip_if_exists=skip_if_exists, document_content=document_content)
         elif tk_doc.soort == DocumentSoort.ANTWOORD_SCHRIFTELIJKE_VRAGEN:
-            overheid_id = get_overheidnl_id(tk_doc)
-            kamerantwoord = create_kamerantwoord(tk_doc, overheid_id, skip_if_exists=skip_if_exists)
+            kamerantwoord = create_kamerantwoord(tk_doc, overheid_id, skip_if_exists=skip_if_exists, document_content=document_content)
         elif tk_doc.soort == DocumentSoort.MEDEDELING_UITSTEL_ANTWOORD:
-            overheid_id = get_overheidnl_id(tk_doc)
-            mededeling = create_mededeling(tk_doc, overheid_id)
+            mededeling = create_mededeling(tk_doc, overheid_id, document_content=document_content)
             mededelingen.append(mededeling)
 
     if kamerantwoord:
@@ -105,12 +261,13 @@ def get_or_create_kamervraag(vraagnummer, document: Document, tk_document: TKDoc
     return kamervraag
 
 
-def create_kamervraag_receivers(document: Document, tk_document: TKDocument) -> Submitter or None:
+def create_kamervraag_receivers(document: Document, tk_document: TKDocument):
+    submitter_builder = SubmitterBuilder()
+    submitter_builder.add_key(document, Submitter.RECEIVER)
     for actor in tk_document.zaken[0].actors:
         if actor.relatie == tkapi.zaak.ZaakActorRelatieSoort.GERICHT_AAN and actor.persoon is not None:
-            SubmitterFactory.create_submitter(
-                document, tk_person=actor.persoon, name=actor.naam, submitter_type=Submitter.RECEIVER
-            )
+            submitter_builder.add(document, tk_person=actor.persoon, name=actor.naam, submitter_type=Submitter.RECEIVER)
+    submitter_builder.write()
 
 
 def get_or_create_kamerantwoord(vraagnummer, document):
@@ -127,14 +284,16 @@ def get_or_create_kamerantwoord(vraagnummer, document):
 
 
 @transaction.atomic
-def create_kamervraag(tk_document: TKDocument, overheidnl_document_id, skip_if_exists=False):
+def create_kamervraag(tk_document: TKDocument, overheidnl_document_id, skip_if_exists=False, document_content=None):
     if skip_if_exists and Kamervraag.objects.filter(document__document_id=overheidnl_document_id).exists():
         return Kamervraag.objects.filter(document__document_id=overheidnl_document_id)[0]
     document_factory = DocumentFactory()
-    document, vraagnummer = document_factory.create_kamervraag_document(tk_document, overheidnl_document_id)
-    kamervraag = get_or_create_kamervraag(vraagnummer, document, tk_document)
-    create_vragen_from_kamervraag_html(kamervraag)
-    footnotes = create_footnotes(kamervraag.document.content_html)
+    document, document_data = document_factory.create_kamervraag_document_data(
+        tk_document, overheidnl_document_id, document_content=document_content
+    )
+    kamervraag = get_or_create_kamervraag(document_data._metadata['vraagnummer'], document, tk_document)
+    create_vragen_from_kamervraag_html(kamervraag, tree=document_data.content.tree)
+    footnotes = create_footnotes_from_tree(document_data.content.tree) if document_data.content.tree is not None else []
     FootNote.objects.filter(document=document).delete()
     for footnote in footnotes:
         FootNote.objects.create(document=document, nr=footnote['nr'], text=footnote['text'], url=footnote['url'])
@@ -142,67 +301,97 @@ def create_kamervraag(tk_document: TKDocument, overheidnl_document_id, skip_if_e
 
 
 @transaction.atomic
-def create_kamerantwoord(tk_document: TKDocument, overheidnl_document_id, skip_if_exists=False):
+def create_kamerantwoord(tk_document: TKDocument, overheidnl_document_id, skip_if_exists=False, document_content=None):
     if skip_if_exists and Kamerantwoord.objects.filter(document__document_id=overheidnl_document_id).exists():
         return Kamerantwoord.objects.filter(document__document_id=overheidnl_document_id)[0]
     document_factory = DocumentFactory()
-    document, vraagnummer = document_factory.create_kamervraag_document(tk_document, overheidnl_document_id)
-    kamerantwoord = get_or_create_kamerantwoord(vraagnummer, document)
-    create_antwoorden_from_antwoord_html(kamerantwoord)
+    document, document_data = document_factory.create_kamervraag_document_data(
+        tk_document, overheidnl_document_id, document_content=document_content
+    )
+    kamerantwoord = get_or_create_kamerantwoord(document_data._metadata['vraagnummer'], document)
+    create_antwoorden_from_antwoord_html(kamerantwoord, tree=document_data.content.tree)
     return kamerantwoord
 
 
 @transaction.atomic
-def create_mededeling(tk_document: TKDocument, overheidnl_document_id):
+def create_mededeling(tk_document: TKDocument, overheidnl_document_id, document_content=None):
     document_factory = DocumentFactory()
-    document, vraagnummer = document_factory.create_kamervraag_document(tk_document, overheidnl_document_id)
+    document, document_data = document_factory.create_kamervraag_document_data(
+        tk_document, overheidnl_document_id, document_content=document_content
+    )
+    vraagnummer = document_data._metadata['vraagnummer']
     KamervraagMededeling.objects.filter(vraagnummer=vraagnummer).delete()
     mededeling = KamervraagMededeling.objects.create(document=document, vraagnummer=vraagnummer)
-    create_kamervraag_mededeling_from_html(mededeling)
+    create_kamervraag_mededeling_from_html(mededeling, tree=document_data.content.tree)
     return mededeling
 
 
 @transaction.atomic
-def create_vragen_from_kamervraag_html(kamervraag):
+def create_vragen_from_kamervraag_html(kamervraag, tree=None):
+    """ :param tree: the parsed document content, parsed from the stored document content if not given """
     logger.info('BEGIN')
     Vraag.objects.filter(kamervraag=kamervraag).delete()
-    tree = lxml.html.fromstring(kamervraag.document.content_html)
+    if tree is None:
+        tree = lxml.html.fromstring(kamervraag.document.content_html)
+    vragen_texts = get_vragen_texts(tree, kamervraag.document.document_url)
+    for counter, vraag_text in enumerate(vragen_texts, start=1):
+        Vraag.objects.create(nr=counter, kamervraag=kamervraag, text=vraag_text)
+    logger.info('END: ' + str(len(vragen_texts)) + ' vragen found')
+
+
+def get_vragen_texts(tree, document_url=''):
+    vragen_texts = []
     elements = tree.xpath('//div[@class="vraag"]')
     counter = 1
     for element in elements:
         vraag_text = ''
         for paragraph in element.iter('p'):
             if paragraph.text is None or paragraph.text == '':
-                logger.warning('empty vraag text found for antwoord ' + str(kamervraag.document.document_url) + 'vraag nr: ' + str(counter))
+                logger.warning('empty vraag text found for antwoord ' + str(document_url) + 'vraag nr: ' + str(counter))
             else:
                 vraag_text += paragraph.text_content() + '\n'
         vraag_text = re.sub('\s{2,}', ' ', vraag_text).strip()
-        Vraag.objects.create(nr=counter, kamervraag=kamervraag, text=vraag_text)
+        vragen_texts.append(vraag_text)
         counter += 1
-    logger.info('END: ' + str(counter) + ' vragen found')
+    return vragen_texts
 
 
 @transaction.atomic
-def create_kamervraag_mededeling_from_html(mededeling):
-    tree = lxml.html.fromstring(mededeling.document.content_html)
+def create_kamervraag_mededeling_from_html(mededeling, tree=None):
+    if tree is None:
+        tree = lxml.html.fromstring(mededeling.document.content_html)
+    mededeling.text = get_mededeling_text(tree, mededeling.document.document_url)
+    mededeling.save()
+    logger.info('END')
+
+
+def get_mededeling_text(tree, document_url=''):
     elements = tree.xpath('//div[@class="kamervraagopmerking"]')
     text = ''
     for paragraph in elements[0].iter('p'):
         if paragraph.text is None or paragraph.text == '':
-            logger.warning('empty mededeling text found for antwoord ' + str(mededeling.document.document_url))
+            logger.warning('empty mededeling text found for antwoord ' + str(document_url))
         else:
             text += re.sub('\s{2,}', ' ', paragraph.text_content()).strip()
             text += '\n'
-    mededeling.text = text
-    mededeling.save()
-    logger.info('END')
+    return text
 
 
 @transaction.atomic
-def create_antwoorden_from_antwoord_html(kamerantwoord):
+def create_antwoorden_from_antwoord_html(kamerantwoord, tree=None):
     logger.info('BEGIN')
     Antwoord.objects.filter(kamerantwoord=kamerantwoord).delete()
-    tree = lxml.html.fromstring(kamerantwoord.document.content_html)
+    if tree is None:
+        tree = lxml.html.fromstring(kamerantwoord.document.content_html)
+    for antwoord in get_antwoorden(tree, kamerantwoord.document.document_url):
+        Antwoord.objects.create(
+            nr=antwoord['nr'], kamerantwoord=kamerantwoord, text=antwoord['text'], see_answer_nr=antwoord['see_answer_nr']
+        )
+    logger.info('END')
+
+
+def get_antwoorden(tree, document_url=''):
+    """ returns a list of dicts with the nr, text and see_answer_nr of the antwoorden """
     elements = tree.xpath('//div[@class="antwoord"]')
     counter = 1
     antwoorden = []
@@ -219,7 +408,7 @@ def create_antwoorden_from_antwoord_html(kamerantwoord):
         vraag_numbers = vraag_numbers.replace('en', ',').replace(' ', '').split(',')
         for paragraph in element.iter('p'):
             if paragraph.text is None or paragraph.text == '':
-                logger.warning('empty vraag text found for antwoord ' + str(kamerantwoord.document.document_url) + ' antwoord nr: ' + str(counter))
+                logger.warning('empty vraag text found for antwoord ' + str(document_url) + ' antwoord nr: ' + str(counter))
             else:
                 answer_text += re.sub('\s{2,}', ' ', paragraph.text_content()).strip()
                 answer_text += '\n'
@@ -231,20 +420,22 @@ def create_antwoorden_from_antwoord_html(kamerantwoord):
                 number = int(number)
             except ValueError:
                 logger.info(vraag_numbers)
-                logger.error('could not convert antwoord number to integer: ' + number + ' for document: ' + str(kamerantwoord.document.document_url))
+                logger.error('could not convert antwoord number to integer: ' + number + ' for document: ' + str(document_url))
                 continue
             if counter > 0:
                 answer_text = 'Zie antwoord vraag ' + str(vraag_numbers[0] + '.')
                 see_answer_nr = first_number
-            antwoord = Antwoord.objects.create(nr=number, kamerantwoord=kamerantwoord, text=answer_text, see_answer_nr=see_answer_nr)
-            antwoorden.append(antwoord)
+            antwoorden.append({'nr': number, 'text': answer_text, 'see_answer_nr': see_answer_nr})
             counter += 1
-    logger.info('END')
+    return antwoorden
 
 
 def create_footnotes(footnotes_html):
+    return create_footnotes_from_tree(lxml.html.fromstring(footnotes_html))
+
+
+def create_footnotes_from_tree(tree):
     footnotes = []
-    tree = lxml.html.fromstring(footnotes_html)
     elements = tree.xpath('//div[contains(@class, "voet noot")]')
     for element in elements:
         text = element.xpath('p')[0].text_content()
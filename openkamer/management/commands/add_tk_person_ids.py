@@ -4,14 +4,22 @@ from django.core.management.base import BaseCommand
 
 from person.models import Person
 from openkamer.parliament import add_tk_person_id
+from openkamer.parliament import TKPersonSnapshot
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--snapshot', action='store_true',
+            help='Download all TK persons once and match in memory, instead of TK API queries per person.'
+        )
+
     def handle(self, *args, **options):
+        snapshot = TKPersonSnapshot.download() if options['snapshot'] else None
         for person in Person.objects.all():
-            person = add_tk_person_id(person)
+            person = add_tk_person_id(person, snapshot)
             if not person.tk_id:
                 print('NOT FOUND FOR : {} ({})'.format(person.surname, person.initials))
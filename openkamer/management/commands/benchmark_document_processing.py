@@ -0,0 +1,81 @@
+import time
+
+import lxml.html
+
+from django.core.management.base import BaseCommand
+
+from document.models import DocumentContent
+from document.models import Kamerantwoord
+from document.models import Kamervraag
+from document.models import KamervraagMededeling
+
+import openkamer.kamervraag
+from openkamer.document import DocumentHtml
+from openkamer.document import LinkTargets
+from openkamer.document import update_document_html_links
+
+VRAAG = 'vraag'
+ANTWOORD = 'antwoord'
+MEDEDELING = 'mededeling'
+
+
+def process_parse_per_step(content_html, kind, link_targets):
+    """ the html is parsed (and serialized) again for each processing step """
+    content_html = update_document_html_links(content_html, link_targets)
+    if kind == VRAAG:
+        openkamer.kamervraag.get_vragen_texts(lxml.html.fromstring(content_html))
+        openkamer.kamervraag.create_footnotes(content_html)
+    elif kind == ANTWOORD:
+        openkamer.kamervraag.get_antwoorden(lxml.html.fromstring(content_html))
+    elif kind == MEDEDELING:
+        openkamer.kamervraag.get_mededeling_text(lxml.html.fromstring(content_html))
+    return content_html
+
+
+def process_single_parse(content_html, kind, link_targets):
+    """ the html is parsed once, all processing steps use the same tree, serialized once """
+    content = DocumentHtml.from_html(content_html)
+    content.update_links(link_targets)
+    if kind == VRAAG:
+        openkamer.kamervraag.get_vragen_texts(content.tree)
+        openkamer.kamervraag.create_footnotes_from_tree(content.tree)
+    elif kind == ANTWOORD:
+        openkamer.kamervraag.get_antwoorden(content.tree)
+    elif kind == MEDEDELING:
+        openkamer.kamervraag.get_mededeling_text(content.tree)
+    return content.html
+
+
+class Command(BaseCommand):
+    """Measure the throughput of kamervraag document processing, over the stored kamervraag, antwoord and mededeling html"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max', type=int, help='The maximum number of documents per document type.', default=500)
+        parser.add_argument('--repeat', type=int, help='The number of times the corpus is processed.', default=3)
+
+    def handle(self, *args, **options):
+        corpus = self.get_corpus(options['max'])
+        size = sum(len(content_html) for content_html, kind in corpus) * options['repeat']
+        self.stdout.write('corpus: {} documents, {:.1f} MB html'.format(len(corpus), size / options['repeat'] / (1024 * 1024)))
+        if not corpus:
+            return
+        link_targets = LinkTargets.load_all()
+        for name, process in (('parse per step', process_parse_per_step), ('single parse', process_single_parse)):
+            time_start = time.perf_counter()
+            for i in range(options['repeat']):
+                for content_html, kind in corpus:
+                    process(content_html, kind, link_targets)
+            duration = time.perf_counter() - time_start
+            self.stdout.write('{}: {:.1f} documents/second, {:.2f} MB/second'.format(
+                name, len(corpus) * options['repeat'] / duration, size / duration / (1024 * 1024)
+            ))
+
+    @staticmethod
+    def get_corpus(max_n):
+        """ returns a list of (content_html, kind) tuples """
+        corpus = []
+        for model, kind in ((Kamervraag, VRAAG), (Kamerantwoord, ANTWOORD), (KamervraagMededeling, MEDEDELING)):
+            document_ids = model.objects.values_list('document_id', flat=True)
+            contents = DocumentContent.objects.filter(document_id__in=document_ids, size__gt=0)[:max_n]
+            corpus += [(DocumentContent.decompress(content.content_html_zlib), kind) for content in contents]
+        return corpus
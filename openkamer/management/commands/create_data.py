@@ -7,6 +7,7 @@ import stats.models
 import openkamer.dossier
 import openkamer.parliament
 import openkamer.kamervraag
+from openkamer.settings import IMPORT_WORKERS
 
 logger = logging.getLogger(__name__)
 
@@ -23,10 +24,26 @@ class Command(BaseCommand):
             default=False,
             help='Do not create items that already exist.',
         )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help='Continue the last dossier import run, only import dossiers that are not done yet or have failed.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=IMPORT_WORKERS,
+            help='Number of processes that import dossiers in parallel (PostgreSQL only).',
+        )
 
     def handle(self, *args, **options):
         openkamer.parliament.create_parliament_and_government()
-        failed_dossiers = openkamer.dossier.create_wetsvoorstellen_all(options['skip-existing'])
+        failed_dossiers = openkamer.dossier.create_wetsvoorstellen_all(
+            options['skip-existing'], resume=options['resume'], workers=options['workers']
+        )
         if failed_dossiers:
             logger.error('the following dossiers failed: ' + str(failed_dossiers))
         openkamer.kamervraag.create_kamervragen(year=2019)
@@ -1,12 +1,39 @@
+import contextlib
+import time
+
 from django.core.management.base import BaseCommand
 
 import openkamer.parliament
 import openkamer.dossier
 
+import scraper.cassette
+import scraper.session
+
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument('--record', type=str, help='Store all upstream responses in this cassette file.', default=None)
+        parser.add_argument('--replay', type=str, help='Use the responses of this cassette file instead of the upstream services, to run as offline benchmark.', default=None)
+        parser.add_argument('--latency', type=float, help='Seconds added to each replayed response.', default=0.0)
+
     def handle(self, *args, **options):
+        if options['record']:
+            cassette = scraper.cassette.use_cassette(options['record'], scraper.cassette.Cassette.RECORD)
+        elif options['replay']:
+            cassette = scraper.cassette.use_cassette(options['replay'], scraper.cassette.Cassette.REPLAY, options['latency'])
+        else:
+            cassette = contextlib.nullcontext()
+        scraper.session.reset_request_counters()
+        time_start = time.time()
+        with cassette:
+            self.create_demo_data()
+        self.stdout.write('created demo data in {:.1f} seconds'.format(time.time() - time_start))
+        for host, counter in sorted(scraper.session.get_request_counters().items()):
+            self.stdout.write('{} - {}'.format(host, counter))
+
+    @staticmethod
+    def create_demo_data():
         openkamer.parliament.create_parties()
         openkamer.parliament.create_governments()
         openkamer.parliament.create_parliament_members()
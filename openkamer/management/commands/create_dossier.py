@@ -1,16 +1,28 @@
 from django.core.management.base import BaseCommand
 
 from openkamer.dossier import create_or_update_dossier
+from openkamer.dossier import update_dossier
 
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('dossier_id', nargs='+', type=str)
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help='Only create, update or delete what has changed instead of recreating the dossier.',
+        )
 
     def handle(self, *args, **options):
         # dossier_id = 33885
         dossier_id = options['dossier_id'][0]
-        create_or_update_dossier(str(dossier_id))
+        if options['incremental']:
+            summary = update_dossier(str(dossier_id))
+            self.stdout.write(str(summary))
+        else:
+            create_or_update_dossier(str(dossier_id))
 
 
@@ -4,6 +4,7 @@ import logging
 from django.core.management.base import BaseCommand
 
 import openkamer.dossier
+from openkamer.settings import IMPORT_WORKERS
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +20,39 @@ class Command(BaseCommand):
             default=False,
             help='Do not create dossiers that already exist.',
         )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help='Only create, update or delete what has changed instead of recreating the dossiers.',
+        )
+        parser.add_argument(
+            '--only-changed',
+            action='store_true',
+            dest='only-changed',
+            default=False,
+            help='Only import dossiers that have changed in the TK API since their last import.',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help='Continue the last dossier import run, only import dossiers that are not done yet or have failed.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=IMPORT_WORKERS,
+            help='Number of processes that import dossiers in parallel (PostgreSQL only).',
+        )
 
     def handle(self, *args, **options):
-        failed_dossiers = openkamer.dossier.create_wetsvoorstellen_all(options['skip-existing'])
+        failed_dossiers = openkamer.dossier.create_wetsvoorstellen_all(
+            options['skip-existing'], incremental=options['incremental'], only_changed=options['only-changed'],
+            resume=options['resume'], workers=options['workers']
+        )
         if failed_dossiers:
             logger.error('the following dossiers failed: ' + str(failed_dossiers))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 
 import openkamer.kamervraag
+from openkamer.settings import KAMERVRAAG_FETCH_CONCURRENCY
 
 from document.models import Kamervraag
 
@@ -10,8 +11,9 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('year', nargs='+', type=int)
         parser.add_argument('--max', type=int, help='The max number of documents to create, used for testing.', default=None)
+        parser.add_argument('--concurrency', type=int, help='The number of documents to download at the same time.', default=KAMERVRAAG_FETCH_CONCURRENCY)
 
     def handle(self, *args, **options):
         year = options['year'][0]
         max_n = options['max']
-        openkamer.kamervraag.create_kamervragen(year, max_n, skip_if_exists=False)
+        openkamer.kamervraag.create_kamervragen(year, max_n, skip_if_exists=False, concurrency=options['concurrency'])
@@ -3,11 +3,21 @@ import logging
 from django.core.management.base import BaseCommand
 
 import openkamer.parliament
+import openkamer.parliament_swap
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--swap', action='store_true',
+            help='Build the new data first and replace the current data in a short transaction, keeps the links of votes, gifts and travels.'
+        )
+
     def handle(self, *args, **options):
-        openkamer.parliament.create_parliament_and_government(all_members=False)
+        if options['swap']:
+            openkamer.parliament_swap.update_parliament_and_government(all_members=False)
+        else:
+            openkamer.parliament.create_parliament_and_government(all_members=False)
@@ -1,18 +1,16 @@
 from django.core.management.base import BaseCommand
 
-from document.models import Document
-import openkamer.dossier
+import openkamer.document
+from openkamer.settings import IMPORT_WORKERS
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='The number of documents per task.', default=500)
+        parser.add_argument('--workers', type=int, help='The number of processes that update documents in parallel.', default=IMPORT_WORKERS)
+        parser.add_argument('--full', action='store_true', help='Process all documents, not only documents that link to kamerstukken or dossiers created since the previous run.')
+
     def handle(self, *args, **options):
-        documents = Document.objects.all()
-        counter = 0
-        for document in documents:
-            if not document.content_html:
-                continue
-            document.content_html = openkamer.document.update_document_html_links(document.content_html)
-            document.save()
-            counter += 1
-            print(counter)
+        updated = openkamer.document.update_documents_html_links(chunk_size=options['chunk_size'], workers=options['workers'], full=options['full'])
+        self.stdout.write('{} documents updated'.format(updated))
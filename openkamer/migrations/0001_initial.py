@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DossierSyncState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dossier_id', models.CharField(db_index=True, max_length=100, unique=True)),
+                ('upstream_modified', models.DateTimeField(blank=True, null=True)),
+                ('date_checked', models.DateTimeField(blank=True, null=True)),
+                ('date_synced', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openkamer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=200)),
+                ('date_started', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-date_started'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportJournalEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dossier_id', models.CharField(db_index=True, max_length=100)),
+                ('status', models.CharField(choices=[('PEN', 'Pending'), ('DON', 'Done'), ('FAI', 'Failed')], db_index=True, default='PEN', max_length=3)),
+                ('error', models.TextField(blank=True, default='')),
+                ('tries', models.IntegerField(default=0)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='openkamer.ImportRun')),
+            ],
+            options={
+                'unique_together': {('run', 'dossier_id')},
+            },
+        ),
+    ]
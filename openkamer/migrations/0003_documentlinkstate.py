@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openkamer', '0002_importjournalentry_importrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentLinkState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kamerstuk_id_max', models.IntegerField(default=0)),
+                ('dossier_id_max', models.IntegerField(default=0)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,81 @@
+from django.db import models
+
+
+class DossierSyncState(models.Model):
+    """
+    The newest modification time of the TK API entities of a dossier (Kamerstukdossier, Zaak, Document, Besluit, Stemming)
+    that has been imported. Used to skip dossiers that have not changed since the last import.
+    Not related to Dossier with a foreign key, because a full dossier import deletes and recreates the dossier.
+    """
+    dossier_id = models.CharField(max_length=100, unique=True, db_index=True)
+    upstream_modified = models.DateTimeField(blank=True, null=True)
+    date_checked = models.DateTimeField(blank=True, null=True)
+    date_synced = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.dossier_id, self.upstream_modified)
+
+
+class DocumentLinkState(models.Model):
+    """
+    The newest kamerstuk and dossier (by id) that existed at the start of the last update of the links in all documents.
+    The next update only has to process documents with a link to a kamerstuk or dossier that is created after that.
+    """
+    kamerstuk_id_max = models.IntegerField(default=0)
+    dossier_id_max = models.IntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.kamerstuk_id_max, self.dossier_id_max)
+
+
+class ImportRun(models.Model):
+    """ A (bulk) dossier import, with a journal entry per dossier, that can be resumed if it is interrupted """
+    WETSVOORSTELLEN_ALL = 'wetsvoorstellen_all'
+    name = models.CharField(max_length=200, db_index=True)
+    date_started = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-date_started']
+
+    def __str__(self):
+        return '{} - {}'.format(self.name, self.date_started)
+
+    @property
+    def is_finished(self):
+        return self.date_finished is not None
+
+    @staticmethod
+    def get_last(name):
+        return ImportRun.objects.filter(name=name).first()
+
+    def get_todo_dossier_ids(self):
+        """ the dossiers that are not yet imported or have failed """
+        entries = ImportJournalEntry.objects.filter(run=self).exclude(status=ImportJournalEntry.DONE).order_by('id')
+        return list(entries.values_list('dossier_id', flat=True))
+
+    def get_status_counts(self):
+        counts = ImportJournalEntry.objects.filter(run=self).values('status').annotate(count=models.Count('id'))
+        return {item['status']: item['count'] for item in counts}
+
+
+class ImportJournalEntry(models.Model):
+    PENDING = 'PEN'
+    DONE = 'DON'
+    FAILED = 'FAI'
+    CHOICES = (
+        (PENDING, 'Pending'), (DONE, 'Done'), (FAILED, 'Failed')
+    )
+    run = models.ForeignKey(ImportRun, on_delete=models.CASCADE)
+    dossier_id = models.CharField(max_length=100, db_index=True)
+    status = models.CharField(max_length=3, choices=CHOICES, default=PENDING, db_index=True)
+    error = models.TextField(blank=True, default='')
+    tries = models.IntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['run', 'dossier_id']
+
+    def __str__(self):
+        return '{} - {}'.format(self.dossier_id, self.status)
@@ -0,0 +1,84 @@
+import logging
+import multiprocessing
+import os
+
+import fasteners
+
+from django.db import connection
+from django.db import connections
+
+from openkamer.settings import IMPORT_LOCK_DIR
+
+logger = logging.getLogger(__name__)
+
+SHARED_LOOKUP_LOCK_PATH = os.path.join(IMPORT_LOCK_DIR, 'openkamer_shared_lookup.lock')
+
+_is_worker = False
+_shared_lookup_lock = None
+_shared_lookup_lock_held = False
+
+
+def can_run_parallel():
+    """ SQLite does not support concurrent writers """
+    return connection.vendor != 'sqlite'
+
+
+def acquire_shared_lookup_lock():
+    """
+    Call before creating a shared object (party, person, category) in a worker process.
+    Another worker cannot see the new object until the transaction of this worker is committed,
+    so the lock is held until the current task of the worker is finished.
+    There is a single lock for all shared objects to prevent deadlocks.
+    Does nothing outside a worker process.
+    Returns True if the lock is newly acquired, objects created by other workers are visible from then on.
+    """
+    global _shared_lookup_lock_held
+    if not _is_worker or _shared_lookup_lock_held:
+        return False
+    _shared_lookup_lock.acquire()
+    _shared_lookup_lock_held = True
+    return True
+
+
+def release_shared_lookup_lock():
+    global _shared_lookup_lock_held
+    if _shared_lookup_lock_held:
+        _shared_lookup_lock.release()
+        _shared_lookup_lock_held = False
+
+
+def _init_worker():
+    global _is_worker, _shared_lookup_lock
+    _is_worker = True
+    _shared_lookup_lock = fasteners.InterProcessLock(SHARED_LOOKUP_LOCK_PATH)
+    connections.close_all()
+
+
+def _run_task(function_and_item):
+    function, item = function_and_item
+    try:
+        return function(item)
+    finally:
+        release_shared_lookup_lock()
+
+
+def map_unordered(function, items, workers):
+    """
+    Yields function(item) for all items, in the given number of worker processes.
+    Each worker opens its own database connection. Runs in the current process if workers is 1 or the database is SQLite.
+    The function should be a module level function (or partial) that handles its own errors.
+    The items can be a generator, with workers it is consumed by a thread of the pool while the tasks run.
+    """
+    if workers > 1 and not can_run_parallel():
+        logger.warning('{} database does not support parallel writers, using a single process'.format(connection.vendor))
+        workers = 1
+    if workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+    logger.info('running tasks in {} worker processes'.format(workers))
+    connections.close_all()  # a connection must not be shared with forked processes, it is reopened when needed
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes=workers, initializer=_init_worker) as pool:
+        for result in pool.imap_unordered(_run_task, ((function, item) for item in items)):
+            yield result
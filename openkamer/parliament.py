@@ -1,3 +1,4 @@
+import collections
 import logging
 from typing import List
 
@@ -6,10 +7,15 @@ from requests.exceptions import ConnectionError, ConnectTimeout, ChunkedEncoding
 from json.decoder import JSONDecodeError
 
 from django.db import transaction
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Subquery
 
 from wikidata import wikidata
 from wikidata.government import GovernmentMemberData
+from wikidata.parliament import ParliamentData
 import wikidata.government as wikidata_government
+import wikidata.parliament as wikidata_parliament
 
 import tkapi
 from tkapi.fractie import Fractie as TKFractie
@@ -37,6 +43,15 @@ import stats.models
 
 logger = logging.getLogger(__name__)
 
+# Kabinet-Balkenende III : Q1473297
+# Balkenende IV : Q1719725
+# Rutte I : Q168828
+# Rutte II : Q1638648
+# Rutte III : Q42293409
+# Rutte IV : Q110111120
+# Schoof: Q126527270
+GOVERNMENT_IDS = ['Q126527270', 'Q110111120', 'Q42293409', 'Q1638648', 'Q168828', 'Q1719725', 'Q1473297']
+
 
 @transaction.atomic
 def create_parliament_and_government(all_members=False):
@@ -56,15 +71,7 @@ def create_parliament_and_government(all_members=False):
 
 @transaction.atomic
 def create_governments():
-    # Kabinet-Balkenende III : Q1473297
-    # Balkenende IV : Q1719725
-    # Rutte I : Q168828
-    # Rutte II : Q1638648
-    # Rutte III : Q42293409
-    # Rutte IV : Q110111120
-    # Schoof: Q126527270
-    government_ids = ['Q126527270', 'Q110111120', 'Q42293409', 'Q1638648', 'Q168828', 'Q1719725', 'Q1473297']
-    for wikidata_id in government_ids:
+    for wikidata_id in GOVERNMENT_IDS:
         create_government(wikidata_id)
 
 
@@ -166,19 +173,20 @@ def create_party_wikidata(wikidata_id):
 
 
 @transaction.atomic
-def create_party_members_for_person(person: Person):
+def create_party_members_for_person(person: Person, parliament_data: ParliamentData = None):
     logger.info('BEGIN - person: {}'.format(person))
     if not person.wikidata_id:
         logger.warning('could not update party member for person: {} because person has no wikidata id.'.format(person))
         return
-    wikidata_person_item = wikidata.WikidataItem(person.wikidata_id)
-    memberships = wikidata_person_item.get_political_party_memberships()
+    if parliament_data and parliament_data.has_person(person.wikidata_id):
+        memberships = parliament_data.memberships.get(person.wikidata_id, [])
+    else:
+        memberships = wikidata.WikidataItem(person.wikidata_id).get_political_party_memberships()
     PartyMember.objects.filter(person=person).delete()
     for membership in memberships:
-        wikidata_party = wikidata.WikidataItem(membership['party_wikidata_id'])
-        if wikidata_party.is_local_party or wikidata_party.is_youth_party:
+        if is_local_or_youth_party(membership['party_wikidata_id'], parliament_data):
             continue
-        parties = PoliticalParty.objects.filter(wikidata_id=wikidata_party.id)
+        parties = PoliticalParty.objects.filter(wikidata_id=membership['party_wikidata_id'])
         if parties.exists():
             party = parties[0]
         else:
@@ -192,20 +200,36 @@ def create_party_members_for_person(person: Person):
     logger.info('END')
 
 
+def is_local_or_youth_party(party_wikidata_id, parliament_data: ParliamentData = None):
+    if parliament_data and party_wikidata_id in parliament_data.parties:
+        party = parliament_data.parties[party_wikidata_id]
+    else:
+        party = wikidata.WikidataItem(party_wikidata_id)
+    return party.is_local_party or party.is_youth_party
+
+
 @transaction.atomic
 def create_parliament_members(max_results=None, all_members=False, update_votes=True):
+    """
+    Creates the parliament members and their party memberships from a bulk SPARQL load of all positions and memberships,
+    only the entities of persons that are new are requested.
+    """
     logger.info('BEGIN')
     parliament = Parliament.get_or_create_tweede_kamer()
-    if all_members:
-        member_wikidata_ids = wikidata.search_parliament_member_ids()
-    else:
-        member_wikidata_ids = wikidata.search_parliament_member_ids_with_start_date()
+    parliament_data = wikidata_parliament.load_parliament_data()
+    member_wikidata_ids = parliament_data.get_member_ids(with_start_date=not all_members)
+    member_wikidata_ids = member_wikidata_ids[:max_results] if max_results else member_wikidata_ids
+    existing_ids = set(Person.objects.filter(wikidata_id__in=member_wikidata_ids).values_list('wikidata_id', flat=True))
+    try:
+        wikidata.WikidataItem.prefetch([wikidata_id for wikidata_id in member_wikidata_ids if wikidata_id not in existing_ids])
+    except (JSONDecodeError, ConnectionError, ConnectTimeout, ChunkedEncodingError) as error:
+        logger.exception(error)  # the items that are not prefetched are requested one by one
     counter = 0
     members = []
     for person_wikidata_id in member_wikidata_ids:
         logger.info('=========================')
         try:
-            members += create_parliament_member_from_wikidata_id(parliament, person_wikidata_id)
+            members += create_parliament_member_from_wikidata_id(parliament, person_wikidata_id, parliament_data)
         except (JSONDecodeError, ConnectionError, ConnectTimeout, ChunkedEncodingError) as error:
             logger.exception(error)
         except Exception as error:
@@ -221,11 +245,13 @@ def create_parliament_members(max_results=None, all_members=False, update_votes=
     return members
 
 
-def create_parliament_member_from_wikidata_id(parliament, person_wikidata_id):
-    wikidata_item = wikidata.WikidataItem(person_wikidata_id)
-    person = get_or_create_person(person_wikidata_id, wikidata_item=wikidata_item, add_initials=True)
+def create_parliament_member_from_wikidata_id(parliament, person_wikidata_id, parliament_data: ParliamentData = None):
+    person = get_or_create_person(person_wikidata_id, add_initials=True, parliament_data=parliament_data)
     logger.info(person)
-    positions = wikidata_item.get_parliament_positions_held()
+    if parliament_data and parliament_data.has_person(person_wikidata_id):
+        positions = parliament_data.positions[person_wikidata_id]
+    else:
+        positions = wikidata.WikidataItem(person_wikidata_id).get_parliament_positions_held()
     members = []
     for position in positions:
         parliament_member = ParliamentMember.objects.create(
@@ -236,53 +262,102 @@ def create_parliament_member_from_wikidata_id(parliament, person_wikidata_id):
         )
         members.append(parliament_member)
         if position['part_of_id']:
-            party_item = wikidata.WikidataItem(position['part_of_id'])
             parties = PoliticalParty.objects.filter(wikidata_id=position['part_of_id'])
             if parties:
                 party = parties[0]
             else:
-                party = PoliticalParty.find_party(party_item.get_label(language='nl'))
+                party = PoliticalParty.find_party(get_party_label(position['part_of_id'], parliament_data))
             if not party:
                 party = create_party_wikidata(wikidata_id=position['part_of_id'])
             PartyMember.objects.create(person=person, party=party, joined=position['start_time'], left=position['end_time'])
     return members
 
 
+def get_party_label(party_wikidata_id, parliament_data: ParliamentData = None):
+    if parliament_data and party_wikidata_id in parliament_data.parties:
+        return parliament_data.parties[party_wikidata_id].label
+    return wikidata.WikidataItem.get_label_for_id(party_wikidata_id, language='nl')
+
+
 @transaction.atomic
-def set_individual_votes_derived_info():
-    """ sets the derived foreign keys in individual votes, needed after parliament members have changed """
+def set_individual_votes_derived_info(batch_size=500) -> int:
+    """
+    sets the derived foreign keys in individual votes, needed after parliament members have changed
+    Gives the same result as VoteIndividual.set_derived for each vote. The parliament member of each vote is found
+    with one query, joined on the member period and voting date, only the changed votes are updated.
+    :return: the number of votes with a changed parliament member
+    """
     logger.info('BEGIN')
-    votes = VoteIndividual.objects.all()
-    for vote in votes:
-        vote.set_derived()
-    logger.info('END')
+    voting_date = OuterRef('voting__date')
+    person_id = Person.objects.filter(tk_id=OuterRef(OuterRef('person_tk_id'))).order_by('id').values('id')[:1]
+    member_id = ParliamentMember.objects.filter(
+        person_id=Subquery(person_id), joined__lte=voting_date
+    ).filter(Q(left__gt=voting_date) | Q(left__isnull=True)).order_by('id').values('id')[:1]
+    votes = VoteIndividual.objects.exclude(person_tk_id='').annotate(derived_member_id=Subquery(member_id))
+    vote_ids_per_member = collections.defaultdict(list)
+    not_found = 0
+    for vote_id, current_member_id, derived_member_id in votes.values_list('id', 'parliament_member_id', 'derived_member_id'):
+        if derived_member_id is None:
+            not_found += 1  # the vote is not changed, like set_derived
+        elif derived_member_id != current_member_id:
+            vote_ids_per_member[derived_member_id].append(vote_id)
+    changed = bulk_update_foreign_key(VoteIndividual, 'parliament_member_id', vote_ids_per_member, batch_size)
+    if not_found:
+        logger.warning('no parliament member found for {} individual votes'.format(not_found))
+    logger.info('END: {} individual votes changed'.format(changed))
+    return changed
 
 
 @transaction.atomic
-def set_party_votes_derived_info():
-    """ sets the derived foreign keys in party votes, needed after parties have changed """
+def set_party_votes_derived_info(batch_size=500) -> int:
+    """
+    sets the derived foreign keys in party votes, needed after parties have changed
+    Gives the same result as VoteParty.set_derived for each vote. The party is found once per party name,
+    only the changed votes are updated.
+    :return: the number of votes with a changed party
+    """
     logger.info('BEGIN')
-    votes = VoteParty.objects.all()
-    for vote in votes:
-        vote.set_derived()
-    logger.info('END')
+    party_ids = {}
+    for party_name in VoteParty.objects.order_by().values_list('party_name', flat=True).distinct():
+        party = PoliticalParty.find_party(party_name)
+        party_ids[party_name] = party.id if party else None
+    vote_ids_per_party = collections.defaultdict(list)
+    for vote_id, party_name, current_party_id in VoteParty.objects.values_list('id', 'party_name', 'party_id'):
+        if party_ids[party_name] != current_party_id:
+            vote_ids_per_party[party_ids[party_name]].append(vote_id)
+    changed = bulk_update_foreign_key(VoteParty, 'party_id', vote_ids_per_party, batch_size)
+    logger.info('END: {} party votes changed'.format(changed))
+    return changed
+
+
+def bulk_update_foreign_key(model, attname, ids_per_value, batch_size=500) -> int:
+    """ sets the foreign key to the value for the rows with the given ids, an UPDATE per value and batch of ids """
+    updated = 0
+    for value, ids in ids_per_value.items():
+        for i in range(0, len(ids), batch_size):
+            updated += model.objects.filter(id__in=ids[i:i + batch_size]).update(**{attname: value})
+    return updated
 
 
 @transaction.atomic
-def get_or_create_person(wikidata_id, fullname='', wikidata_item=None, add_initials=False):
-    if not wikidata_item:
-        wikidata_item = wikidata.WikidataItem(wikidata_id)
+def get_or_create_person(wikidata_id, fullname='', wikidata_item=None, add_initials=False, parliament_data: ParliamentData = None):
+    person = find_or_create_person(wikidata_id, fullname, wikidata_item, add_initials)
+    party_members = PartyMember.objects.filter(person=person)
+    if not party_members.exists():
+        create_party_members_for_person(person, parliament_data)
+    return person
+
+
+def find_or_create_person(wikidata_id, fullname='', wikidata_item=None, add_initials=False):
+    """ get_or_create_person without creating the party memberships of a new person """
     persons = Person.objects.filter(wikidata_id=wikidata_id)
     if persons.count() > 1:
         logger.warning('more than one person with same wikidata_id found, wikidata id: ' + str(wikidata_id))
     if persons.count() == 1:
-        person = persons[0]
-    else:
-        person = create_person(wikidata_id, fullname, wikidata_item, add_initials)
-    party_members = PartyMember.objects.filter(person=person)
-    if not party_members.exists():
-        create_party_members_for_person(person)
-    return person
+        return persons[0]
+    if not wikidata_item:
+        wikidata_item = wikidata.WikidataItem(wikidata_id)
+    return create_person(wikidata_id, fullname, wikidata_item, add_initials)
 
 
 def create_person(wikidata_id, fullname, wikidata_item, add_initials):
@@ -305,27 +380,83 @@ def create_person(wikidata_id, fullname, wikidata_item, add_initials):
     return person
 
 
-def add_tk_person_id(person: Person) -> Person:
-    tkperson = find_tkapi_person(person)
+class TKPersonSnapshot(object):
+    """
+    All TK persons, downloaded once, to find the TK person of many persons without a TK API query per person.
+    The persons are indexed on their normalized surname and surname parts, search gives the same persons as search_tkapi_persons.
+    """
+
+    def __init__(self, tk_persons: List[TKPersoon]):
+        self.by_surname = collections.OrderedDict()
+        self.by_surname_part = collections.defaultdict(list)
+        for tk_person in tk_persons:
+            self.by_surname.setdefault(self.normalize(tk_person.achternaam), []).append(tk_person)
+            for part in get_surname_parts(tk_person.achternaam):
+                if tk_person not in self.by_surname_part[part]:
+                    self.by_surname_part[part].append(tk_person)
+
+    @staticmethod
+    def download() -> 'TKPersonSnapshot':
+        logger.info('BEGIN')
+        tk_persons = tkapi.TKApi.get_personen()
+        logger.info('END: {} persons'.format(len(tk_persons)))
+        return TKPersonSnapshot(tk_persons)
+
+    @staticmethod
+    def normalize(surname):
+        return surname.lower()
+
+    def search(self, surname) -> List[TKPersoon]:
+        """ returns the persons with a surname that contains the given surname """
+        surname = self.normalize(surname)
+        return [tk_person for key, tk_persons in self.by_surname.items() if surname in key for tk_person in tk_persons]
+
+    def find_candidates(self, surname) -> List[TKPersoon]:
+        """
+        Returns the persons with the same surname, or if there are none, the persons with a surname part in common.
+        These are the only persons of a search that find_tkapi_person can match, found with index lookups instead of a scan.
+        """
+        if self.normalize(surname) in self.by_surname:
+            return list(self.by_surname[self.normalize(surname)])
+        candidates = []
+        for part in get_surname_parts(surname):
+            candidates += [tk_person for tk_person in self.by_surname_part.get(part, []) if tk_person not in candidates]
+        return candidates
+
+
+def get_surname_parts(surname) -> List[str]:
+    """ the lower case parts of a double or multi word surname, short parts (prefixes) are ignored """
+    surname_parts = surname.split('-') + surname.split(' ')
+    return [part.lower() for part in surname_parts if len(part) > 3]
+
+
+def add_tk_person_id(person: Person, snapshot: TKPersonSnapshot = None) -> Person:
+    tkperson = find_tkapi_person(person, snapshot)
     person.tk_id = tkperson.id if tkperson else ''
     person.save()
     return person
 
 
-def find_tkapi_person(person: Person) -> TKPersoon or None:
-    # TODO BR: cleanup: this is a mess!
+def search_tkapi_persons(surname) -> List[TKPersoon]:
     filter = TKPersoon.create_filter()
-    filter.filter_achternaam(person.surname)
+    filter.filter_achternaam(surname)
+    return tkapi.TKApi.get_personen(filter=filter)
+
+
+def find_tkapi_person(person: Person, snapshot: TKPersonSnapshot = None) -> TKPersoon or None:
+    """ :param snapshot: search the persons in this snapshot instead of with TK API queries """
+    # TODO BR: cleanup: this is a mess!
     try:
-        persons = tkapi.TKApi.get_personen(filter=filter)
-        if not persons:
+        if snapshot is not None:
+            persons = snapshot.find_candidates(person.surname)
+        else:
+            persons = search_tkapi_persons(person.surname)
+        if not persons and snapshot is None:
             persons = []
             surname_parts = person.surname.split('-')
             surname_parts += person.surname.split(' ')
             for part in surname_parts:
-                filter = TKPersoon.create_filter()
-                filter.filter_achternaam(part)
-                persons += tkapi.TKApi.get_personen(filter=filter)
+                persons += search_tkapi_persons(part)
     except KeyError:
         logger.exception('Could not find TK Person for {} ({})'.format(person.surname, person.initials))
         return None
@@ -333,16 +464,10 @@ def find_tkapi_person(person: Person) -> TKPersoon or None:
     surname_matches = [tkperson for tkperson in persons if tkperson.achternaam.lower() == person.surname.lower()]
 
     if len(surname_matches) == 0:
-        surname_parts = person.surname.split('-')
-        surname_parts += person.surname.split(' ')
-        surname_parts = [surname.lower() for surname in surname_parts if len(surname) > 3]
+        surname_parts = get_surname_parts(person.surname)
         surname_matches = []
         for tkperson in persons:
-            tk_surname_parts = []
-            tk_surname_parts += tkperson.achternaam.split('-')
-            tk_surname_parts += tkperson.achternaam.split(' ')
-            tk_surname_parts = [surname.lower() for surname in tk_surname_parts if len(surname) > 3]
-            for tk_part in tk_surname_parts:
+            for tk_part in get_surname_parts(tkperson.achternaam):
                 if tk_part in surname_parts:
                     surname_matches.append(tkperson)
 
@@ -0,0 +1,412 @@
+import collections
+import datetime
+import logging
+from typing import Dict, List
+
+from django.db import transaction
+
+import tkapi
+from tkapi.fractie import Fractie as TKFractie
+
+from document.models import VoteIndividual
+from document.models import VoteParty
+
+from government.models import Government
+
+from parliament.models import Parliament
+from parliament.models import ParliamentMember
+from parliament.models import PartyMember
+from parliament.models import PartyResolver
+from parliament.models import PoliticalParty
+
+from person.models import Person
+
+from wikidata import wikidata
+from wikidata.parliament import ParliamentData
+import wikidata.government as wikidata_government
+import wikidata.parliament as wikidata_parliament
+
+import openkamer.parliament
+from openkamer.settings import PARLIAMENT_SWAP_MAX_OVERLAPPING
+from openkamer.settings import PARLIAMENT_SWAP_MAX_REMOVED_FRACTION
+from openkamer.settings import PARLIAMENT_SWAP_SEATS_TOLERANCE
+from openkamer.update import UpdateSummary
+from openkamer.update import update_if_changed
+
+import stats.models
+
+logger = logging.getLogger(__name__)
+
+PARLIAMENT_SEATS = 150
+PARTY_FIELDS = (
+    'tk_id', 'name', 'name_short', 'founded', 'dissolved', 'wikidata_id', 'wikimedia_logo_url', 'wikipedia_url',
+    'official_website_url',
+)
+
+
+class ParliamentDataset(object):
+    """
+    The parties, party memberships, parliament members and governments of a full parliament and government update,
+    built in memory without writing to the tables that are replaced, so the site can be used while it is built.
+    Only new persons are created during the build, persons are never removed by an update.
+    """
+
+    def __init__(self):
+        self.parties = []  # unsaved PoliticalParty objects
+        self.party_members = []  # (person id, PoliticalParty, joined, left)
+        self.parliament_members = []  # (person id, joined, left)
+        self.governments = []  # (wikidata id, government info, [(GovernmentMemberData, person id)])
+        self._parties_by_wikidata_id = {}
+        self._parties_by_name = {}
+
+    def add_party(self, party: PoliticalParty):
+        self.parties.append(party)
+        if party.wikidata_id:
+            self._parties_by_wikidata_id[party.wikidata_id] = party
+        for name in (party.name, party.name_short):
+            self._parties_by_name.setdefault(PartyResolver.normalize(name), party)
+
+    def add_wikidata_id(self, party: PoliticalParty, wikidata_id):
+        """ the party is also found by this wikidata id, it is set as the party wikidata id if the party has none """
+        if not party.wikidata_id:
+            party.wikidata_id = wikidata_id
+        self._parties_by_wikidata_id[wikidata_id] = party
+
+    def find_party(self, wikidata_id=None, name=None) -> PoliticalParty or None:
+        """ finds a party by wikidata id, or by (short) name like PoliticalParty.find_party """
+        if wikidata_id in self._parties_by_wikidata_id:
+            return self._parties_by_wikidata_id[wikidata_id]
+        if name:
+            for variant in PartyResolver.get_name_variants(name):
+                if variant in self._parties_by_name:
+                    return self._parties_by_name[variant]
+        return None
+
+    def add_party_member(self, person_id, party, joined, left):
+        self.party_members.append((person_id, party, joined, left))
+
+    def add_parliament_member(self, person_id, joined, left):
+        self.parliament_members.append((person_id, joined, left))
+
+    def get_current_seats(self, date=None):
+        date = date or datetime.date.today()
+        return len({
+            person_id for person_id, joined, left in self.parliament_members
+            if joined is not None and joined <= date and (left is None or left > date)
+        })
+
+    def get_overlapping_parliament_members(self):
+        """ returns the (person id, joined, left) of parliament members that overlap another membership of the same person """
+        overlapping = []
+        members_by_person = collections.defaultdict(list)
+        for person_id, joined, left in self.parliament_members:
+            members_by_person[person_id].append((joined or datetime.date.min, left or datetime.date.max))
+        for person_id, periods in members_by_person.items():
+            periods.sort()
+            for (joined_a, left_a), (joined_b, left_b) in zip(periods, periods[1:]):
+                if joined_b < left_a:
+                    overlapping.append((person_id, joined_b, left_b))
+        return overlapping
+
+    def validate(self, date=None, seats_tolerance=PARLIAMENT_SWAP_SEATS_TOLERANCE,
+                 max_removed_fraction=PARLIAMENT_SWAP_MAX_REMOVED_FRACTION, max_overlapping=PARLIAMENT_SWAP_MAX_OVERLAPPING) -> List[str]:
+        """
+        Returns the errors that prevent a swap, an empty list if the dataset can replace the current data.
+        A dataset of an incomplete build is rejected by the number of current seats,
+        and by the number of existing parliament members and parties it would remove.
+        """
+        errors = []
+        if not self.parties:
+            errors.append('no parties')
+        if not self.parliament_members:
+            errors.append('no parliament members')
+        current_seats = self.get_current_seats(date)
+        if current_seats > PARLIAMENT_SEATS:
+            errors.append('{} current parliament members, more than {} seats'.format(current_seats, PARLIAMENT_SEATS))
+        if current_seats < PARLIAMENT_SEATS - seats_tolerance:
+            errors.append('{} current parliament members, less than {} seats'.format(current_seats, PARLIAMENT_SEATS - seats_tolerance))
+        overlapping = self.get_overlapping_parliament_members()
+        for person_id, joined, left in overlapping:
+            logger.warning('overlapping parliament membership for person {}: {} - {}'.format(person_id, joined, left))
+        if len(overlapping) > max_overlapping:
+            errors.append('{} overlapping parliament memberships, more than {}'.format(len(overlapping), max_overlapping))
+        n_members = ParliamentMember.objects.count()
+        n_members_removed = len(match_parliament_members(self)[1])
+        if n_members_removed > n_members * max_removed_fraction:
+            errors.append('{} of {} parliament members would be removed'.format(n_members_removed, n_members))
+        n_parties = PoliticalParty.objects.count()
+        n_parties_removed = len(match_parties(self)[1])
+        if n_parties_removed > n_parties * max_removed_fraction:
+            errors.append('{} of {} parties would be removed'.format(n_parties_removed, n_parties))
+        for error in errors:
+            logger.error('parliament dataset is not valid: {}'.format(error))
+        return errors
+
+
+def update_parliament_and_government(all_members=False) -> bool:
+    """
+    Builds the parliament and government data without locks held, validates it and swaps it in with a short transaction.
+    Existing parties and parliament members keep their id when they are in the new data,
+    the foreign keys to removed parliament members are moved to the new membership of the same person.
+    Unlike create_parliament_and_government, the links of votes, gifts and travels are kept.
+    Returns False if the dataset is not valid, the current data is then not changed.
+    """
+    logger.info('BEGIN')
+    dataset = build_dataset(all_members=all_members)
+    if dataset.validate():
+        logger.info('END: dataset not valid, nothing changed')
+        return False
+    summary = UpdateSummary('parliament and government')
+    swap_dataset(dataset, summary)
+    for party in PoliticalParty.objects.all():
+        party.set_current_parliament_seats()
+    summary.add(VoteParty._meta.verbose_name_plural, UpdateSummary.UPDATED, openkamer.parliament.set_party_votes_derived_info())
+    summary.add(VoteIndividual._meta.verbose_name_plural, UpdateSummary.UPDATED, openkamer.parliament.set_individual_votes_derived_info())
+    logger.info(summary)
+    Person.update_persons_all(language='nl')
+    stats.models.update_all()
+    logger.info('END')
+    return True
+
+
+def build_dataset(all_members=False, max_results=None) -> ParliamentDataset:
+    logger.info('BEGIN')
+    dataset = ParliamentDataset()
+    for tk_fractie in tkapi.TKApi.get_fracties():
+        party = PoliticalParty(tk_id=tk_fractie.id, name=tk_fractie.naam, name_short=tk_fractie.afkorting)
+        party.set_info(language='nl')
+        dataset.add_party(party)
+    parliament_data = wikidata_parliament.load_parliament_data()
+    person_ids = {}  # wikidata id to person id
+    for government_id in openkamer.parliament.GOVERNMENT_IDS:
+        members = []
+        for member in wikidata_government.get_government_members(government_id):
+            if member.position is None:
+                logger.error('no position found for government member: {} ({})'.format(member.name, member.wikidata_id))
+                continue
+            person = openkamer.parliament.find_or_create_person(member.wikidata_id, member.name, add_initials=True)
+            person_ids[member.wikidata_id] = person.id
+            members.append((member, person.id))
+        dataset.governments.append((government_id, wikidata_government.get_government(government_id), members))
+    member_wikidata_ids = parliament_data.get_member_ids(with_start_date=not all_members)
+    member_wikidata_ids = member_wikidata_ids[:max_results] if max_results else member_wikidata_ids
+    existing_ids = set(Person.objects.filter(wikidata_id__in=member_wikidata_ids).values_list('wikidata_id', flat=True))
+    wikidata.WikidataItem.prefetch([wikidata_id for wikidata_id in member_wikidata_ids if wikidata_id not in existing_ids])
+    for person_wikidata_id in member_wikidata_ids:
+        person = openkamer.parliament.find_or_create_person(person_wikidata_id, add_initials=True)
+        person_ids[person_wikidata_id] = person.id
+        add_parliament_positions(dataset, parliament_data, person.id, person_wikidata_id)
+    for person_wikidata_id, person_id in person_ids.items():
+        add_party_memberships(dataset, parliament_data, person_id, person_wikidata_id)
+    logger.info('END: {} parties, {} party members, {} parliament members, {} governments'.format(
+        len(dataset.parties), len(dataset.party_members), len(dataset.parliament_members), len(dataset.governments)
+    ))
+    return dataset
+
+
+def add_parliament_positions(dataset: ParliamentDataset, parliament_data: ParliamentData, person_id, person_wikidata_id):
+    if parliament_data.has_person(person_wikidata_id):
+        positions = parliament_data.positions[person_wikidata_id]
+    else:
+        positions = wikidata.WikidataItem(person_wikidata_id).get_parliament_positions_held()
+    for position in positions:
+        dataset.add_parliament_member(person_id, position['start_time'], position['end_time'])
+        if position['part_of_id']:
+            party = dataset.find_party(position['part_of_id'])
+            if party is None:
+                party = dataset.find_party(name=openkamer.parliament.get_party_label(position['part_of_id'], parliament_data))
+            if party is None:
+                party = add_party_wikidata(dataset, position['part_of_id'])
+            dataset.add_party_member(person_id, party, position['start_time'], position['end_time'])
+
+
+def add_party_memberships(dataset: ParliamentDataset, parliament_data: ParliamentData, person_id, person_wikidata_id):
+    if parliament_data.has_person(person_wikidata_id):
+        memberships = parliament_data.memberships.get(person_wikidata_id, [])
+    else:
+        memberships = wikidata.WikidataItem(person_wikidata_id).get_political_party_memberships()
+    for membership in memberships:
+        if openkamer.parliament.is_local_or_youth_party(membership['party_wikidata_id'], parliament_data):
+            continue
+        party = dataset.find_party(membership['party_wikidata_id'])
+        if party is None:
+            party = add_party_wikidata(dataset, membership['party_wikidata_id'])
+        dataset.add_party_member(person_id, party, membership['start_date'], membership['end_date'])
+
+
+def add_party_wikidata(dataset: ParliamentDataset, wikidata_id) -> PoliticalParty:
+    """ adds the party of a wikidata item, or sets the wikidata id of a party with the same name, like create_party_wikidata """
+    wikidata_party_item = wikidata.WikidataItem(wikidata_id)
+    name = wikidata_party_item.get_label(language='nl')
+    party = dataset.find_party(name=name)
+    if party is not None:
+        dataset.add_wikidata_id(party, wikidata_id)
+        return party
+    filter_fractie = TKFractie.create_filter()
+    filter_fractie.filter_fractie(naam=name)
+    tk_fracties = tkapi.TKApi.get_fracties(filter=filter_fractie)
+    party = PoliticalParty(
+        tk_id=tk_fracties[0].id if tk_fracties else None,
+        name=name,
+        name_short=wikidata_party_item.get_short_name(language='nl') or name,
+        wikidata_id=wikidata_id
+    )
+    party.set_info(language='nl')
+    dataset.add_party(party)
+    return party
+
+
+@transaction.atomic
+def swap_dataset(dataset: ParliamentDataset, summary: UpdateSummary):
+    logger.info('BEGIN')
+    swap_parties(dataset, summary)
+    PartyMember.objects.all().delete()
+    PartyMember.objects.bulk_create([
+        PartyMember(person_id=person_id, party_id=party.id, joined=joined, left=left)
+        for person_id, party, joined, left in dataset.party_members
+    ], batch_size=500)
+    summary.add(PartyMember._meta.verbose_name_plural, UpdateSummary.CREATED, len(dataset.party_members))
+    swap_parliament_members(dataset, summary)
+    swap_governments(dataset, summary)
+    logger.info('END')
+
+
+def swap_parties(dataset: ParliamentDataset, summary: UpdateSummary):
+    """ updates the existing parties that are in the dataset, matched on tk id, wikidata id or name, and removes the others """
+    object_type = PoliticalParty._meta.verbose_name_plural
+    matches, removed = match_parties(dataset)
+    for party, existing_party in matches:
+        if existing_party is None:
+            party.save()
+            summary.add(object_type, UpdateSummary.CREATED)
+            continue
+        if update_if_changed(existing_party, {name: getattr(party, name) for name in PARTY_FIELDS}):
+            summary.add(object_type, UpdateSummary.UPDATED)
+        else:
+            summary.add(object_type, UpdateSummary.UNCHANGED)
+        party.id = existing_party.id
+    removed_ids = [party.id for party in removed]
+    remap_foreign_keys(PoliticalParty, {party_id: None for party_id in removed_ids})
+    PoliticalParty.objects.filter(id__in=removed_ids).delete()
+    summary.add(object_type, UpdateSummary.DELETED, len(removed_ids))
+
+
+def match_parties(dataset: ParliamentDataset):
+    """ returns the (party, matching existing party or None) of the dataset parties, and the existing parties without a match """
+    existing = list(PoliticalParty.objects.order_by('id'))
+    matched_ids = set()
+    matches = []
+    for party in dataset.parties:
+        existing_party = find_matching_party(party, [p for p in existing if p.id not in matched_ids])
+        if existing_party is not None:
+            matched_ids.add(existing_party.id)
+        matches.append((party, existing_party))
+    return matches, [party for party in existing if party.id not in matched_ids]
+
+
+def find_matching_party(party: PoliticalParty, existing: List[PoliticalParty]) -> PoliticalParty or None:
+    for name in ('tk_id', 'wikidata_id'):
+        if getattr(party, name):
+            for existing_party in existing:
+                if getattr(existing_party, name) == getattr(party, name):
+                    return existing_party
+    name_variants = PartyResolver.get_name_variants(party.name)
+    for existing_party in existing:
+        if PartyResolver.normalize(existing_party.name) in name_variants:
+            return existing_party
+    return None
+
+
+def swap_parliament_members(dataset: ParliamentDataset, summary: UpdateSummary):
+    """
+    Keeps the existing members that are in the dataset, creates the new ones and removes the others.
+    The foreign keys to a removed member are moved to the new member of the same person at the date the removed member joined.
+    """
+    object_type = ParliamentMember._meta.verbose_name_plural
+    parliament = Parliament.get_or_create_tweede_kamer()
+    staged = set(dataset.parliament_members)
+    existing, removed_ids = match_parliament_members(dataset)
+    new_members = [
+        ParliamentMember(person_id=person_id, parliament=parliament, joined=joined, left=left)
+        for person_id, joined, left in sorted(staged - set(existing), key=str)
+    ]
+    ParliamentMember.objects.bulk_create(new_members, batch_size=500)
+    summary.add(object_type, UpdateSummary.CREATED, len(new_members))
+    summary.add(object_type, UpdateSummary.UNCHANGED, len(existing))
+    if not removed_ids:
+        return
+    removed = ParliamentMember.objects.filter(id__in=removed_ids).values_list('id', 'person_id', 'joined')
+    members_by_person = collections.defaultdict(list)
+    for member_id, person_id, joined, left in ParliamentMember.objects.exclude(id__in=removed_ids).order_by('id').values_list(
+            'id', 'person_id', 'joined', 'left'):
+        members_by_person[person_id].append((joined, left, member_id))
+    id_map = {}
+    for member_id, person_id, joined in removed:
+        id_map[member_id] = find_member_at_date(members_by_person[person_id], joined)
+    remap_foreign_keys(ParliamentMember, id_map)
+    ParliamentMember.objects.filter(id__in=removed_ids).delete()
+    summary.add(object_type, UpdateSummary.DELETED, len(removed_ids))
+
+
+def match_parliament_members(dataset: ParliamentDataset):
+    """
+    Returns the existing parliament member id per (person id, joined, left) of the dataset,
+    and the ids of the existing members that are not in the dataset, or a duplicate of another existing member.
+    """
+    staged = set(dataset.parliament_members)
+    existing = {}
+    removed_ids = []
+    for member_id, person_id, joined, left in ParliamentMember.objects.order_by('id').values_list('id', 'person_id', 'joined', 'left'):
+        key = (person_id, joined, left)
+        if key in staged and key not in existing:
+            existing[key] = member_id
+        else:
+            removed_ids.append(member_id)
+    return existing, removed_ids
+
+
+def find_member_at_date(members, date):
+    """ the id of the membership at the date, or the first membership if there is no date """
+    for joined, left, member_id in members:
+        if date is None or ((joined is None or joined <= date) and (left is None or left > date)):
+            return member_id
+    return None
+
+
+def swap_governments(dataset: ParliamentDataset, summary: UpdateSummary):
+    object_type = Government._meta.verbose_name_plural
+    for wikidata_id, gov_info, members in dataset.governments:
+        deleted, deleted_per_type = Government.objects.filter(wikidata_id=wikidata_id).delete()
+        government = Government.objects.create(
+            name=gov_info['name'],
+            date_formed=gov_info['start_date'],
+            date_dissolved=gov_info['end_date'],
+            wikidata_id=wikidata_id
+        )
+        summary.add(object_type, UpdateSummary.UPDATED if deleted else UpdateSummary.CREATED)
+        persons = Person.objects.in_bulk([person_id for member, person_id in members])
+        for member, person_id in members:
+            ministry = openkamer.parliament.create_ministry(government, member)
+            position = openkamer.parliament.create_government_position(government, member, ministry)
+            openkamer.parliament.create_goverment_member(government, member, persons[person_id], position)
+
+
+def remap_foreign_keys(model, id_map: Dict[int, int], batch_size=500):
+    """
+    Points all foreign keys to the rows of model with an old id in id_map to the new id.
+    A nullable foreign key is cleared if the new id is None, a non nullable foreign key is then left to the delete cascade.
+    """
+    old_ids_by_new_id = collections.defaultdict(list)
+    for old_id, new_id in id_map.items():
+        old_ids_by_new_id[new_id].append(old_id)
+    for relation in model._meta.related_objects:
+        if relation.many_to_many:
+            continue
+        field = relation.field
+        for new_id, old_ids in old_ids_by_new_id.items():
+            if new_id is None and not field.null:
+                continue
+            for i in range(0, len(old_ids), batch_size):
+                relation.related_model.objects.filter(
+                    **{'{}__in'.format(field.attname): old_ids[i:i + batch_size]}
+                ).update(**{field.attname: new_id})
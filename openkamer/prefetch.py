@@ -0,0 +1,145 @@
+import collections
+import logging
+from typing import Dict
+from typing import List
+
+from tkapi import TKApi
+from tkapi.besluit import Besluit as TKBesluit
+from tkapi.dossier import Dossier as TKDossier
+from tkapi.zaak import Zaak
+
+from openkamer.sync import can_probe
+from openkamer.sync import create_dossiers_filter
+from openkamer.sync import match_dossier_ids
+from openkamer.sync import request_odata
+
+logger = logging.getLogger(__name__)
+
+# the expand depth is kept at two to limit the response size, deeper navigation (document actor persons) is requested when used
+ZAAK_EXPAND = 'Kamerstukdossier,ZaakActor($expand=Persoon,Commissie),Document($expand=DocumentActor)'
+BESLUIT_EXPAND = 'Zaak($expand=Kamerstukdossier),Stemming($expand=Persoon,Fractie),Agendapunt($expand=Activiteit)'
+ZAAK_PATH = [('Kamerstukdossier', True)]
+BESLUIT_PATH = [('Zaak', True), ('Kamerstukdossier', True)]
+
+
+class TKDossierData(object):
+    """
+    The TK API dossiers, zaken and besluiten of a dossier, with their documents, stemmingen and agendapunten embedded.
+    Used instead of the tkapi dossier queries, navigating the embedded items does not do requests.
+    """
+
+    def __init__(self, dossier_id):
+        self.dossier_id = dossier_id
+        self.tk_dossiers = []
+        self.tk_zaken = []
+        self.tk_besluiten = []
+
+    def get_dossier(self) -> TKDossier:
+        """ same as queries.get_dossier, raises an IndexError if the dossier does not exist """
+        return self.tk_dossiers[0]
+
+    def get_besluiten(self) -> List[TKBesluit]:
+        """ same as queries.get_dossier_besluiten, the besluiten of all zaken without duplicates """
+        return list(self.tk_besluiten)
+
+    def get_besluiten_with_stemmingen(self) -> List[TKBesluit]:
+        """ same as queries.get_dossier_besluiten_with_stemmingen """
+        return [tk_besluit for tk_besluit in self.tk_besluiten if tk_besluit.stemmingen]
+
+
+def embed(item_json, navigation, value):
+    """ tkapi only uses the embedded items of a navigation property if it has a navigation link """
+    item_json[navigation] = value
+    item_json.setdefault(navigation + '@odata.navigationLink', '{}/{}'.format(item_json.get('@odata.id', ''), navigation))
+
+
+def add_navigation_links(item_json):
+    """ adds the navigation links of the expanded navigation properties, if not given by the TK API """
+    for key, value in list(item_json.items()):
+        if '@' in key:
+            continue
+        if isinstance(value, dict):
+            add_navigation_links(value)
+        elif not isinstance(value, list) or not all(isinstance(value_item, dict) for value_item in value):
+            continue
+        else:
+            for value_item in value:
+                add_navigation_links(value_item)
+        embed(item_json, key, value)
+
+
+def request_dossier_items(entity_type, path, dossier_ids, expand=None, orderby=None) -> List[Dict]:
+    params = {
+        '$filter': 'Verwijderd eq false and ({})'.format(create_dossiers_filter(path, dossier_ids)),
+        '$format': 'application/json;odata.metadata=full',
+    }
+    if expand:
+        params['$expand'] = expand
+    if orderby:
+        params['$orderby'] = orderby
+    item_jsons = request_odata(TKApi.api_root + entity_type, params)
+    for item_json in item_jsons:
+        add_navigation_links(item_json)
+    return item_jsons
+
+
+def get_dossier_ids(item_json, dossier_ids) -> List[str]:
+    matches = []
+    for dossier_json in item_json.get('Kamerstukdossier') or []:
+        if dossier_json.get('Verwijderd'):
+            continue
+        matches += [dossier_id for dossier_id in match_dossier_ids(dossier_json, dossier_ids) if dossier_id not in matches]
+    return matches
+
+
+def create_dossiers_data(dossier_ids, dossier_jsons, zaak_jsons, besluit_jsons) -> Dict[str, TKDossierData]:
+    """ links the items in memory, the zaken to their dossier and the besluiten to their zaken """
+    dossiers_data = collections.OrderedDict((dossier_id, TKDossierData(dossier_id)) for dossier_id in dossier_ids)
+
+    besluit_jsons_per_zaak = collections.defaultdict(list)
+    for besluit_json in besluit_jsons:
+        for zaak_json in besluit_json.get('Zaak') or []:
+            besluit_jsons_per_zaak[zaak_json['Id']].append(besluit_json)
+
+    zaak_jsons_per_tk_dossier = collections.defaultdict(list)
+    for zaak_json in zaak_jsons:
+        embed(zaak_json, 'Besluit', besluit_jsons_per_zaak[zaak_json['Id']])
+        for dossier_json in zaak_json.get('Kamerstukdossier') or []:
+            zaak_jsons_per_tk_dossier[dossier_json['Id']].append(zaak_json)
+        for dossier_id in get_dossier_ids(zaak_json, dossier_ids):
+            dossiers_data[dossier_id].tk_zaken.append(Zaak(zaak_json))
+
+    for dossier_json in dossier_jsons:
+        embed(dossier_json, 'Zaak', zaak_jsons_per_tk_dossier[dossier_json['Id']])
+        for dossier_id in match_dossier_ids(dossier_json, dossier_ids):
+            dossiers_data[dossier_id].tk_dossiers.append(TKDossier(dossier_json))
+
+    tk_besluiten = {}
+    for dossier_data in dossiers_data.values():
+        besluit_ids = set()
+        for tk_zaak in dossier_data.tk_zaken:
+            for besluit_json in besluit_jsons_per_zaak[tk_zaak.id]:
+                if besluit_json['Id'] in besluit_ids:
+                    continue
+                besluit_ids.add(besluit_json['Id'])
+                tk_besluit = tk_besluiten.setdefault(besluit_json['Id'], TKBesluit(besluit_json))
+                dossier_data.tk_besluiten.append(tk_besluit)
+    return dossiers_data
+
+
+def prefetch_dossiers(dossier_ids: List[str]) -> Dict[str, TKDossierData]:
+    """
+    Returns the TK API data of the given dossiers, with a single request (per result page) for each of
+    the dossiers, zaken and besluiten, instead of several requests per dossier, zaak and besluit.
+    Dossiers with an id that can not be used in a TK API filter are not prefetched.
+    """
+    dossier_ids = [dossier_id for dossier_id in dossier_ids if can_probe(dossier_id)]
+    if not dossier_ids:
+        return {}
+    logger.info('BEGIN - {} dossiers'.format(len(dossier_ids)))
+    dossier_jsons = request_dossier_items(TKDossier.type, [], dossier_ids, orderby='GewijzigdOp desc')
+    zaak_jsons = request_dossier_items(Zaak.type, ZAAK_PATH, dossier_ids, expand=ZAAK_EXPAND, orderby='GestartOp')
+    besluit_jsons = request_dossier_items(TKBesluit.type, BESLUIT_PATH, dossier_ids, expand=BESLUIT_EXPAND)
+    dossiers_data = create_dossiers_data(dossier_ids, dossier_jsons, zaak_jsons, besluit_jsons)
+    logger.info('END - {} dossiers, {} zaken, {} besluiten'.format(len(dossier_jsons), len(zaak_jsons), len(besluit_jsons)))
+    return dossiers_data
@@ -1,3 +1,15 @@
+import tempfile
+
 from django.conf import settings
 
-OK_TMP_DIR = getattr(settings, '/tmp/', '')
\ No newline at end of file
+OK_TMP_DIR = getattr(settings, '/tmp/', '')
+DOCUMENT_FETCH_MAX_WORKERS = getattr(settings, 'DOCUMENT_FETCH_MAX_WORKERS', 8)
+DOSSIER_PREFETCH_BATCH_SIZE = getattr(settings, 'DOSSIER_PREFETCH_BATCH_SIZE', 20)
+DOSSIER_SYNC_PROBE_BATCH_SIZE = getattr(settings, 'DOSSIER_SYNC_PROBE_BATCH_SIZE', 20)
+IMPORT_WORKERS = getattr(settings, 'IMPORT_WORKERS', 1)
+IMPORT_LOCK_DIR = getattr(settings, 'IMPORT_LOCK_DIR', getattr(settings, 'OK_TMP_DIR', '') or tempfile.gettempdir())
+PARLIAMENT_SWAP_SEATS_TOLERANCE = getattr(settings, 'PARLIAMENT_SWAP_SEATS_TOLERANCE', 10)
+PARLIAMENT_SWAP_MAX_REMOVED_FRACTION = getattr(settings, 'PARLIAMENT_SWAP_MAX_REMOVED_FRACTION', 0.1)
+PARLIAMENT_SWAP_MAX_OVERLAPPING = getattr(settings, 'PARLIAMENT_SWAP_MAX_OVERLAPPING', 10)
+KAMERVRAAG_FETCH_CONCURRENCY = getattr(settings, 'KAMERVRAAG_FETCH_CONCURRENCY', 8)
+KAMERVRAAG_WRITE_BATCH_SIZE = getattr(settings, 'KAMERVRAAG_WRITE_BATCH_SIZE', 20)
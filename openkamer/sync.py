@@ -0,0 +1,194 @@
+import datetime
+import logging
+from typing import Dict
+from typing import List
+
+from django.utils import timezone
+
+from tkapi import TKApi
+from tkapi.util import util as tkapi_util
+
+import scraper.session
+
+from document.models import Dossier
+
+from openkamer.models import DossierSyncState
+from openkamer.settings import DOSSIER_SYNC_PROBE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# our clock and the TK API clock can differ, the sync start time is moved back by this margin
+CLOCK_SKEW_MARGIN = datetime.timedelta(minutes=10)
+
+
+class ProbeEntity(object):
+    """
+    A TK API entity type that is part of a dossier,
+    with the navigation path from the entity to its Kamerstukdossier as (navigation property, is collection) tuples.
+    """
+
+    def __init__(self, type, path):
+        self.type = type
+        self.path = path
+
+
+PROBE_ENTITIES = (
+    ProbeEntity('Kamerstukdossier', []),
+    ProbeEntity('Zaak', [('Kamerstukdossier', True)]),
+    ProbeEntity('Document', [('Kamerstukdossier', True)]),
+    ProbeEntity('Besluit', [('Zaak', True), ('Kamerstukdossier', True)]),
+    ProbeEntity('Stemming', [('Besluit', False), ('Zaak', True), ('Kamerstukdossier', True)]),
+)
+
+
+def can_probe(dossier_id):
+    dossier_id_main, dossier_id_sub = Dossier.split_dossier_id(dossier_id)
+    return dossier_id_main.isdigit()
+
+
+def create_dossier_condition(dossier_id, prefix):
+    dossier_id_main, dossier_id_sub = Dossier.split_dossier_id(dossier_id)
+    condition = '{}Nummer eq {}'.format(prefix, dossier_id_main)
+    if dossier_id_sub:
+        condition += " and {}Toevoeging eq '{}'".format(prefix, dossier_id_sub.replace("'", "''"))
+    return '({})'.format(condition)
+
+
+def create_dossiers_filter(path, dossier_ids, prefix=''):
+    """ creates an OData filter that matches entities that belong to one of the dossiers """
+    if not path:
+        return ' or '.join([create_dossier_condition(dossier_id, prefix) for dossier_id in dossier_ids])
+    (navigation, is_collection), path_rest = path[0], path[1:]
+    if not is_collection:
+        return create_dossiers_filter(path_rest, dossier_ids, prefix + navigation + '/')
+    variable = 'x{}'.format(len(path))
+    return '{}{}/any({}: {})'.format(
+        prefix, navigation, variable, create_dossiers_filter(path_rest, dossier_ids, variable + '/')
+    )
+
+
+def create_dossiers_expand(path):
+    navigation = path[0][0]
+    if len(path) == 1:
+        return '{}($select=Nummer,Toevoeging)'.format(navigation)
+    return '{}($select=Id;$expand={})'.format(navigation, create_dossiers_expand(path[1:]))
+
+
+def get_dossier_jsons(item_json, path):
+    if not path:
+        return [item_json]
+    value = item_json.get(path[0][0])
+    if value is None:
+        return []
+    values = value if isinstance(value, list) else [value]
+    dossier_jsons = []
+    for value in values:
+        dossier_jsons += get_dossier_jsons(value, path[1:])
+    return dossier_jsons
+
+
+def match_dossier_ids(dossier_json, dossier_ids):
+    """ a dossier id without toevoeging matches all toevoegingen, same as the dossier queries """
+    matches = []
+    for dossier_id in dossier_ids:
+        dossier_id_main, dossier_id_sub = Dossier.split_dossier_id(dossier_id)
+        if str(dossier_json.get('Nummer')) != dossier_id_main:
+            continue
+        if dossier_id_sub and dossier_id_sub != dossier_json.get('Toevoeging'):
+            continue
+        matches.append(dossier_id)
+    return matches
+
+
+def request_odata(url, params=None):
+    items = []
+    while url:
+        response = scraper.session.get(url, params=params, timeout=60)
+        response.raise_for_status()
+        page = response.json()
+        items += page.get('value', [])
+        url = page.get('@odata.nextLink')
+        params = None
+    return items
+
+
+def probe_upstream_modified(dossier_ids, since: datetime.datetime) -> Dict[str, datetime.datetime]:
+    """
+    Returns the newest GewijzigdOp per dossier, of the dossier related TK API entities that are modified after since.
+    Does one request per entity type for all given dossiers. Deleted entities are included, a deletion is a change.
+    """
+    upstream_modified = {}
+    for entity in PROBE_ENTITIES:
+        params = {
+            '$filter': 'GewijzigdOp gt {} and ({})'.format(
+                tkapi_util.datetime_to_odata(since.astimezone(datetime.timezone.utc)),
+                create_dossiers_filter(entity.path, dossier_ids)
+            ),
+            '$select': 'Id,GewijzigdOp' if entity.path else 'Id,GewijzigdOp,Nummer,Toevoeging',
+            '$format': 'application/json;odata.metadata=minimal',
+        }
+        if entity.path:
+            params['$expand'] = create_dossiers_expand(entity.path)
+        for item_json in request_odata(TKApi.api_root + entity.type, params):
+            if not item_json.get('GewijzigdOp'):
+                continue
+            modified = tkapi_util.odatedatetime_to_datetime(item_json['GewijzigdOp'])
+            if timezone.is_naive(modified):
+                modified = timezone.make_aware(modified, datetime.timezone.utc)
+            for dossier_json in get_dossier_jsons(item_json, entity.path):
+                for dossier_id in match_dossier_ids(dossier_json, dossier_ids):
+                    if dossier_id not in upstream_modified or modified > upstream_modified[dossier_id]:
+                        upstream_modified[dossier_id] = modified
+    return upstream_modified
+
+
+def get_changed_dossiers(dossier_ids: List[str], batch_size=DOSSIER_SYNC_PROBE_BATCH_SIZE) -> Dict[str, datetime.datetime]:
+    """
+    Returns the dossiers that have changed in the TK API since their last import, with their newest upstream modification time.
+    Dossiers that have not been imported before are always changed, with an unknown (None) modification time.
+    If the probe of a batch fails, all dossiers in that batch are considered changed.
+    """
+    logger.info('BEGIN - {} dossiers'.format(len(dossier_ids)))
+    states = {state.dossier_id: state for state in DossierSyncState.objects.filter(dossier_id__in=dossier_ids)}
+    dossier_ids_existing = set(Dossier.objects.filter(dossier_id__in=dossier_ids).values_list('dossier_id', flat=True))
+    changed = {}
+    states_probe = []
+    for dossier_id in dossier_ids:
+        state = states.get(dossier_id)
+        if state is None or state.upstream_modified is None or dossier_id not in dossier_ids_existing or not can_probe(dossier_id):
+            changed[dossier_id] = None
+        else:
+            states_probe.append(state)
+
+    for i in range(0, len(states_probe), batch_size):
+        batch = states_probe[i:i + batch_size]
+        since = min([state.upstream_modified for state in batch])
+        try:
+            upstream_modified = probe_upstream_modified([state.dossier_id for state in batch], since)
+        except Exception:
+            logger.exception('freshness probe failed, consider all {} dossiers in the batch changed'.format(len(batch)))
+            for state in batch:
+                changed[state.dossier_id] = None
+            continue
+        for state in batch:
+            modified = upstream_modified.get(state.dossier_id)
+            if modified is not None and modified > state.upstream_modified:
+                changed[state.dossier_id] = modified
+        DossierSyncState.objects.filter(id__in=[state.id for state in batch]).update(date_checked=timezone.now())
+    logger.info('END - {} of {} dossiers changed'.format(len(changed), len(dossier_ids)))
+    return changed
+
+
+def set_dossier_synced(dossier_id, upstream_modified: datetime.datetime, sync_start: datetime.datetime):
+    """
+    Stores the upstream modification time that was seen before the import.
+    If unknown, the start of the import (minus a clock skew margin) is used,
+    all upstream changes before that moment are included in the import.
+    """
+    if upstream_modified is None:
+        upstream_modified = sync_start - CLOCK_SKEW_MARGIN
+    now = timezone.now()
+    DossierSyncState.objects.update_or_create(
+        dossier_id=dossier_id,
+        defaults={'upstream_modified': upstream_modified, 'date_checked': now, 'date_synced': now}
+    )
@@ -1,4 +1,6 @@
 import datetime
+import os
+import threading
 
 from django.urls import reverse
 from django.test import TestCase
@@ -7,6 +9,8 @@ from tkapi import TKApi
 from tkapi.besluit import Besluit as TKBesluit
 from tkapi.document import DocumentSoort
 from tkapi.document import Document as TKDocument
+from tkapi.persoon import Persoon as TKPersoon
+from tkapi.stemming import Stemming as TKStemming
 from tkapi.util import queries
 from tkapi.util.document import get_overheidnl_id
 from tkapi.zaak import Zaak
@@ -16,23 +20,50 @@ from person.models import Person
 from government.models import Government
 
 from parliament.models import Parliament
+from parliament.models import ParliamentMember
 from parliament.models import PartyMember
 from parliament.models import PoliticalParty
 from parliament.models import Commissie
+from parliament.models import MembershipsAtDate
+
+from gift.models import Gift
+from gift.models import PersonPosition
 
 from document.models import Document
 from document.models import Dossier
 from document.models import Kamervraag
+from document.models import Kamerantwoord
+from document.models import Submitter
 from document.models import Voting, Vote
+from document.models import VoteIndividual
+from document.models import VoteParty
 
 from openkamer.document import DocumentFactory
+from openkamer.document import DocumentHtml
+from openkamer.document import SubmitterBuilder
+import openkamer.document
 import openkamer.dossier
 import openkamer.kamerstuk
 import openkamer.kamervraag
 import openkamer.parliament
+import openkamer.parliament_swap
 import openkamer.voting
 import openkamer.gift
 import openkamer.verslagao
+import openkamer.journal
+import openkamer.parallel
+import openkamer.prefetch
+import openkamer.sync
+from openkamer.models import DossierSyncState
+from openkamer.models import ImportJournalEntry
+from openkamer.models import ImportRun
+from openkamer.update import UpdateSummary
+from openkamer.update import update_if_changed
+from openkamer.update import get_or_create_person_positions
+from openkamer.update import upsert_by_tk_id
+
+from wikidata.parliament import ParliamentData
+from wikidata.parliament import PartyData
 
 
 class TestCreatePerson(TestCase):
@@ -148,6 +179,31 @@ class TestCreateParliamentMember(TestCase):
         member.person.update_info()
         self.assertEqual(member.person.initials, 'P.H.M.')
 
+    def test_create_from_parliament_data(self):
+        person_wikidata_id = 'Q-person'
+        person = Person.objects.create(forename='Jan', surname='Jansen', wikidata_id=person_wikidata_id)
+        party_a = PoliticalParty.objects.create(name='Partij A', name_short='PA', wikidata_id='Q-party-a')
+        party_b = PoliticalParty.objects.create(name='Partij B', name_short='PB', wikidata_id='Q-party-b')
+        parliament_data = ParliamentData()
+        parliament_data.positions[person_wikidata_id] = [
+            {'id': 'Q18887908', 'start_time': datetime.date(2012, 9, 20), 'end_time': datetime.date(2017, 3, 22), 'part_of_id': 'Q-party-a'},
+            {'id': 'Q18887908', 'start_time': datetime.date(2017, 3, 23), 'end_time': None, 'part_of_id': 'Q-party-b'},
+        ]
+        parliament_data.memberships[person_wikidata_id] = [
+            {'party_wikidata_id': 'Q-party-a', 'start_date': datetime.date(2010, 1, 1), 'end_date': datetime.date(2017, 3, 22)},
+            {'party_wikidata_id': 'Q-party-youth', 'start_date': datetime.date(2005, 1, 1), 'end_date': None},
+        ]
+        parliament_data.parties['Q-party-a'] = PartyData('Q-party-a')
+        parliament_data.parties['Q-party-youth'] = PartyData('Q-party-youth')
+        parliament_data.parties['Q-party-youth'].is_youth_party = True
+        parliament = Parliament.get_or_create_tweede_kamer()
+        members = openkamer.parliament.create_parliament_member_from_wikidata_id(parliament, person_wikidata_id, parliament_data)
+        self.assertEqual(2, len(members))
+        self.assertEqual(party_a, members[0].party)
+        self.assertEqual(party_b, members[1].party)
+        self.assertEqual(3, PartyMember.objects.filter(person=person).count())
+        self.assertFalse(PartyMember.objects.filter(party__wikidata_id='Q-party-youth').exists())
+
     def test_create_kuzu(self):
         person_wikidata_id = 'Q616635'  # Tunahan Kuzu
         parliament = Parliament.get_or_create_tweede_kamer()
@@ -299,6 +355,35 @@ class TestKamervraag(TestCase):
         self.assertEqual(len(kamervragen), n_create)
         self.assertEqual(len(kamerantwoorden), n_create)
 
+    def test_create_for_zaken_pipeline_empty(self):
+        kamervragen, kamerantwoorden = openkamer.kamervraag.create_for_zaken_pipeline([], concurrency=4, batch_size=2)
+        self.assertEqual([], kamervragen)
+        self.assertEqual([], kamerantwoorden)
+
+    def test_document_html_single_parse(self):
+        content_html = """<div class="stuk">
+            <div class="vraag"><h2>Vraag 1</h2><p>Zie <a href="kst-33885-1.html">het wetsvoorstel</a>.<a class="nootnum" href="#n1">1</a></p></div>
+            <div class="voet noot" id="n1"><sup><span class="nootnum">1</span></sup><p><a href="http://nos.nl/l/2077649">nos</a></p></div>
+        </div>"""
+        content = DocumentHtml.from_html(content_html)
+        content.update_links()
+        self.assertEqual(['Zie het wetsvoorstel.1'], openkamer.kamervraag.get_vragen_texts(content.tree))
+        footnotes = openkamer.kamervraag.create_footnotes_from_tree(content.tree)
+        self.assertEqual([{'nr': '1', 'text': 'nos', 'url': 'http://nos.nl/l/2077649'}], footnotes)
+        self.assertEqual(openkamer.document.update_document_html_links(content_html), content.html)
+        self.assertIn('href="https://zoek.officielebekendmakingen.nl/kst-33885-1.html"', content.html)
+
+    def test_existing_overheidnl_document_ids(self):
+        document_vraag = Document.objects.create(document_id='kv-2016Z00001', content_html='')
+        document_antwoord = Document.objects.create(document_id='ah-tk-20152016-1', content_html='')
+        Document.objects.create(document_id='kst-33885-1', content_html='')
+        Kamervraag.objects.create(document=document_vraag, vraagnummer='2016Z00001')
+        Kamerantwoord.objects.create(document=document_antwoord, vraagnummer='2016Z00001')
+        self.assertEqual(
+            {'kv-2016Z00001', 'ah-tk-20152016-1'},
+            openkamer.kamervraag.get_existing_overheidnl_document_ids()
+        )
+
     @staticmethod
     def get_tk_zaak(zaak_nummer):
         filter = Zaak.create_filter()
@@ -489,6 +574,40 @@ class TestGifts(TestCase):
     def test_create_gifts(self):
         openkamer.gift.create_gifts(max_items=20)
 
+    def test_upsert_gifts(self):
+        person = Person.objects.create(forename='Jesse', surname='Klaver', initials='J.F.')
+        party = PoliticalParty.objects.create(name='GroenLinks', name_short='GL')
+        PartyMember.objects.create(person=person, party=party, joined=datetime.date(2010, 1, 1))
+        date = datetime.date(2018, 1, 1)
+        gift_legacy = Gift.objects.create(person=person, description='wijn', date=date, type=Gift.WIJN)
+        items = {
+            'tk-gift-1': {'person_id': person.id, 'description': 'boek', 'date': date, 'value_euro': 20.0, 'type': Gift.BOEK},
+            'tk-gift-2': {'person_id': person.id, 'description': 'wijn', 'date': date, 'value_euro': None, 'type': Gift.WIJN},
+        }
+
+        def upsert():
+            summary = UpdateSummary('gifts')
+            positions = get_or_create_person_positions(PersonPosition, [(person.id, date)], MembershipsAtDate(), summary)
+            for item in items.values():
+                item['person_position_id'] = positions[(person.id, date)]
+            upsert_by_tk_id(Gift, items, summary, legacy_fields=('person_id', 'date', 'description'))
+            return summary
+
+        summary = upsert()
+        self.assertEqual(1, summary.get('gifts', UpdateSummary.CREATED))
+        self.assertEqual(1, summary.get('gifts', UpdateSummary.UPDATED))
+        self.assertEqual('tk-gift-2', Gift.objects.get(id=gift_legacy.id).tk_id)
+        self.assertEqual(party, Gift.objects.get(tk_id='tk-gift-1').person_position.party)
+        with self.assertNumQueries(4):
+            summary = upsert()
+        self.assertFalse(summary.has_changes)
+        del items['tk-gift-2']
+        items['tk-gift-1']['value_euro'] = 25.0
+        summary = upsert()
+        self.assertEqual(1, summary.get('gifts', UpdateSummary.UPDATED))
+        self.assertEqual(1, summary.get('gifts', UpdateSummary.DELETED))
+        self.assertEqual(25.0, Gift.objects.get().value_euro)
+
 
 class TestVerslagAlgemeenOverleg(TestCase):
 
@@ -621,3 +740,493 @@ class TestFindTKAPIPerson(TestCase):
         )
         tkperson = openkamer.parliament.find_tkapi_person(person)
         self.assertIsNotNone(tkperson)
+
+
+class TestTKPersonSnapshot(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.snapshot = openkamer.parliament.TKPersonSnapshot([
+            TKPersoon({'Id': '1', 'Achternaam': 'Bijsterveldt-Vliegenthart', 'Initialen': 'J.M.', 'Voornamen': 'Johanna Maria', 'Roepnaam': 'Marja'}),
+            TKPersoon({'Id': '2', 'Achternaam': 'Vries', 'Initialen': 'A.', 'Voornamen': 'Aukje', 'Roepnaam': 'Aukje'}),
+            TKPersoon({'Id': '3', 'Achternaam': 'Vries', 'Initialen': 'J.M.', 'Voornamen': 'Jan Marinus', 'Roepnaam': 'Jan'}),
+            TKPersoon({'Id': '4', 'Achternaam': 'Vriesema', 'Initialen': 'J.', 'Voornamen': 'Jan', 'Roepnaam': 'Jan'}),
+        ])
+
+    def test_search(self):
+        self.assertEqual(['2', '3', '4'], [tk_person.id for tk_person in self.snapshot.search('vries')])
+        self.assertEqual(['1'], [tk_person.id for tk_person in self.snapshot.search('Vliegenthart')])
+        self.assertEqual([], self.snapshot.search('Samsom'))
+
+    def test_find_candidates(self):
+        self.assertEqual(['2', '3'], [tk_person.id for tk_person in self.snapshot.find_candidates('Vries')])
+        self.assertEqual(['1'], [tk_person.id for tk_person in self.snapshot.find_candidates('Bijsterveldt')])
+        self.assertEqual(['1'], [tk_person.id for tk_person in self.snapshot.find_candidates('Vliegenthart-Smit')])
+        self.assertEqual([], self.snapshot.find_candidates('Samsom'))
+
+    def test_find_person(self):
+        person = Person(forename='Jan', surname='Vries', initials='J.M.')
+        self.assertEqual('3', openkamer.parliament.find_tkapi_person(person, self.snapshot).id)
+        person = Person(forename='Marja', surname='Bijsterveldt', initials='J.M.')
+        self.assertEqual('1', openkamer.parliament.find_tkapi_person(person, self.snapshot).id)
+        person = Person(forename='Diederik', surname='Samsom')
+        self.assertIsNone(openkamer.parliament.find_tkapi_person(person, self.snapshot))
+
+
+class TestIncrementalUpdate(TestCase):
+
+    def test_update_if_changed(self):
+        dossier = Dossier.objects.create(dossier_id='33885', dossier_main_id='33885', title='Wet regulering')
+        document = Document.objects.create(
+            dossier=dossier,
+            document_id='kst-33885-2',
+            title_full='Voorstel van wet',
+            title_short='Voorstel van wet',
+            date_published=datetime.date(2014, 2, 10),
+        )
+        properties = {
+            'dossier': dossier,
+            'title_full': 'Voorstel van wet',
+            'date_published': datetime.datetime(2014, 2, 10, 0, 0),
+        }
+        self.assertFalse(update_if_changed(document, properties))
+        properties['title_full'] = 'Gewijzigd voorstel van wet'
+        self.assertTrue(update_if_changed(document, properties))
+        document.refresh_from_db()
+        self.assertEqual(document.title_full, 'Gewijzigd voorstel van wet')
+
+    def test_summary(self):
+        summary = UpdateSummary('33885')
+        summary.add('document', UpdateSummary.UNCHANGED, 3)
+        summary.add('voting', UpdateSummary.DELETED, 0)
+        self.assertFalse(summary.has_changes)
+        summary.add('voting', UpdateSummary.CREATED)
+        self.assertTrue(summary.has_changes)
+        self.assertEqual(summary.get('document', UpdateSummary.UNCHANGED), 3)
+        self.assertEqual(str(summary), '33885 | document: 3 unchanged | voting: 1 created')
+
+    def test_update_dossier_not_found(self):
+        dossier = Dossier.objects.create(dossier_id='33885', dossier_main_id='33885', title='Wet regulering')
+        summary = openkamer.dossier.update_dossier('33885', tk_data=openkamer.prefetch.TKDossierData('33885'))
+        self.assertFalse(summary.has_changes)
+        self.assertEqual(str(summary), '33885 | nothing to update')
+        dossier.refresh_from_db()
+        self.assertEqual(dossier.title, 'Wet regulering')
+
+
+class TestBulkVotes(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dossier = Dossier.objects.create(dossier_id='33885', dossier_main_id='33885', title='Wet regulering')
+        cls.party = PoliticalParty.objects.create(name='GroenLinks', name_short='GL')
+        cls.person = Person.objects.create(forename='Jesse', surname='Klaver', initials='J.F.', tk_id='tk-person-1')
+        parliament = Parliament.objects.create(name='Tweede Kamer')
+        PartyMember.objects.create(person=cls.person, party=cls.party)
+        ParliamentMember.objects.create(person=cls.person, parliament=parliament, joined=datetime.date(2010, 6, 17))
+        cls.member = ParliamentMember.objects.create(person=cls.person, parliament=parliament, joined=datetime.date(2017, 3, 23))
+
+    def create_voting(self, is_individual=False):
+        return Voting.objects.create(
+            dossier=self.dossier, result=Voting.AANGENOMEN, date=datetime.date(2017, 6, 1), is_individual=is_individual
+        )
+
+    def test_create_votes_party(self):
+        voting_other = self.create_voting()
+        VoteParty.objects.create(voting=voting_other, party_name='SP', number_of_seats=14, decision=Vote.FOR)
+        voting = self.create_voting()
+        stemmingen = [
+            TKStemming({'Id': '1', 'ActorFractie': 'GroenLinks', 'FractieGrootte': 14, 'Soort': 'Voor', 'Vergissing': None}),
+            TKStemming({'Id': '2', 'ActorFractie': 'Onbekend', 'FractieGrootte': 1, 'Soort': 'Tegen', 'Vergissing': True}),
+        ]
+        vote_factory = openkamer.voting.VoteFactory(do_create_missing_party=False)
+        vote_factory.create_votes_party(voting, stemmingen)
+        votes = list(VoteParty.objects.filter(voting=voting).order_by('id'))
+        self.assertEqual(2, len(votes))
+        self.assertEqual(
+            [('GroenLinks', self.party.id, 14, Vote.FOR, False), ('Onbekend', None, 1, Vote.AGAINST, True)],
+            [(vote.party_name, vote.party_id, vote.number_of_seats, vote.decision, vote.is_mistake) for vote in votes]
+        )
+        self.assertEqual(3, Vote.objects.count())
+        self.assertFalse(vote_factory.votes_changed(voting, stemmingen))
+
+    def test_bulk_create_votes(self):
+        voting_other = self.create_voting()
+        vote_other = VoteParty.objects.create(voting=voting_other, party_name='SP', number_of_seats=14, decision=Vote.FOR)
+        voting = self.create_voting()
+        votes = [
+            VoteParty(voting=voting, party_name=name, party=party, number_of_seats=seats, decision=Vote.FOR)
+            for name, party, seats in [('GroenLinks', self.party, 14), ('PvdA', None, 9), ('D66', None, 19)]
+        ]
+        openkamer.voting.bulk_create_votes(voting, votes)
+        votes_created = list(VoteParty.objects.filter(voting=voting).order_by('id'))
+        self.assertEqual([vote.id for vote in votes], [vote.id for vote in votes_created])
+        self.assertTrue(all(vote.id > vote_other.id for vote in votes))
+        self.assertEqual(['GroenLinks', 'PvdA', 'D66'], [vote.party_name for vote in votes_created])
+        self.assertEqual(self.party, votes_created[0].party)
+        self.assertEqual(4, Vote.objects.count())
+        votes[0].party_name = 'GL'
+        votes[0].save()
+        self.assertEqual('GL', VoteParty.objects.get(id=votes[0].id).party_name)
+
+    def test_create_votes_individual(self):
+        voting = self.create_voting(is_individual=True)
+        stemming = TKStemming({
+            'Id': '1', 'Soort': 'Niet deelgenomen', 'Vergissing': False,
+            'Persoon@odata.navigationLink': 'Stemming(1)/Persoon',
+            'Persoon': {'Id': 'tk-person-1', 'Achternaam': 'Klaver', 'Initialen': 'J.F.', 'Verwijderd': False},
+        })
+        openkamer.voting.VoteFactory().create_votes_individual(voting, [stemming])
+        vote = VoteIndividual.objects.get(voting=voting)
+        self.assertEqual(self.member, vote.parliament_member)
+        self.assertEqual('Jesse Klaver J.F.', vote.person_name)
+        self.assertEqual('tk-person-1', vote.person_tk_id)
+        self.assertEqual(Vote.NONE, vote.decision)
+
+    def test_set_votes_derived_info(self):
+        voting = self.create_voting(is_individual=True)
+        voting_old = Voting.objects.create(dossier=self.dossier, result=Voting.AANGENOMEN, date=datetime.date(2012, 6, 1))
+        member_old = ParliamentMember.objects.get(person=self.person, joined=datetime.date(2010, 6, 17))
+        ParliamentMember.objects.filter(id=member_old.id).update(left=datetime.date(2017, 3, 23))
+        vote_kwargs = {'person_name': 'Klaver', 'person_tk_id': 'tk-person-1', 'number_of_seats': 1, 'decision': Vote.FOR}
+        VoteIndividual.objects.create(voting=voting, parliament_member=member_old, **vote_kwargs)
+        VoteIndividual.objects.create(voting=voting_old, parliament_member=None, **vote_kwargs)
+        VoteIndividual.objects.create(voting=voting, parliament_member=self.member, **vote_kwargs)
+        VoteIndividual.objects.create(voting=voting, person_name='Onbekend', person_tk_id='tk-unknown', number_of_seats=1, decision=Vote.FOR)
+        VoteParty.objects.create(voting=voting, party_name='GroenLinks', number_of_seats=14, decision=Vote.FOR)
+        VoteParty.objects.create(voting=voting, party_name='GL', party=self.party, number_of_seats=14, decision=Vote.FOR)
+        VoteParty.objects.create(voting=voting, party_name='Onbekend', party=self.party, number_of_seats=1, decision=Vote.FOR)
+        with self.assertNumQueries(5):  # a select and an update per parliament member, in a transaction
+            self.assertEqual(2, openkamer.parliament.set_individual_votes_derived_info())
+        self.assertEqual(
+            [self.member.id, member_old.id, self.member.id, None],
+            list(VoteIndividual.objects.order_by('id').values_list('parliament_member_id', flat=True))
+        )
+        self.assertEqual(2, openkamer.parliament.set_party_votes_derived_info())
+        self.assertEqual(
+            [self.party.id, self.party.id, None], list(VoteParty.objects.order_by('id').values_list('party_id', flat=True))
+        )
+        self.assertEqual(0, openkamer.parliament.set_individual_votes_derived_info())
+        self.assertEqual(0, openkamer.parliament.set_party_votes_derived_info())
+
+
+class TestSubmitterBuilder(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.party = PoliticalParty.objects.create(name='GroenLinks', name_short='GL')
+        cls.person = Person.objects.create(forename='Jesse', surname='Klaver', initials='J.F.', tk_id='tk-person-1')
+        cls.person_other = Person.objects.create(forename='Bram', surname='van Ojik', initials='B.', tk_id='tk-person-2')
+        PartyMember.objects.create(person=cls.person, party=cls.party, joined=datetime.date(2010, 6, 17))
+        cls.tk_person = TKPersoon({'Id': 'tk-person-1', 'Achternaam': 'Klaver', 'Initialen': 'J.F.'})
+        cls.tk_person_other = TKPersoon({'Id': 'tk-person-2', 'Achternaam': 'Ojik', 'Initialen': 'B.'})
+
+    def test_write(self):
+        documents = [
+            Document.objects.create(document_id='kst-33885-{}'.format(i), date_published=datetime.date(2017, 6, 1))
+            for i in range(1, 4)
+        ]
+        builder = SubmitterBuilder()
+        for document in documents:
+            builder.add(document, tk_person=self.tk_person)
+            builder.add(document, tk_person=self.tk_person_other)
+        with self.assertNumQueries(8):
+            summary = builder.write()
+        self.assertEqual(6, summary.get('submitter', UpdateSummary.CREATED))
+        self.assertEqual(3, Submitter.objects.filter(person=self.person, party_slug=self.party.slug).count())
+        self.assertEqual(3, Submitter.objects.filter(person=self.person_other, party_slug='').count())
+
+        for document in documents:
+            builder.add(document, tk_person=self.tk_person)
+            builder.add(document, tk_person=self.tk_person_other)
+        summary = builder.write()
+        self.assertFalse(summary.has_changes)
+        self.assertEqual(6, summary.get('submitter', UpdateSummary.UNCHANGED))
+
+        builder.add(documents[0], tk_person=self.tk_person)
+        builder.add_key(documents[1], Submitter.SUBMITTER)
+        summary = builder.write()
+        self.assertEqual(3, summary.get('submitter', UpdateSummary.DELETED))
+        self.assertEqual(1, Submitter.objects.filter(document=documents[0]).count())
+        self.assertEqual(0, Submitter.objects.filter(document=documents[1]).count())
+        self.assertEqual(2, Submitter.objects.filter(document=documents[2]).count())
+
+
+class TestDossierSync(TestCase):
+
+    def test_dossiers_filter(self):
+        path = [('Besluit', False), ('Zaak', True), ('Kamerstukdossier', True)]
+        filter_str = openkamer.sync.create_dossiers_filter(path, ['33885', '35300-XVI'])
+        self.assertEqual(
+            filter_str,
+            "Besluit/Zaak/any(x2: x2/Kamerstukdossier/any(x1: (x1/Nummer eq 33885) or (x1/Nummer eq 35300 and x1/Toevoeging eq 'XVI')))"
+        )
+        self.assertEqual(openkamer.sync.create_dossiers_filter([], ['33885']), '(Nummer eq 33885)')
+        self.assertEqual(
+            openkamer.sync.create_dossiers_expand(path),
+            'Besluit($select=Id;$expand=Zaak($select=Id;$expand=Kamerstukdossier($select=Nummer,Toevoeging)))'
+        )
+
+    def test_match_dossiers(self):
+        path = [('Zaak', True), ('Kamerstukdossier', True)]
+        item_json = {'Id': 'a', 'Zaak': [{'Id': 'b', 'Kamerstukdossier': [{'Nummer': 35300, 'Toevoeging': 'XVI'}]}]}
+        dossier_jsons = openkamer.sync.get_dossier_jsons(item_json, path)
+        self.assertEqual(len(dossier_jsons), 1)
+        dossier_ids = ['35300', '35300-XVI', '35300-XV', '33885']
+        self.assertEqual(openkamer.sync.match_dossier_ids(dossier_jsons[0], dossier_ids), ['35300', '35300-XVI'])
+
+    def test_changed_dossiers_without_sync_state(self):
+        Dossier.objects.create(dossier_id='33885', dossier_main_id='33885')
+        changed = openkamer.sync.get_changed_dossiers(['33885', '33506'])
+        self.assertEqual(changed, {'33885': None, '33506': None})
+
+    def test_set_dossier_synced(self):
+        sync_start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        openkamer.sync.set_dossier_synced('33885', None, sync_start)
+        state = DossierSyncState.objects.get(dossier_id='33885')
+        self.assertEqual(state.upstream_modified, sync_start - openkamer.sync.CLOCK_SKEW_MARGIN)
+        upstream_modified = datetime.datetime(2020, 2, 1, tzinfo=datetime.timezone.utc)
+        openkamer.sync.set_dossier_synced('33885', upstream_modified, sync_start)
+        state.refresh_from_db()
+        self.assertEqual(state.upstream_modified, upstream_modified)
+
+
+class TestImportJournal(TestCase):
+
+    def test_resume(self):
+        name = ImportRun.WETSVOORSTELLEN_ALL
+        self.assertIsNone(openkamer.journal.get_resumable_run(name))
+        run = openkamer.journal.start_run(name, ['33885', '33506', '34344'])
+        openkamer.journal.set_done(run, '33885')
+        openkamer.journal.set_failed(run, '33506', 'error')
+        resumed = openkamer.journal.get_resumable_run(name)
+        self.assertEqual(resumed, run)
+        self.assertEqual(resumed.get_todo_dossier_ids(), ['33506', '34344'])
+        self.assertEqual(ImportJournalEntry.objects.get(run=run, dossier_id='33506').error, 'error')
+        openkamer.journal.set_done(run, '33506')
+        openkamer.journal.set_done(run, '34344')
+        openkamer.journal.finish_run(run)
+        self.assertTrue(run.is_finished)
+        self.assertEqual(run.get_status_counts(), {ImportJournalEntry.DONE: 3})
+        self.assertIsNone(openkamer.journal.get_resumable_run(name))
+
+    def test_progress(self):
+        progress = openkamer.journal.ImportProgress(total=2)
+        progress.step()
+        self.assertEqual(progress.processed, 1)
+        self.assertGreater(progress.rate_per_minute, 0)
+
+
+class TestParallelImport(TestCase):
+
+    def test_single_writer_on_sqlite(self):
+        self.assertFalse(openkamer.parallel.can_run_parallel())
+        results = list(openkamer.parallel.map_unordered(str.upper, ['a', 'b', 'c'], workers=4))
+        self.assertEqual(results, ['A', 'B', 'C'])
+
+    def test_dossiers_prefetched(self):
+        # these dossier ids can not be used in a TK API filter, they are not prefetched
+        dossier_ids = ['a{}'.format(i) for i in range(5)]
+        slots = threading.Semaphore(2)
+        dossiers_prefetched = openkamer.dossier.iter_dossiers_prefetched(dossier_ids, 2, slots, threading.Event())
+        results = []
+        for dossier_id, tk_data in openkamer.parallel.map_unordered(lambda item: item, dossiers_prefetched, workers=1):
+            slots.release()
+            results.append(dossier_id)
+            self.assertIsNone(tk_data)
+        self.assertEqual(results, dossier_ids)
+        self.assertTrue(slots.acquire(blocking=False))
+        self.assertTrue(slots.acquire(blocking=False))
+
+    def test_dossiers_prefetched_stop(self):
+        # with workers, a thread of the pool consumes the dossiers and waits for a slot
+        slots = threading.Semaphore(1)
+        stop = threading.Event()
+        dossiers_prefetched = openkamer.dossier.iter_dossiers_prefetched(['a0', 'a1', 'a2'], 2, slots, stop)
+        consumer = threading.Thread(target=list, args=(dossiers_prefetched,))
+        consumer.start()
+        consumer.join(timeout=0.5)
+        self.assertTrue(consumer.is_alive())
+        stop.set()
+        consumer.join(timeout=5)
+        self.assertFalse(consumer.is_alive())
+
+    def test_import_dossiers_prefetched_writer_error(self):
+        dossier_ids = ['a{}'.format(i) for i in range(5)]
+        results = openkamer.dossier.import_dossiers_prefetched(lambda item: item, dossier_ids, 2, workers=1)
+        with self.assertRaises(ValueError):
+            for dossier_id, tk_data in results:
+                raise ValueError('writer error for dossier {}'.format(dossier_id))
+        results.close()
+        self.assertEqual(list(results), [])
+
+    def test_document_executor(self):
+        executor = openkamer.dossier.get_document_executor()
+        self.assertIs(executor, openkamer.dossier.get_document_executor())
+        self.assertEqual([], openkamer.dossier.get_documents_data([], '33885'))
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # the threads of the executor are not forked, the child creates its own executor
+            try:
+                os.write(write_fd, b'1' if openkamer.dossier.get_document_executor() is not executor else b'0')
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        result = os.read(read_fd, 1)
+        os.waitpid(pid, 0)
+        os.close(read_fd)
+        self.assertEqual(b'1', result)
+
+    def test_shared_lookup_lock_outside_worker(self):
+        self.assertFalse(openkamer.parallel.acquire_shared_lookup_lock())
+        openkamer.parallel.release_shared_lookup_lock()
+
+
+class TestDossierPrefetch(TestCase):
+
+    @staticmethod
+    def create_besluit_json(tk_id, zaak_jsons, stemming_jsons, begin):
+        return {
+            'Id': tk_id, 'BesluitTekst': 'Aangenomen.', 'Verwijderd': False,
+            'Zaak': zaak_jsons,
+            'Stemming': stemming_jsons,
+            'Agendapunt': {
+                'Id': 'agendapunt-' + tk_id, 'Verwijderd': False,
+                'Activiteit': {'Id': 'activiteit-' + tk_id, 'Status': 'Uitgevoerd', 'Aanvangstijd': begin, 'Verwijderd': False},
+            },
+        }
+
+    def test_dossier_data(self):
+        dossier_json = {'Id': 'dossier-a', 'Nummer': 34000, 'Toevoeging': None, 'Titel': 'Test dossier', 'Verwijderd': False}
+        dossier_jsons = [dossier_json]
+        zaak_jsons = [
+            {
+                'Id': 'zaak-a', 'Volgnummer': 0, 'Verwijderd': False,
+                'Kamerstukdossier': [dict(dossier_json)],
+                'Document': [{'Id': 'document-a', 'Volgnummer': 1, 'Verwijderd': False}, {'Id': 'document-b', 'Verwijderd': True}],
+            },
+            {
+                'Id': 'zaak-b', 'Volgnummer': 5, 'Verwijderd': False,
+                'Kamerstukdossier': [dict(dossier_json)],
+                'Document': [],
+            },
+        ]
+        besluit_jsons = [
+            self.create_besluit_json(
+                'besluit-a', [{'Id': 'zaak-a', 'Volgnummer': 0, 'Verwijderd': False}],
+                [{'Id': 'stemming-a', 'Soort': 'Voor', 'Verwijderd': False}], '2018-03-01T10:00:00'
+            ),
+            self.create_besluit_json(
+                'besluit-b',
+                [{'Id': 'zaak-a', 'Volgnummer': 0, 'Verwijderd': False}, {'Id': 'zaak-b', 'Volgnummer': 5, 'Verwijderd': False}],
+                [], '2018-04-01T10:00:00'
+            ),
+        ]
+        for item_json in dossier_jsons + zaak_jsons + besluit_jsons:
+            openkamer.prefetch.add_navigation_links(item_json)
+        dossiers_data = openkamer.prefetch.create_dossiers_data(['34000', '35000'], dossier_jsons, zaak_jsons, besluit_jsons)
+        self.assertEqual(list(dossiers_data.keys()), ['34000', '35000'])
+        self.assertEqual(dossiers_data['35000'].tk_dossiers, [])
+        tk_data = dossiers_data['34000']
+        tk_dossier = tk_data.get_dossier()
+        self.assertEqual(tk_dossier.titel, 'Test dossier')
+        self.assertEqual([tk_zaak.id for tk_zaak in tk_dossier.zaken], ['zaak-a', 'zaak-b'])
+        self.assertEqual([tk_document.id for tk_document in tk_dossier.zaken[0].documenten], ['document-a'])
+        self.assertEqual([tk_besluit.id for tk_besluit in tk_dossier.zaken[1].besluiten], ['besluit-b'])
+        self.assertEqual([tk_besluit.id for tk_besluit in tk_data.get_besluiten()], ['besluit-a', 'besluit-b'])
+        self.assertEqual([tk_besluit.id for tk_besluit in tk_data.get_besluiten_with_stemmingen()], ['besluit-a'])
+        tk_besluit = tk_data.get_besluiten()[0]
+        self.assertEqual(tk_besluit.zaak.volgnummer, '0')
+        self.assertEqual(tk_besluit.stemmingen[0].soort, 'Voor')
+        self.assertEqual(openkamer.dossier.get_besluit_last('34000', tk_data=tk_data).id, 'besluit-b')
+        self.assertEqual(openkamer.dossier.get_besluit_last_with_voting('34000', tk_data=tk_data).id, 'besluit-a')
+        self.assertEqual(openkamer.dossier.get_dossier_decision_text('34000', None, tk_data=tk_data), 'Aangenomen')
+
+
+class TestParliamentSwap(TestCase):
+
+    def setUp(self):
+        self.person_a = Person.objects.create(forename='Jan', surname='Jansen', wikidata_id='Q-a')
+        self.person_b = Person.objects.create(forename='Piet', surname='Pietersen', wikidata_id='Q-b')
+        self.party = PoliticalParty.objects.create(tk_id='tk-party', name='Partij', name_short='P')
+        self.party_old = PoliticalParty.objects.create(tk_id='tk-party-old', name='Oude Partij', name_short='OP')
+        parliament = Parliament.get_or_create_tweede_kamer()
+        self.member_a = ParliamentMember.objects.create(person=self.person_a, parliament=parliament, joined=datetime.date(2017, 3, 23))
+        self.member_b = ParliamentMember.objects.create(
+            person=self.person_b, parliament=parliament, joined=datetime.date(2012, 9, 20), left=datetime.date(2017, 3, 22)
+        )
+        PartyMember.objects.create(person=self.person_b, party=self.party_old, joined=datetime.date(2012, 9, 20))
+
+    def create_dataset(self):
+        dataset = openkamer.parliament_swap.ParliamentDataset()
+        party = PoliticalParty(tk_id='tk-party', name='Partij', name_short='PA')
+        party_new = PoliticalParty(tk_id='tk-party-new', name='Nieuwe Partij', name_short='NP')
+        dataset.add_party(party)
+        dataset.add_party(party_new)
+        dataset.add_parliament_member(self.person_a.id, datetime.date(2017, 3, 23), None)
+        dataset.add_parliament_member(self.person_b.id, datetime.date(2012, 9, 20), datetime.date(2017, 3, 21))
+        dataset.add_party_member(self.person_a.id, party, datetime.date(2017, 3, 23), None)
+        dataset.add_party_member(self.person_b.id, party_new, datetime.date(2012, 9, 20), None)
+        return dataset
+
+    def validate(self, dataset, **kwargs):
+        """ validates with limits for the small test dataset, that removes one of two parliament members and parties """
+        limits = {'seats_tolerance': openkamer.parliament_swap.PARLIAMENT_SEATS - 1, 'max_removed_fraction': 0.5, 'max_overlapping': 0}
+        limits.update(kwargs)
+        return dataset.validate(**limits)
+
+    def test_validate(self):
+        dataset = self.create_dataset()
+        self.assertEqual([], self.validate(dataset))
+        self.assertEqual(1, dataset.get_current_seats())
+        self.assertEqual(3, len(dataset.validate()))  # too few seats, too many members and parties removed
+        self.assertEqual(2, len(self.validate(dataset, max_removed_fraction=0.4)))
+        dataset.add_parliament_member(self.person_b.id, datetime.date(2017, 1, 1), None)
+        self.assertEqual([(self.person_b.id, datetime.date(2017, 1, 1), datetime.date.max)], dataset.get_overlapping_parliament_members())
+        self.assertEqual(1, len(self.validate(dataset)))
+        self.assertEqual([], self.validate(dataset, max_overlapping=1))
+        for i in range(openkamer.parliament_swap.PARLIAMENT_SEATS):
+            dataset.add_parliament_member(1000 + i, datetime.date(2017, 3, 23), None)
+        self.assertEqual(1, len(self.validate(dataset, max_overlapping=1)))
+        self.assertEqual(3, len(self.validate(openkamer.parliament_swap.ParliamentDataset(), max_removed_fraction=1)))
+
+    def test_validate_partial_build(self):
+        dataset = self.create_dataset()
+        for i in range(openkamer.parliament_swap.PARLIAMENT_SEATS - 20):
+            dataset.add_parliament_member(1000 + i, datetime.date(2017, 3, 23), None)
+        errors = dataset.validate(max_removed_fraction=0.5)
+        self.assertEqual(1, len(errors))
+        self.assertIn('less than', errors[0])
+        self.assertEqual([], dataset.validate(seats_tolerance=20, max_removed_fraction=0.5))
+        self.assertFalse(ParliamentMember.objects.filter(person_id__gte=1000).exists())
+
+    def test_find_party(self):
+        dataset = self.create_dataset()
+        self.assertEqual('tk-party-new', dataset.find_party(name='nieuwe partij').tk_id)
+        self.assertEqual('tk-party-new', dataset.find_party(name='NP').tk_id)
+        self.assertIsNone(dataset.find_party('Q-party'))
+        dataset.add_wikidata_id(dataset.find_party(name='NP'), 'Q-party')
+        self.assertEqual('tk-party-new', dataset.find_party('Q-party').tk_id)
+
+    def test_swap(self):
+        PersonPosition.objects.bulk_create([  # save() derives the party and member
+            PersonPosition(person=self.person_b, party=self.party_old, parliament_member=self.member_b, date=datetime.date(2015, 1, 1))
+        ])
+        summary = UpdateSummary('parliament')
+        openkamer.parliament_swap.swap_dataset(self.create_dataset(), summary)
+        object_type = PoliticalParty._meta.verbose_name_plural
+        self.assertEqual(1, summary.get(object_type, UpdateSummary.UPDATED))
+        self.assertEqual(1, summary.get(object_type, UpdateSummary.CREATED))
+        self.assertEqual(1, summary.get(object_type, UpdateSummary.DELETED))
+        self.assertEqual('PA', PoliticalParty.objects.get(id=self.party.id).name_short)
+        self.assertFalse(PoliticalParty.objects.filter(id=self.party_old.id).exists())
+        self.assertTrue(ParliamentMember.objects.filter(id=self.member_a.id).exists())
+        self.assertFalse(ParliamentMember.objects.filter(id=self.member_b.id).exists())
+        member_b = ParliamentMember.objects.get(person=self.person_b)
+        self.assertEqual(datetime.date(2017, 3, 21), member_b.left)
+        self.assertEqual(2, PartyMember.objects.count())
+        self.assertEqual('tk-party-new', PartyMember.objects.get(person=self.person_b).party.tk_id)
+        position = PersonPosition.objects.get(person=self.person_b)
+        self.assertIsNone(position.party_id)
+        self.assertEqual(member_b.id, position.parliament_member_id)
@@ -6,32 +6,59 @@ from tkapi import TKApi
 from tkapi.persoon import PersoonReis
 
 from person.models import Person
+from parliament.models import MembershipsAtDate
 from travel.models import Travel, TravelPersonPosition
 
+from openkamer.update import UpdateSummary
+from openkamer.update import get_or_create_person_positions
+from openkamer.update import upsert_by_tk_id
+
 logger = logging.getLogger(__name__)
 
 
+MIN_EXPECTED_TRAVELS = 1000
+
+
 @transaction.atomic
 def create_travels(max_items=None):
-    travels = TKApi.get_items(PersoonReis, max_items=max_items)
-    logger.info('{} travels found.'.format(len(travels)))
-    if len(travels) < 1000:
-        logger.error('Only {} travels found. This is unexpected. Skip re-creating travels.'.format(len(travels)))
-    Travel.objects.all().delete()
-    TravelPersonPosition.objects.all().delete()
-    for travel in travels:
-        person = Person.find_surname_initials(travel.persoon.achternaam, travel.persoon.initialen)
+    """
+    Creates, updates and deletes travels to match the travels of the TK API, by TK id.
+    Unchanged travels are not written. Travels are only deleted for a complete import.
+    """
+    logger.info('BEGIN')
+    summary = UpdateSummary('travels')
+    tk_travels = TKApi.get_items(PersoonReis, max_items=max_items)
+    logger.info('{} travels found.'.format(len(tk_travels)))
+    delete_missing = max_items is None and len(tk_travels) >= MIN_EXPECTED_TRAVELS
+    if max_items is None and not delete_missing:
+        logger.error('Only {} travels found. This is unexpected. Skip deleting travels.'.format(len(tk_travels)))
+    items = {}
+    for tk_travel in tk_travels:
+        person = Person.find_surname_initials(tk_travel.persoon.achternaam, tk_travel.persoon.initialen)
         if person is None:
-            logger.warning('No person found for travel: {}'.format(travel.id))
+            logger.warning('No person found for travel: {}'.format(tk_travel.id))
             continue
-        if travel.van is None or travel.tot_en_met is None:
-            logger.warning('No date found for travel: {}'.format(travel.id))
+        if tk_travel.van is None or tk_travel.tot_en_met is None:
+            logger.warning('No date found for travel: {}'.format(tk_travel.id))
             continue
-        Travel.objects.create(
-            person=person,
-            destination=travel.bestemming,
-            purpose=travel.doel,
-            paid_by=travel.betaald_door,
-            date_begin=travel.van,
-            date_end=travel.tot_en_met,
-        )
+        items[tk_travel.id] = {
+            'person_id': person.id,
+            'destination': tk_travel.bestemming,
+            'purpose': tk_travel.doel,
+            'paid_by': tk_travel.betaald_door,
+            'date_begin': tk_travel.van,
+            'date_end': tk_travel.tot_en_met,
+        }
+    positions = get_or_create_person_positions(
+        TravelPersonPosition, [(item['person_id'], item['date_begin']) for item in items.values()], MembershipsAtDate(), summary
+    )
+    for item in items.values():
+        item['person_position_id'] = positions[(item['person_id'], item['date_begin'])]
+    upsert_by_tk_id(
+        Travel, items, summary, delete_missing=delete_missing, legacy_fields=('person_id', 'date_begin', 'destination', 'purpose')
+    )
+    if delete_missing:
+        TravelPersonPosition.objects.filter(travel__isnull=True).delete()
+    logger.info(summary)
+    logger.info('END')
+    return summary
@@ -0,0 +1,159 @@
+import collections
+import datetime
+import logging
+from itertools import chain
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateSummary(object):
+    """ Counts the created, updated, deleted and unchanged objects per type during an incremental update """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    UNCHANGED = 'unchanged'
+    ACTIONS = (CREATED, UPDATED, DELETED, UNCHANGED)
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = collections.OrderedDict()
+
+    def add(self, object_type, action, count=1):
+        assert action in self.ACTIONS
+        if object_type not in self.counts:
+            self.counts[object_type] = collections.Counter()
+        self.counts[object_type][action] += count
+
+    def get(self, object_type, action):
+        return self.counts.get(object_type, collections.Counter())[action]
+
+    @property
+    def has_changes(self):
+        for counter in self.counts.values():
+            if counter[self.CREATED] or counter[self.UPDATED] or counter[self.DELETED]:
+                return True
+        return False
+
+    def __str__(self):
+        parts = []
+        for object_type, counter in self.counts.items():
+            actions = ', '.join('{} {}'.format(counter[action], action) for action in self.ACTIONS if counter[action])
+            parts.append('{}: {}'.format(object_type, actions))
+        return '{} | {}'.format(self.name, ' | '.join(parts) if parts else 'nothing to update')
+
+
+def update_if_changed(instance, properties) -> bool:
+    """
+    Sets the given properties on the model instance and saves it, only if one of the values differs from the stored value.
+    Values are compared after conversion to the field type, a datetime compares equal to its date for a DateField.
+    """
+    changed = set_if_changed(instance, properties)
+    if changed:
+        instance.save()
+    return changed
+
+
+def set_if_changed(instance, properties) -> bool:
+    """ update_if_changed without saving, returns True if one of the properties is changed """
+    changed = False
+    for name, value in properties.items():
+        field = instance._meta.get_field(name)
+        if field.is_relation:
+            current = getattr(instance, field.attname)
+            new = value.pk if value is not None and name != field.attname else value
+        else:
+            current = getattr(instance, name)
+            new = field.to_python(value)
+            if settings.USE_TZ and isinstance(new, datetime.datetime) and timezone.is_naive(new):
+                new = timezone.make_aware(new)
+        if current != new:
+            setattr(instance, name, value)
+            changed = True
+    return changed
+
+
+def upsert_by_tk_id(model, items, summary: UpdateSummary, delete_missing=True, legacy_fields=None, batch_size=500):
+    """
+    Creates, updates and deletes the rows of a model with a tk_id field, to match the given items.
+    Unchanged rows are not written, new rows are bulk inserted, changed rows are bulk updated.
+    Model save() methods are not called.
+    :param items: dict of tk_id to a dict of field values, relations as <name>_id
+    :param delete_missing: delete the rows with a tk_id that is not in items
+    :param legacy_fields: the fields that identify a row that has no tk_id yet, it is assigned the tk_id of the matching item
+    """
+    object_type = model._meta.verbose_name_plural
+    existing = {}
+    legacy = {}
+    for instance in model.objects.all():
+        if instance.tk_id:
+            existing[instance.tk_id] = instance
+        elif legacy_fields:
+            legacy.setdefault(tuple(getattr(instance, name) for name in legacy_fields), instance)
+    new_instances = []
+    changed_instances = []
+    fields_changed = set()
+    for tk_id, properties in items.items():
+        instance = existing.pop(tk_id, None)
+        if instance is None and legacy:
+            instance = legacy.pop(tuple(model._meta.get_field(name).to_python(properties[name]) for name in legacy_fields), None)
+            if instance is not None:
+                instance.tk_id = tk_id
+                fields_changed.add('tk_id')
+                set_if_changed(instance, properties)
+                fields_changed.update(properties.keys())
+                changed_instances.append(instance)
+                continue
+        if instance is None:
+            new_instances.append(model(tk_id=tk_id, **properties))
+        elif set_if_changed(instance, properties):
+            fields_changed.update(properties.keys())
+            changed_instances.append(instance)
+        else:
+            summary.add(object_type, UpdateSummary.UNCHANGED)
+    model.objects.bulk_create(new_instances, batch_size=batch_size)
+    summary.add(object_type, UpdateSummary.CREATED, len(new_instances))
+    if changed_instances:
+        model.objects.bulk_update(
+            changed_instances, sorted({model._meta.get_field(name).name for name in fields_changed}), batch_size=batch_size
+        )
+        summary.add(object_type, UpdateSummary.UPDATED, len(changed_instances))
+    if delete_missing:
+        deleted_ids = [instance.id for instance in chain(existing.values(), legacy.values())]
+        for i in range(0, len(deleted_ids), batch_size):
+            model.objects.filter(id__in=deleted_ids[i:i + batch_size]).delete()
+        summary.add(object_type, UpdateSummary.DELETED, len(deleted_ids))
+
+
+def get_or_create_person_positions(model, person_dates, memberships, summary: UpdateSummary, batch_size=500):
+    """
+    Returns a dict of (person id, date) to the id of the person position at that date, with the party and parliament member
+    at that date, for gift and travel person position models.
+    Missing positions are bulk inserted, existing positions are only updated if the membership has changed.
+    :param memberships: a MembershipsAtDate
+    """
+    object_type = model._meta.verbose_name_plural
+    positions = {(position.person_id, position.date): position for position in model.objects.all()}
+    new_positions = []
+    changed_positions = []
+    for person_id, date in set(person_dates):
+        properties = {
+            'party_id': memberships.get_party_id(person_id, date),
+            'parliament_member_id': memberships.get_parliament_member_id(person_id, date),
+        }
+        position = positions.get((person_id, date))
+        if position is None:
+            new_positions.append(model(person_id=person_id, date=date, **properties))
+        elif position.party_id != properties['party_id'] or position.parliament_member_id != properties['parliament_member_id']:
+            position.party_id = properties['party_id']
+            position.parliament_member_id = properties['parliament_member_id']
+            changed_positions.append(position)
+    model.objects.bulk_create(new_positions, batch_size=batch_size)
+    model.objects.bulk_update(changed_positions, ['party', 'parliament_member'], batch_size=batch_size)
+    summary.add(object_type, UpdateSummary.CREATED, len(new_positions))
+    summary.add(object_type, UpdateSummary.UPDATED, len(changed_positions))
+    if new_positions:  # the ids of bulk inserted rows are not set for all databases
+        positions = {(position.person_id, position.date): position for position in model.objects.all()}
+    return {key: position.id for key, position in positions.items()}
@@ -1,6 +1,10 @@
+import collections
 import logging
+from typing import List
 
+from django.db import connections
 from django.db import transaction
+from django.db.models import Max
 
 from wikidata import wikidata
 
@@ -21,9 +25,15 @@ from document.models import VoteIndividual
 from document.models import VoteParty
 from document.models import Voting
 
+import openkamer.parallel
+from openkamer.prefetch import TKDossierData
+from openkamer.update import UpdateSummary
+from openkamer.update import update_if_changed
 
 logger = logging.getLogger(__name__)
 
+BULK_CREATE_BATCH_SIZE = 500
+
 
 def clean_voting_results(voting_results, dossier_id):
     """ Removes votings for other dossiers and duplicate controversial dossier votings """
@@ -37,17 +47,59 @@ def clean_voting_results(voting_results, dossier_id):
     return voting_results_cleaned
 
 
+@transaction.atomic
+def bulk_create_votes(voting: Voting, votes):
+    """
+    Inserts new votes of the voting, all of the same Vote subclass, with a few queries.
+    Django can not bulk create multi-table inherited models,
+    the Vote rows are bulk created first and then the subclass rows with the primary keys of the Vote rows.
+    """
+    if not votes:
+        return
+    model = type(votes[0])
+    parent_fields = [field for field in Vote._meta.concrete_fields if not field.primary_key]
+    parents = [Vote(**{field.attname: getattr(vote, field.attname) for field in parent_fields}) for vote in votes]
+    connection = connections[Vote.objects.db]
+    if connection.features.can_return_ids_from_bulk_insert:
+        Vote.objects.bulk_create(parents, batch_size=BULK_CREATE_BATCH_SIZE)
+    else:
+        # the ids of a bulk insert are not returned (SQLite), the votes get an explicit range of new ids,
+        # taken under the shared lookup lock that is held until the task of a worker is done
+        openkamer.parallel.acquire_shared_lookup_lock()
+        id_first = (Vote.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        for i, parent in enumerate(parents):
+            parent.id = id_first + i
+        Vote.objects.bulk_create(parents, batch_size=BULK_CREATE_BATCH_SIZE)
+        n_created = Vote.objects.filter(voting=voting, id__gte=id_first, id__lt=id_first + len(parents)).count()
+        assert n_created == len(parents), '{} votes created while {} expected'.format(n_created, len(parents))
+    for vote, parent in zip(votes, parents):
+        vote.id = parent.id
+        vote.vote_ptr_id = parent.id
+    fields = model._meta.local_concrete_fields
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields))
+    )
+    rows = [[field.get_db_prep_save(getattr(vote, field.attname), connection) for field in fields] for vote in votes]
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), BULK_CREATE_BATCH_SIZE):
+            cursor.executemany(sql, rows[i:i + BULK_CREATE_BATCH_SIZE])
+    for vote in votes:
+        vote._state.adding = False
+        vote._state.db = Vote.objects.db
+
+
 class VotingFactory(object):
 
     def __init__(self, do_create_missing_party=True):
         self.vote_factory = VoteFactory(do_create_missing_party=do_create_missing_party)
 
     @transaction.atomic
-    def create_votings(self, dossier_id):
+    def create_votings(self, dossier_id, tk_data: TKDossierData = None):
         logger.info('BEGIN')
         logger.info('dossier id: ' + str(dossier_id))
-        dossier_id_main, dossier_id_sub = Dossier.split_dossier_id(dossier_id)
-        tk_besluiten = queries.get_dossier_besluiten_with_stemmingen(nummer=dossier_id_main, toevoeging=dossier_id_sub)
+        tk_besluiten = self.get_besluiten_with_stemmingen(dossier_id, tk_data)
         for tk_besluit in tk_besluiten:
             self.create_votings_dossier_besluit(tk_besluit, dossier_id)
         logger.info('END')
@@ -57,6 +109,24 @@ class VotingFactory(object):
         dossiers = Dossier.objects.filter(dossier_id=dossier_id)
         assert dossiers.count() == 1
         dossier = dossiers[0]
+        voting_obj = self.get_voting(tk_besluit, dossier)
+
+        if voting_obj.kamerstuk:
+            kamerstuk = voting_obj.kamerstuk
+            # A voting can be postponed and later voted on
+            # we do not save the postponed voting if there is a newer voting
+            if kamerstuk.voting and kamerstuk.voting.date > voting_obj.date:
+                logger.info('newer voting for this kamerstuk already exits, skip this voting')
+                return
+            elif kamerstuk.voting:
+                kamerstuk.voting.delete()
+
+        voting_obj.save()
+        self.create_votes(voting_obj, tk_besluit.stemmingen)
+
+    def get_voting(self, tk_besluit: TKBesluit, dossier: Dossier, decision=None) -> Voting:
+        """ returns a new, unsaved, voting for the besluit """
+        dossier_id = dossier.dossier_id
         result = self.get_result_choice(tk_besluit.tekst)
         zaak = tk_besluit.zaak
 
@@ -68,8 +138,9 @@ class VotingFactory(object):
         is_dossier_voting = is_dossier_voting or str(zaak.volgnummer) == '0'
         logger.info('{} | dossier voting: {}'.format(document_id, is_dossier_voting))
         voting_obj = Voting(
+            tk_id=tk_besluit.id,
             dossier=dossier,
-            decision=Decision.objects.filter(tk_id=tk_besluit.id).first(),
+            decision=decision if decision is not None else Decision.objects.filter(tk_id=tk_besluit.id).first(),
             kamerstuk_raw_id=document_id,
             result=result,
             date=tk_besluit.agendapunt.activiteit.begin.date(),  # TODO BR: replace with besluit date
@@ -79,26 +150,93 @@ class VotingFactory(object):
 
         kamerstukken = Kamerstuk.objects.filter(id_main=dossier_id, id_sub=zaak.volgnummer)
         if kamerstukken.exists():
-            kamerstuk = kamerstukken[0]
-            voting_obj.kamerstuk = kamerstuk
-            # A voting can be postponed and later voted on
-            # we do not save the postponed voting if there is a newer voting
-            if kamerstuk.voting and kamerstuk.voting.date > voting_obj.date:
-                logger.info('newer voting for this kamerstuk already exits, skip this voting')
-                return
-            elif kamerstuk.voting:
-                kamerstuk.voting.delete()
+            voting_obj.kamerstuk = kamerstukken[0]
         elif not is_dossier_voting:
             logger.error(
                 'Kamerstuk ' + document_id + ' not found in database. Kamerstuk is probably not yet published.')
 
         voting_obj.is_individual = ('hoofdelijk' in tk_besluit.tekst.lower())
-        voting_obj.save()
+        return voting_obj
 
-        if voting_obj.is_individual:
-            self.vote_factory.create_votes_individual(voting_obj, tk_besluit.stemmingen)
+    def create_votes(self, voting, stemmingen):
+        if voting.is_individual:
+            self.vote_factory.create_votes_individual(voting, stemmingen)
         else:
-            self.vote_factory.create_votes_party(voting_obj, tk_besluit.stemmingen)
+            self.vote_factory.create_votes_party(voting, stemmingen)
+
+    @staticmethod
+    def get_besluiten_with_stemmingen(dossier_id, tk_data: TKDossierData = None) -> List[TKBesluit]:
+        if tk_data is not None:
+            return tk_data.get_besluiten_with_stemmingen()
+        dossier_id_main, dossier_id_sub = Dossier.split_dossier_id(dossier_id)
+        return queries.get_dossier_besluiten_with_stemmingen(nummer=dossier_id_main, toevoeging=dossier_id_sub)
+
+    def update_votings(self, dossier_id, summary: UpdateSummary, tk_data: TKDossierData = None):
+        """
+        Creates, updates and deletes only the votings that differ from the TK API, matched on their TK besluit id.
+        The votes of an existing voting are only replaced if they have changed.
+        """
+        logger.info('BEGIN')
+        dossier = Dossier.objects.get(dossier_id=dossier_id)
+        tk_besluiten = self.get_besluiten_with_stemmingen(dossier_id, tk_data)
+        decisions = {decision.tk_id: decision for decision in Decision.objects.filter(dossier=dossier)}
+
+        votings_new = collections.OrderedDict()
+        kamerstuk_latest = {}
+        for tk_besluit in tk_besluiten:
+            voting = self.get_voting(tk_besluit, dossier, decision=decisions.get(tk_besluit.id))
+            votings_new[tk_besluit.id] = (voting, tk_besluit)
+            if voting.kamerstuk:
+                latest_tk_id = kamerstuk_latest.get(voting.kamerstuk.id)
+                # same as create_votings; a postponed voting is replaced by a later voting on the same kamerstuk
+                if latest_tk_id is None or not votings_new[latest_tk_id][0].date > voting.date:
+                    kamerstuk_latest[voting.kamerstuk.id] = tk_besluit.id
+        for tk_id, (voting, tk_besluit) in list(votings_new.items()):
+            if voting.kamerstuk and kamerstuk_latest[voting.kamerstuk.id] != tk_id:
+                del votings_new[tk_id]
+
+        votings = {}
+        votings_removed = []
+        for voting in Voting.objects.filter(dossier=dossier):
+            if voting.tk_id in votings_new and voting.tk_id not in votings:
+                votings[voting.tk_id] = voting
+            else:
+                votings_removed.append(voting)
+        with transaction.atomic():
+            for voting in votings_removed:
+                voting.delete()
+        summary.add('voting', UpdateSummary.DELETED, len(votings_removed))
+
+        for tk_id, (voting_new, tk_besluit) in votings_new.items():
+            with transaction.atomic():
+                self.update_voting(votings.get(tk_id), voting_new, tk_besluit, summary)
+        logger.info('END')
+
+    def update_voting(self, voting, voting_new: Voting, tk_besluit: TKBesluit, summary: UpdateSummary):
+        if voting is None:
+            voting_new.save()
+            self.create_votes(voting_new, tk_besluit.stemmingen)
+            summary.add('voting', UpdateSummary.CREATED)
+            summary.add('vote', UpdateSummary.CREATED, len(tk_besluit.stemmingen))
+            return
+        properties = {
+            'decision': voting_new.decision,
+            'kamerstuk': voting_new.kamerstuk,
+            'kamerstuk_raw_id': voting_new.kamerstuk_raw_id,
+            'result': voting_new.result,
+            'date': voting_new.date,
+            'is_dossier_voting': voting_new.is_dossier_voting,
+            'is_individual': voting_new.is_individual,
+        }
+        changed = update_if_changed(voting, properties)
+        if self.vote_factory.votes_changed(voting, tk_besluit.stemmingen):
+            votes = Vote.objects.filter(voting=voting)
+            summary.add('vote', UpdateSummary.DELETED, votes.count())
+            votes.delete()
+            self.create_votes(voting, tk_besluit.stemmingen)
+            summary.add('vote', UpdateSummary.CREATED, len(tk_besluit.stemmingen))
+            changed = True
+        summary.add('voting', UpdateSummary.UPDATED if changed else UpdateSummary.UNCHANGED)
 
     @staticmethod
     def get_result_choice(result_string):
@@ -126,24 +264,64 @@ class VoteFactory(object):
     @transaction.atomic
     def create_votes_party(self, voting, stemmingen):
         logger.info('BEGIN')
+        parties = {}
+        votes = []
         for stemming in stemmingen:
-            fractie_name = stemming.actor_fractie if stemming.actor_fractie else stemming.actor_naam
-            party = PoliticalParty.find_party(fractie_name)
-            if not party and self.do_create_missing_party:
-                party = self.create_missing_party(stemming)
+            fractie_name = self.get_fractie_name(stemming)
+            if fractie_name not in parties:
+                parties[fractie_name] = self.get_party(fractie_name, stemming)
             if not stemming.soort:
                 logger.warning('vote has no decision, vote.details: ' + str(stemming.soort))
-            VoteParty.objects.create(
+            votes.append(VoteParty(
                 voting=voting,
-                party=party,
+                party=parties[fractie_name],
                 party_name=fractie_name,
                 number_of_seats=stemming.fractie_size,
                 decision=self.get_decision(stemming.soort),
                 details='',
-                is_mistake=stemming.vergissing if stemming.vergissing is not None else False
-            )
+                is_mistake=self.get_is_mistake(stemming)
+            ))
+        bulk_create_votes(voting, votes)
         logger.info('END')
 
+    def get_party(self, fractie_name, stemming):
+        party = PoliticalParty.find_party(fractie_name)
+        if not party and self.do_create_missing_party:
+            if openkamer.parallel.acquire_shared_lookup_lock():
+                # the party may have been created by another worker process in the meantime
+                party = PoliticalParty.find_party(fractie_name)
+            if not party:
+                party = self.create_missing_party(stemming)
+        return party
+
+    @staticmethod
+    def get_fractie_name(stemming):
+        return stemming.actor_fractie if stemming.actor_fractie else stemming.actor_naam
+
+    @staticmethod
+    def get_is_mistake(stemming):
+        return stemming.vergissing if stemming.vergissing is not None else False
+
+    def votes_changed(self, voting: Voting, stemmingen) -> bool:
+        """ compares the stored votes of the voting with the TK stemmingen, ignoring order """
+        votes_party = collections.Counter(
+            VoteParty.objects.filter(voting=voting).values_list('party_name', 'number_of_seats', 'decision', 'is_mistake')
+        )
+        votes_individual = collections.Counter(
+            VoteIndividual.objects.filter(voting=voting).values_list('person_tk_id', 'decision', 'is_mistake')
+        )
+        if voting.is_individual:
+            expected = collections.Counter(
+                (stemming.persoon.id, self.get_decision(stemming.soort), self.get_is_mistake(stemming))
+                for stemming in stemmingen
+            )
+            return bool(votes_party) or votes_individual != expected
+        expected = collections.Counter(
+            (self.get_fractie_name(stemming), stemming.fractie_size, self.get_decision(stemming.soort), self.get_is_mistake(stemming))
+            for stemming in stemmingen
+        )
+        return bool(votes_individual) or votes_party != expected
+
     @staticmethod
     def create_missing_party(stemming):
         party_name = stemming.actor_naam  # TODO: use fractie.naam (currently not available in TK API)
@@ -159,15 +337,22 @@ class VoteFactory(object):
     @transaction.atomic
     def create_votes_individual(self, voting, stemmingen):
         logger.info('BEGIN')
+        tk_ids = [stemming.persoon.id for stemming in stemmingen if stemming.persoon]
+        persons = {}
+        for person in Person.objects.filter(tk_id__in=tk_ids).order_by('id'):
+            persons.setdefault(person.tk_id, person)
+        members = {}
+        for member in ParliamentMember.objects.filter(person__in=persons.values()).order_by('-joined'):
+            members.setdefault(member.person_id, member)
+
+        votes = []
         for stemming in stemmingen:
             persoon = stemming.persoon
             parliament_member = None
 
-            persons = Person.objects.filter(tk_id=persoon.id)
-            if persons:
-                person = persons[0]
-                members = ParliamentMember.objects.filter(person=person).order_by('-joined')
-                parliament_member = members[0] if members.exists() else None
+            person = persons.get(persoon.id)
+            if person:
+                parliament_member = members.get(person.id)
                 person_name = ' '.join([person.forename, person.surname, person.initials]).strip()
 
             # TODO BR: this is a fallback, remove or extract function and log
@@ -188,7 +373,7 @@ class VoteFactory(object):
                     logger.error('creating vote with empty parliament member')
                 person_name = ' '.join([forname, surname, initials]).strip()
 
-            VoteIndividual.objects.create(
+            votes.append(VoteIndividual(
                 voting=voting,
                 person_name=person_name,
                 person_tk_id=persoon.id,
@@ -196,8 +381,9 @@ class VoteFactory(object):
                 number_of_seats=1,
                 decision=self.get_decision(stemming.soort),
                 details='',
-                is_mistake=stemming.vergissing if stemming.vergissing is not None else False
-            )
+                is_mistake=self.get_is_mistake(stemming)
+            ))
+        bulk_create_votes(voting, votes)
         logger.info('END')
 
     @staticmethod
@@ -1,9 +1,14 @@
 import logging
 import datetime
+import threading
 
 from unidecode import unidecode
 
+from django.db import connections
 from django.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils.functional import cached_property
 from django.utils.text import slugify
 
@@ -206,12 +211,17 @@ class PoliticalParty(models.Model):
         update the party with wikidata info
         :param language: the language to search for in wikidata
         """
+        if self.set_info(language):
+            self.save()
+
+    def set_info(self, language='nl'):
+        """ sets the wikidata info without saving, returns False if the party is not found in wikidata """
         logger.info('update party info for {}'.format(self.name))
         if not self.wikidata_id:
             self.wikidata_id = self.find_wikidata_id(language)
             if not self.wikidata_id:
                 logger.warning('no wikidata_id found for {}'.format(self.name))
-                return
+                return False
         wikidata_item = wikidata.WikidataItem(self.wikidata_id)
         self.official_website_url = wikidata_item.get_official_website()
         self.wikipedia_url = wikidata_item.get_wikipedia_url(language)
@@ -221,10 +231,15 @@ class PoliticalParty(models.Model):
         self.name_short = wikidata_item.get_short_name() or self.name
         if logo_filename:
             self.wikimedia_logo_url = wikidata.WikidataItem.get_wikimedia_image_url(logo_filename)
-        self.save()
+        return True
 
     @staticmethod
     def find_party(name):
+        """ returns the party with the given (short) name, see PartyResolver """
+        return party_resolver.find(name)
+
+    @staticmethod
+    def find_party_query(name):
         name_ascii = unidecode(name)
         name_lid = 'Lid-' + name
         name_no_dash = name.replace('-', ' ')
@@ -240,13 +255,103 @@ class PoliticalParty(models.Model):
                   | PoliticalParty.objects.filter(name_short__iexact=name_no_dash)
         if parties.exists():
             return parties[0]
-        logger.warning('party not found: ' + name)
         return None
 
     class Meta:
         verbose_name_plural = "Political parties"
 
 
+class PartyResolver(object):
+    """
+    Finds parties by name with an in memory index of the normalized party names and short names,
+    built on first use. Gives the same result as PoliticalParty.find_party_query:
+    the first party (lowest id) that matches the name, its ascii version, its 'Lid-' version or its version without dashes,
+    first on name and then on short name, case insensitive.
+
+    The index is invalidated when a party is saved or deleted in this process.
+    Until the transaction of that change has ended (it may be rolled back), the database is queried instead.
+    A name that is not in the index is looked up in the database, the party may have been created by another process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._field_names = [field.attname for field in PoliticalParty._meta.concrete_fields]
+        self._parties = None
+        self._name_index = None
+        self._name_short_index = None
+        self._changed_in_transaction = False
+
+    def invalidate(self):
+        with self._lock:
+            self._parties = None
+            self._name_index = None
+            self._name_short_index = None
+            if connections[PoliticalParty.objects.db].in_atomic_block:
+                self._changed_in_transaction = True
+
+    @staticmethod
+    def normalize(name):
+        return name.lower()
+
+    @staticmethod
+    def get_name_variants(name):
+        return {
+            PartyResolver.normalize(variant)
+            for variant in (name, unidecode(name), 'Lid-' + name, name.replace('-', ' '))
+        }
+
+    def _build(self):
+        parties = {}
+        name_index = {}
+        name_short_index = {}
+        for values in PoliticalParty.objects.order_by('-id').values_list(*self._field_names):
+            party_values = dict(zip(self._field_names, values))
+            parties[party_values['id']] = values
+            # ordered by descending id, the lowest id is stored last
+            name_index[self.normalize(party_values['name'])] = party_values['id']
+            name_short_index[self.normalize(party_values['name_short'])] = party_values['id']
+        self._parties = parties
+        self._name_index = name_index
+        self._name_short_index = name_short_index
+        logger.info('party index created for {} parties'.format(len(parties)))
+
+    def _find_in_index(self, name):
+        variants = self.get_name_variants(name)
+        with self._lock:
+            if self._changed_in_transaction:
+                if connections[PoliticalParty.objects.db].in_atomic_block:
+                    return None
+                self._changed_in_transaction = False
+                self._parties = None
+            if self._parties is None:
+                self._build()
+            for index in (self._name_index, self._name_short_index):
+                ids = [index[variant] for variant in variants if variant in index]
+                if ids:
+                    return PoliticalParty.from_db(PoliticalParty.objects.db, self._field_names, self._parties[min(ids)])
+        return None
+
+    def find(self, name) -> 'PoliticalParty' or None:
+        party = self._find_in_index(name)
+        if party is not None:
+            return party
+        party = PoliticalParty.find_party_query(name)
+        if party is not None:
+            self.invalidate()
+            return party
+        logger.warning('party not found: ' + name)
+        return None
+
+
+party_resolver = PartyResolver()
+
+
+@receiver(post_save, sender=PoliticalParty)
+@receiver(post_delete, sender=PoliticalParty)
+def invalidate_party_resolver(sender, **kwargs):
+    party_resolver.invalidate()
+
+
 class PartyMember(models.Model):
     person = models.ForeignKey(Person, related_name='partymember', on_delete=models.CASCADE)
     party = models.ForeignKey(PoliticalParty, on_delete=models.CASCADE)
@@ -264,6 +369,43 @@ class PartyMember(models.Model):
         return str(self.person) + ' (' + str(self.party) + ')'
 
 
+class MembershipsAtDate(object):
+    """
+    The party and parliament memberships of all persons, loaded with one query each,
+    to find the memberships of many persons at a date without a query per lookup.
+    Gives the same result as PartyMember.get_at_date and ParliamentMember.find_at_date,
+    the membership with the lowest id if there are multiple.
+    """
+
+    def __init__(self, person_ids=None):
+        """ :param person_ids: only load the memberships of these persons """
+        party_members = PartyMember.objects.order_by('id')
+        parliament_members = ParliamentMember.objects.order_by('id')
+        if person_ids is not None:
+            party_members = party_members.filter(person_id__in=person_ids)
+            parliament_members = parliament_members.filter(person_id__in=person_ids)
+        self.party_members = {}
+        for person_id, joined, left, party_id in party_members.values_list('person_id', 'joined', 'left', 'party_id'):
+            self.party_members.setdefault(person_id, []).append((joined, left, party_id))
+        self.parliament_members = {}
+        for person_id, joined, left, member_id in parliament_members.values_list('person_id', 'joined', 'left', 'id'):
+            if joined is not None:
+                self.parliament_members.setdefault(person_id, []).append((joined, left, member_id))
+
+    @staticmethod
+    def _find_at_date(memberships, date):
+        for joined, left, value in memberships:
+            if (joined is None or joined <= date) and (left is None or left > date):
+                return value
+        return None
+
+    def get_party_id(self, person_id, date):
+        return self._find_at_date(self.party_members.get(person_id, []), date)
+
+    def get_parliament_member_id(self, person_id, date):
+        return self._find_at_date(self.parliament_members.get(person_id, []), date)
+
+
 class Commissie(models.Model):
     name = models.CharField(max_length=500)
     name_short = models.CharField(max_length=200)
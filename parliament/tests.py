@@ -6,6 +6,7 @@ from person.models import Person
 
 from parliament.models import Parliament
 from parliament.models import ParliamentMember
+from parliament.models import PartyResolver
 from parliament.models import PoliticalParty
 
 from wikidata import wikidata
@@ -68,6 +69,33 @@ class TestPoliticalParty(TestCase):
         self.assertEqual(party, party_expected)
 
 
+class TestPartyResolver(TestCase):
+
+    def test_find(self):
+        party_gl = PoliticalParty.objects.create(name='GroenLinks', name_short='GL')
+        PoliticalParty.objects.create(name='GroenLinks', name_short='GL')
+        party_kvp = PoliticalParty.objects.create(name='Katholieke Volkspartij', name_short='KVP')
+        party_vdb = PoliticalParty.objects.create(name='Vrijzinnig Democratische Bond', name_short='VDB')
+        party_resolver = PartyResolver()
+        for name in ['GroenLinks', 'groenlinks', 'GL', 'Lid-GroenLinks', 'Katholieke Volkspartij', 'kvp', 'Vrijzinnig-Democratische Bond']:
+            self.assertEqual(PoliticalParty.find_party_query(name), party_resolver.find(name))
+        self.assertEqual(party_gl, party_resolver.find('GL'))
+        self.assertEqual(party_kvp.name, party_resolver.find('KVP').name)
+        self.assertEqual(party_vdb, party_resolver.find('Vrijzinnig-Democratische Bond'))
+        self.assertIsNone(party_resolver.find('Piratenpartij'))
+
+    def test_invalidate(self):
+        party_resolver = PartyResolver()
+        self.assertIsNone(party_resolver.find('SP'))
+        party = PoliticalParty.objects.create(name='Socialistische Partij', name_short='SP')
+        self.assertEqual(party, party_resolver.find('SP'))  # not in the index, found in the database
+        party.name_short = 'SocP'
+        party.save()
+        party_resolver.invalidate()
+        self.assertEqual(party, party_resolver.find('socp'))
+        self.assertEqual(party, PoliticalParty.find_party('SocP'))
+
+
 class TestParliamentMembers(TestCase):
     fixtures = ['person.json', 'parliament.json']
 
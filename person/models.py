@@ -1,7 +1,13 @@
 import logging
+import threading
 from unidecode import unidecode
 
+from django.db import connections
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils.text import slugify
 
 from wikidata import wikidata
@@ -72,33 +78,18 @@ class Person(models.Model):
 
     @staticmethod
     def find_surname_initials(surname, initials='', persons=None):
-        # TODO: improve performance; use queries
-        surname = unidecode(surname)
-        initials = unidecode(initials)
-        persons = persons if persons is not None else Person.objects.all()
+        """
+        Returns the person that matches the surname and initials best, or None.
+        Uses the PersonMatcher index, or scores all given persons.
+        """
+        if persons is None:
+            return person_matcher.find(surname, initials)
+        surname_key, initials = PersonMatchData.normalize_query(surname, initials)
         best_match = None
         best_score = 0
         for person in persons:
-            score = 0
-            surname_no_second = surname.split('-')[0].lower()  # for example, Anne-Wil Lucas-Smeerdijk is called Anne-Wil Lucas on tweedekamer.nl
-            person_surname_no_second = person.surname.split('-')[0].lower()
-            if surname_no_second == unidecode(person_surname_no_second):
-                score += 1
-            elif surname_no_second == unidecode(person_surname_no_second + ' ' + person.surname_prefix.lower()):
-                score += 1
-            elif surname_no_second == unidecode(person.surname_prefix.lower() + ' ' + person_surname_no_second):
-                score += 1
-            initials_letters = initials.split('.')
-            forename = unidecode(person.forename)
-            if initials and initials.lower() == unidecode(person.initials.lower()):
-                score += 1
-            elif initials_letters and forename and initials_letters[0] == forename[0]:
-                score += 0.5
-            if person.initials and person.forename and person.surname:
-                score += 0.1
-            if person.wikidata_id:
-                score += 0.05
-            if score >= 1.5 and score > best_score:
+            score = PersonMatchData.from_person(person).get_score(surname_key, initials)
+            if score >= PersonMatchData.SCORE_MIN and score > best_score:
                 best_match = person
                 best_score = score
         if not best_match:
@@ -215,3 +206,175 @@ class Person(models.Model):
                 for p in persons_same_name:
                     same_name_ids.append(p.id)
         return Person.objects.filter(pk__in=same_name_ids).order_by('surname')
+
+
+class PersonMatchData(object):
+    """ The normalized names of a person that are used to find a person by surname and initials """
+    SCORE_MIN = 1.5  # a matching surname and (first letter of the) initials
+
+    def __init__(self, surname_keys, initials, forename_first_letter, is_complete, has_wikidata_id):
+        self.surname_keys = surname_keys
+        self.initials = initials
+        self.forename_first_letter = forename_first_letter
+        self.is_complete = is_complete
+        self.has_wikidata_id = has_wikidata_id
+
+    @staticmethod
+    def from_person(person):
+        return PersonMatchData.create(person.surname, person.surname_prefix, person.initials, person.forename, person.wikidata_id)
+
+    @staticmethod
+    def create(surname, surname_prefix, initials, forename, wikidata_id):
+        surname_no_second = surname.split('-')[0].lower()
+        surname_keys = (
+            unidecode(surname_no_second),
+            unidecode(surname_no_second + ' ' + surname_prefix.lower()),
+            unidecode(surname_prefix.lower() + ' ' + surname_no_second),
+        )
+        forename = unidecode(forename)
+        return PersonMatchData(
+            surname_keys=surname_keys,
+            initials=unidecode(initials.lower()),
+            forename_first_letter=forename[0] if forename else None,
+            is_complete=bool(initials and forename and surname),
+            has_wikidata_id=bool(wikidata_id),
+        )
+
+    @staticmethod
+    def normalize_query(surname, initials):
+        """ returns the surname key and initials to compare with """
+        # for example, Anne-Wil Lucas-Smeerdijk is called Anne-Wil Lucas on tweedekamer.nl
+        return unidecode(surname).split('-')[0].lower(), unidecode(initials)
+
+    def get_score(self, surname_key, initials):
+        score = 0
+        if surname_key in self.surname_keys:
+            score += 1
+        if initials and initials.lower() == self.initials:
+            score += 1
+        elif self.forename_first_letter and initials.split('.')[0] == self.forename_first_letter:
+            score += 0.5
+        if self.is_complete:
+            score += 0.1
+        if self.has_wikidata_id:
+            score += 0.05
+        return score
+
+
+class PersonMatcher(object):
+    """
+    Finds persons by surname and initials with an in memory index of normalized surname variants, built on first use.
+    Only persons with a matching surname can reach the minimum score, only those are scored.
+    Gives the same result as scoring all persons in order of id.
+    Persons that are saved or deleted are reloaded from the database on the next lookup,
+    and again after the transaction of the change has ended, because the change may be rolled back.
+    If no person is found, the new persons and the persons with a matching surname are reloaded from the database,
+    these can be created or changed by another process, or without a save signal (bulk_create, update).
+    """
+    MATCH_FIELDS = ('surname', 'surname_prefix', 'initials', 'forename', 'wikidata_id')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._field_names = [field.attname for field in Person._meta.concrete_fields]
+        self._rows = None
+        self._match_data = None
+        self._surname_index = None
+        self._max_id = 0
+        self._changed_ids = set()
+        self._changed_ids_in_transaction = set()
+
+    def invalidate(self, person_id=None):
+        """ reload the given person, or all persons if no person is given """
+        with self._lock:
+            if person_id is None:
+                self._rows = None
+            else:
+                self._changed_ids.add(person_id)
+
+    def _add(self, values):
+        row = dict(zip(self._field_names, values))
+        match_data = PersonMatchData.create(*[row[name] for name in self.MATCH_FIELDS])
+        self._rows[row['id']] = values
+        self._max_id = max(self._max_id, row['id'])
+        self._match_data[row['id']] = match_data
+        for key in match_data.surname_keys:
+            self._surname_index.setdefault(key, set()).add(row['id'])
+
+    def _remove(self, person_id):
+        match_data = self._match_data.pop(person_id, None)
+        self._rows.pop(person_id, None)
+        if match_data is None:
+            return
+        for key in match_data.surname_keys:
+            self._surname_index[key].discard(person_id)
+
+    def _build(self):
+        self._rows = {}
+        self._match_data = {}
+        self._surname_index = {}
+        self._max_id = 0
+        for values in Person.objects.values_list(*self._field_names):
+            self._add(values)
+        self._set_changed_loaded()
+        logger.info('person index created for {} persons'.format(len(self._rows)))
+
+    def _reload_changed(self):
+        changed_ids = self._changed_ids | self._changed_ids_in_transaction
+        if not changed_ids:
+            return
+        for person_id in changed_ids:
+            self._remove(person_id)
+        for values in Person.objects.filter(id__in=changed_ids).values_list(*self._field_names):
+            self._add(values)
+        self._set_changed_loaded()
+
+    def _set_changed_loaded(self):
+        if connections[Person.objects.db].in_atomic_block:
+            self._changed_ids_in_transaction |= self._changed_ids
+        else:
+            self._changed_ids_in_transaction.clear()
+        self._changed_ids.clear()
+
+    def _reload_candidates(self, surname_key):
+        """ reloads the persons that are not in the index yet, and the persons that may have the surname """
+        query = Q(id__gt=self._max_id)
+        for word in surname_key.split():
+            query |= Q(surname__istartswith=word)
+        for values in Person.objects.filter(query).values_list(*self._field_names):
+            self._remove(values[self._field_names.index('id')])
+            self._add(values)
+
+    def _find_best_id(self, surname_key, initials):
+        best_id = None
+        best_score = 0
+        for person_id in sorted(self._surname_index.get(surname_key, ())):
+            score = self._match_data[person_id].get_score(surname_key, initials)
+            if score >= PersonMatchData.SCORE_MIN and score > best_score:
+                best_id = person_id
+                best_score = score
+        return best_id
+
+    def find(self, surname, initials='') -> 'Person' or None:
+        surname_key, initials = PersonMatchData.normalize_query(surname, initials)
+        with self._lock:
+            if self._rows is None:
+                self._build()
+            else:
+                self._reload_changed()
+            best_id = self._find_best_id(surname_key, initials)
+            if best_id is None:
+                self._reload_candidates(surname_key)
+                best_id = self._find_best_id(surname_key, initials)
+            if best_id is not None:
+                return Person.from_db(Person.objects.db, self._field_names, self._rows[best_id])
+        logger.info('person not found: ' + surname + ', ' + initials)
+        return None
+
+
+person_matcher = PersonMatcher()
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def invalidate_person_matcher(sender, instance, **kwargs):
+    person_matcher.invalidate(instance.id)
@@ -6,6 +6,7 @@ from django.test import TestCase
 
 from wikidata import wikidata
 from person.models import Person
+from person.models import PersonMatcher
 from person.util import parse_name_surname_initials, parse_surname_comma_surname_prefix
 
 
@@ -53,6 +54,45 @@ class TestFindName(TestCase):
         p_found = Person.find_surname_initials('Grapperhaus', 'F.B.J.')
         self.assertEqual(p_found, self.p9)
 
+    def test_person_matcher_same_as_scan(self):
+        person_matcher = PersonMatcher()
+        persons = Person.objects.order_by('id')
+        names = [
+            ('Balkenende', 'J.P.'), ('Balkenende', 'J.'), ('Balkenende', ''), ('van Balkenende', 'J.'),
+            ('Balkenende van', 'J.P.'), ('Koser Kaya', 'F.'), ('Koşer Kaya-Smit', 'F.'), ('Grapperhaus', 'F.'), ('Raak', ''),
+        ]
+        for surname, initials in names:
+            self.assertEqual(
+                Person.find_surname_initials(surname, initials, persons),
+                person_matcher.find(surname, initials)
+            )
+
+    def test_person_matcher_changed(self):
+        person_matcher = PersonMatcher()
+        self.assertIsNone(person_matcher.find('Lucas', 'A.W.'))
+        person = Person.objects.create(forename='Anne-Wil', surname='Lucas-Smeerdijk', initials='A.W.')
+        person_matcher.invalidate(person.id)
+        self.assertEqual(person, person_matcher.find('Lucas', 'A.W.'))
+        person.surname = 'Smeerdijk'
+        person.save()
+        self.assertIsNone(Person.find_surname_initials('Lucas', 'A.W.'))
+        self.assertEqual(person, Person.find_surname_initials('Smeerdijk', 'A.W.'))
+        person_id = person.id
+        person.delete()
+        person_matcher.invalidate(person_id)
+        self.assertIsNone(person_matcher.find('Smeerdijk', 'A.W.'))
+
+    def test_person_matcher_without_signal(self):
+        person_matcher = PersonMatcher()
+        self.assertIsNone(person_matcher.find('Lucas', 'A.W.'))
+        # created by another process, or without a save signal
+        Person.objects.bulk_create([Person(forename='Anne-Wil', surname='Lucas-Smeerdijk', initials='A.W.')])
+        person = person_matcher.find('Lucas', 'A.W.')
+        self.assertIsNotNone(person)
+        self.assertEqual(person.surname, 'Lucas-Smeerdijk')
+        Person.objects.filter(id=person.id).update(surname='Smeerdijk')
+        self.assertEqual(person, person_matcher.find('Smeerdijk', 'A.W.'))
+
 
 class TestNamePrefix(TestCase):
 
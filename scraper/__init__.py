@@ -1 +1,2 @@
 
+default_app_config = 'scraper.apps.ScraperConfig'
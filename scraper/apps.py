@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ScraperConfig(AppConfig):
+    name = 'scraper'
+
+    def ready(self):
+        import scraper.session
+        scraper.session.install_library_hooks()
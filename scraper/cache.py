@@ -0,0 +1,198 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from scraper.settings import HTTP_CACHE_DIR
+from scraper.settings import HTTP_CACHE_MAX_SIZE
+from scraper.settings import HTTP_CACHE_ENABLED
+import scraper.cassette
+import scraper.session
+
+logger = logging.getLogger(__name__)
+
+EVICT_INTERVAL = 100  # number of puts between size checks
+
+
+class CacheEntry(object):
+
+    def __init__(self, url, final_url, etag, last_modified, body_hash, size):
+        self.url = url
+        self.final_url = final_url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_hash = body_hash
+        self.size = size
+
+    @property
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+
+class CachedResponse(object):
+    """ The part of a requests.Response that the scrapers use """
+
+    def __init__(self, url, content, status_code=200, from_cache=False):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.from_cache = from_cache
+
+
+class HttpCache(object):
+    """
+    Persistent, size bounded, cache of http GET responses.
+    Response bodies are stored content addressed (sha256 of the body) in separate files,
+    the index (url -> final redirect url, validators and body hash) is stored in a sqlite database.
+    The least recently used entries are removed when the total size of the bodies exceeds max_size,
+    the size is checked every evict_interval puts (per process).
+    Can be used by multiple threads and processes at the same time.
+    """
+    INDEX_FILENAME = 'index.sqlite3'
+
+    def __init__(self, directory, max_size, evict_interval=EVICT_INTERVAL):
+        self.directory = directory
+        self.max_size = max_size
+        self.evict_interval = evict_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entry ('
+                'url TEXT PRIMARY KEY, final_url TEXT, etag TEXT, last_modified TEXT, '
+                'body_hash TEXT, size INTEGER, last_access REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS entry_last_access ON entry (last_access)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entry_body_hash ON entry (body_hash)')
+
+    def _connection(self):
+        # a sqlite connection can not be shared with threads or forked processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(os.path.join(self.directory, self.INDEX_FILENAME), timeout=60)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _body_path(self, body_hash):
+        return os.path.join(self.directory, body_hash[:2], body_hash + '.bin')
+
+    def get_entry(self, url) -> CacheEntry or None:
+        row = self._connection().execute(
+            'SELECT url, final_url, etag, last_modified, body_hash, size FROM entry WHERE url = ?', (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(*row)
+        if not os.path.exists(self._body_path(entry.body_hash)):
+            return None
+        return entry
+
+    def get_body(self, entry: CacheEntry):
+        with open(self._body_path(entry.body_hash), 'rb') as body_file:
+            return body_file.read()
+
+    def touch(self, entry: CacheEntry):
+        with self._connection() as connection:
+            connection.execute('UPDATE entry SET last_access = ? WHERE url = ?', (time.time(), entry.url))
+
+    def put(self, url, final_url, content, etag='', last_modified=''):
+        body_hash = hashlib.sha256(content).hexdigest()
+        body_path = self._body_path(body_hash)
+        if not os.path.exists(body_path):
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(body_path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as body_file:
+                body_file.write(content)
+            os.replace(tmp_path, body_path)
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO entry (url, final_url, etag, last_modified, body_hash, size, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, final_url, etag, last_modified, body_hash, len(content), time.time())
+            )
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_interval == 0
+        if evict:
+            self.evict()
+        return CacheEntry(url, final_url, etag, last_modified, body_hash, len(content))
+
+    def total_size(self):
+        row = self._connection().execute(
+            'SELECT SUM(size) FROM (SELECT DISTINCT body_hash, size FROM entry)'
+        ).fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        """ removes the least recently used entries until the cache is within its max size """
+        total_size = self.total_size()
+        if total_size <= self.max_size:
+            return
+        connection = self._connection()
+        rows = connection.execute('SELECT url, body_hash, size FROM entry ORDER BY last_access').fetchall()
+        for url, body_hash, size in rows:
+            if total_size <= self.max_size:
+                break
+            with connection:
+                connection.execute('DELETE FROM entry WHERE url = ?', (url,))
+                body_in_use = connection.execute(
+                    'SELECT 1 FROM entry WHERE body_hash = ? LIMIT 1', (body_hash,)
+                ).fetchone()
+            if body_in_use:
+                continue
+            try:
+                os.remove(self._body_path(body_hash))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+        logger.info('http cache evicted to {} bytes'.format(total_size))
+
+    def get(self, url, timeout=60) -> CachedResponse:
+        """
+        GET the url, revalidates a cached response with If-None-Match/If-Modified-Since
+        and returns the body from disk if the server responds with 304 Not Modified.
+        """
+        entry = self.get_entry(url)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        response = scraper.session.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            self.touch(entry)
+            return CachedResponse(url=entry.final_url, content=self.get_body(entry), from_cache=True)
+        if response.status_code == 200:
+            self.put(
+                url=url,
+                final_url=response.url,
+                content=response.content,
+                etag=response.headers.get('ETag', ''),
+                last_modified=response.headers.get('Last-Modified', ''),
+            )
+        return CachedResponse(url=response.url, content=response.content, status_code=response.status_code)
+
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> HttpCache:
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = HttpCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_SIZE)
+        return _http_cache
+
+
+def get(url, timeout=60):
+    """ GET with the persistent http cache, if enabled. Not used with a cassette, conditional responses can not be replayed. """
+    if not HTTP_CACHE_ENABLED or scraper.cassette.get_cassette() is not None:
+        response = scraper.session.get(url, timeout=timeout)
+        return CachedResponse(url=response.url, content=response.content, status_code=response.status_code)
+    return get_http_cache().get(url, timeout=timeout)
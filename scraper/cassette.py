@@ -0,0 +1,136 @@
+import contextlib
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from scraper.settings import CASSETTE_LATENCY
+from scraper.settings import CASSETTE_MODE
+from scraper.settings import CASSETTE_PATH
+
+logger = logging.getLogger(__name__)
+
+# the body is stored decoded, these headers do not apply to the stored body
+SKIP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection', 'set-cookie')
+
+_cassette = None
+_cassette_initialized = False
+
+
+class CassetteMissError(requests.ConnectionError):
+    """ A request that is not in the cassette, in replay mode """
+    pass
+
+
+class Cassette(object):
+    """
+    Archive of upstream http responses, to run imports offline and repeatable, for example as benchmark.
+    In record mode all responses of scraper.session.get are stored, in replay mode they are served from the archive,
+    after an optional delay that simulates the network latency. A request that is not recorded raises a CassetteMissError.
+    Responses are stored per url (with query parameters) in a single sqlite file, with zlib compressed bodies.
+    """
+    RECORD = 'record'
+    REPLAY = 'replay'
+    MODES = (RECORD, REPLAY)
+
+    def __init__(self, path, mode, latency=0.0):
+        assert mode in self.MODES
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._local = threading.local()
+        if mode == self.REPLAY and not os.path.exists(path):
+            raise FileNotFoundError('cassette does not exist: {}'.format(path))
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS response ('
+                'request_url TEXT PRIMARY KEY, url TEXT, status_code INTEGER, reason TEXT, headers TEXT, '
+                'body BLOB, elapsed REAL, date_recorded REAL)'
+            )
+
+    @property
+    def is_replay(self):
+        return self.mode == self.REPLAY
+
+    def _connection(self):
+        # a sqlite connection can not be shared with threads or forked processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=60)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    @staticmethod
+    def create_request_url(url, params=None):
+        """ the url with the query parameters in a fixed order """
+        if params:
+            params = sorted(params.items()) if isinstance(params, dict) else sorted(params)
+        return requests.Request('GET', url, params=params).prepare().url
+
+    def record(self, url, params, response: requests.Response):
+        headers = {key: value for key, value in response.headers.items() if key.lower() not in SKIP_HEADERS}
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    self.create_request_url(url, params), response.url, response.status_code, response.reason,
+                    json.dumps(headers), zlib.compress(response.content), response.elapsed.total_seconds(), time.time()
+                )
+            )
+
+    def replay(self, url, params=None) -> requests.Response:
+        request_url = self.create_request_url(url, params)
+        row = self._connection().execute(
+            'SELECT url, status_code, reason, headers, body FROM response WHERE request_url = ?', (request_url,)
+        ).fetchone()
+        if row is None:
+            raise CassetteMissError('request not in cassette {}: {}'.format(self.path, request_url))
+        if self.latency:
+            time.sleep(self.latency)
+        response = requests.Response()
+        response.url, response.status_code, response.reason = row[0], row[1], row[2]
+        response.headers = CaseInsensitiveDict(json.loads(row[3]))
+        response._content = zlib.decompress(row[4])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = datetime.timedelta(seconds=self.latency)
+        return response
+
+    def get_stats(self):
+        row = self._connection().execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM response').fetchone()
+        return {'responses': row[0], 'bytes': row[1]}
+
+
+def get_cassette() -> Cassette or None:
+    """ returns the active cassette, by default the cassette configured in the settings, or None """
+    global _cassette, _cassette_initialized
+    if not _cassette_initialized:
+        if CASSETTE_MODE:
+            _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_LATENCY)
+        _cassette_initialized = True
+    return _cassette
+
+
+def set_cassette(cassette: Cassette or None):
+    global _cassette, _cassette_initialized
+    _cassette = cassette
+    _cassette_initialized = True
+
+
+@contextlib.contextmanager
+def use_cassette(path, mode, latency=0.0):
+    previous = get_cassette()
+    cassette = Cassette(path, mode, latency)
+    set_cassette(cassette)
+    logger.info('{} http cassette: {}'.format(mode, path))
+    try:
+        yield cassette
+    finally:
+        set_cassette(previous)
@@ -1,15 +1,27 @@
+import copy
 import logging
-import requests
-
 import lxml.html
 import lxml.etree
 
+import scraper.cache
+
 logger = logging.getLogger(__name__)
 
 
+def request_get(url):
+    """ GET with the persistent http cache (conditional requests) """
+    return scraper.cache.get(url, timeout=60)
+
+
 def get_html_content(document_id):
+    html_content = lxml.etree.tostring(get_html_content_tree(document_id))
+    return html_content
+
+
+def get_html_content_tree(document_id):
+    """ returns the document content element of the page, as root of its own tree, without the rest of the page """
     url = 'https://zoek.officielebekendmakingen.nl/{}.html'.format(document_id)
-    response = requests.get(url, timeout=60)
+    response = request_get(url)
     tree = lxml.html.fromstring(response.content)
     elements = tree.xpath('//div[@class="stuk"]')
     if not elements:
@@ -17,17 +29,18 @@ def get_html_content(document_id):
     if not elements:
         logger.error('no document content found for document url: ' + url)
         elements = tree.xpath('//main[@class="global-main"]')
-    html_content = lxml.etree.tostring(elements[0])
-    return html_content
+    content_tree = copy.deepcopy(elements[0])
+    content_tree.tail = None
+    return content_tree
 
 
 def get_metadata(document_id):
     logger.info('get metadata url for document id: {}'.format(document_id))
     url = 'https://zoek.officielebekendmakingen.nl/{}'.format(document_id)
-    response = requests.get(url, timeout=60)  # get redirected urls (new document ids)
+    response = request_get(url)  # get redirected urls (new document ids)
     xml_url = response.url + '/metadata.xml'
     logger.info('get metadata url: ' + xml_url)
-    page = requests.get(xml_url, timeout=60)
+    page = request_get(xml_url)
     tree = lxml.etree.fromstring(page.content)
     attributes_transtable = {
         'DC.type': 'types',
@@ -1,8 +1,9 @@
 import logging
 
-import requests
 import lxml.html
 
+import scraper.session
+
 logger = logging.getLogger(__name__)
 
 TITLES = (
@@ -31,7 +32,7 @@ def get_initials(parlement_and_politiek_id):
     if not parlement_and_politiek_id:
         return ''
     url = 'https://www.parlement.com/id/' + parlement_and_politiek_id + '/'
-    page = requests.get(url, timeout=60)
+    page = scraper.session.get(url, timeout=60)
     tree = lxml.html.fromstring(page.content)
     title = tree.xpath("//title")[0].text
     name_parts = title.split(' ')  # this includes the title, if applicable, for example: Ir. J.R.V.A. (Jeroen) Dijsselbloem
@@ -0,0 +1,206 @@
+import contextlib
+import email.utils
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import fasteners
+
+from scraper.settings import HOST_REQUESTS_PER_SECOND
+from scraper.settings import MAX_CONNECTIONS_PER_HOST
+from scraper.settings import POLITENESS_DIR
+from scraper.settings import REQUESTS_PER_SECOND
+from scraper.settings import THROTTLE_BACKOFF_MAX
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUS_CODES = (429, 503)
+THROTTLE_BACKOFF_MIN = 1.0  # seconds
+RATE_FACTOR_MIN = 1.0 / 16
+RATE_FACTOR_RECOVERY_STEP = 0.05  # per successful request
+SLOT_POLL_INTERVAL = 0.05  # seconds
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+class HostState(object):
+    """
+    The request budget of a host, shared by all threads and processes via a state file.
+    A token bucket limits the request rate. After a throttled response (429, 503) all requests to the host wait
+    for the Retry-After time or an exponential backoff, and the rate is halved.
+    The rate recovers step by step with each successful request (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, tokens=None, updated=0.0, blocked_until=0.0, rate_factor=1.0, backoff=0.0):
+        self.tokens = tokens
+        self.updated = updated
+        self.blocked_until = blocked_until
+        self.rate_factor = rate_factor
+        self.backoff = backoff
+
+    def take_token(self, now, rate, burst):
+        """ takes a token if available, returns 0, otherwise returns the number of seconds to wait before trying again """
+        rate = rate * self.rate_factor
+        if self.tokens is None:
+            self.tokens = burst
+        self.tokens = min(burst, self.tokens + max(0.0, now - self.updated) * rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / rate
+
+    def throttled(self, now, retry_after=None):
+        self.backoff = min(THROTTLE_BACKOFF_MAX, max(THROTTLE_BACKOFF_MIN, self.backoff * 2))
+        wait = max(self.backoff, retry_after or 0)
+        self.blocked_until = max(self.blocked_until, now + wait)
+        self.rate_factor = max(RATE_FACTOR_MIN, self.rate_factor / 2)
+        self.tokens = 0
+        return wait
+
+    def succeeded(self):
+        self.backoff = 0.0
+        self.rate_factor = min(1.0, self.rate_factor + RATE_FACTOR_RECOVERY_STEP)
+
+    @property
+    def is_recovering(self):
+        return self.backoff > 0 or self.rate_factor < 1.0
+
+    def to_json(self):
+        return self.__dict__
+
+    @staticmethod
+    def from_json(data):
+        return HostState(**data)
+
+
+class HostScheduler(object):
+    """
+    Limits the requests per second and the requests in flight to a host, over all threads and processes.
+    Threads of a process share the scheduler object, processes share the state and slot files.
+    """
+
+    def __init__(self, host, requests_per_second, max_in_flight, state_dir=POLITENESS_DIR):
+        self.host = host
+        self.requests_per_second = float(requests_per_second)
+        self.burst = max(1.0, self.requests_per_second)
+        self.max_in_flight = max_in_flight
+        name = re.sub(r'[^A-Za-z0-9.-]', '_', host)
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, name + '.json')
+        # file locks are held per process, a thread lock is needed as well
+        self._thread_lock = threading.Lock()
+        self._state_lock = fasteners.InterProcessLock(self.state_path + '.lock')
+        self._slot_semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._slot_locks = [
+            fasteners.InterProcessLock(os.path.join(state_dir, '{}.slot{}.lock'.format(name, i))) for i in range(max_in_flight)
+        ]
+        self._slots_in_use = set()
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with self._thread_lock, self._state_lock:
+            state = self._read_state()
+            yield state
+            self._write_state(state)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as file:
+                return HostState.from_json(json.load(file))
+        except (OSError, ValueError, TypeError):
+            return HostState()
+
+    def _write_state(self, state):
+        path_tmp = '{}.{}.tmp'.format(self.state_path, os.getpid())
+        with open(path_tmp, 'w') as file:
+            json.dump(state.to_json(), file)
+        os.replace(path_tmp, self.state_path)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """ waits for a free in flight slot, and a request token, for the duration of a request """
+        with self._slot_semaphore:
+            slot = self._acquire_slot()
+            try:
+                self.wait_for_token()
+                yield
+            finally:
+                with self._thread_lock:
+                    self._slot_locks[slot].release()
+                    self._slots_in_use.remove(slot)
+
+    def _acquire_slot(self):
+        while True:
+            with self._thread_lock:
+                for i, lock in enumerate(self._slot_locks):
+                    if i not in self._slots_in_use and lock.acquire(blocking=False):
+                        self._slots_in_use.add(i)
+                        return i
+            time.sleep(SLOT_POLL_INTERVAL)  # all slots are used by other processes
+
+    def wait_for_token(self):
+        while True:
+            with self._locked_state() as state:
+                wait = state.take_token(time.time(), self.requests_per_second, self.burst)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """ call after a throttled response, with the value of the Retry-After header if present """
+        with self._locked_state() as state:
+            wait = state.throttled(time.time(), parse_retry_after(retry_after))
+            rate_factor = state.rate_factor
+        logger.warning('{} is throttling requests, pause for {:.1f} seconds and reduce the rate to {:.2f} requests/second'.format(
+            self.host, wait, self.requests_per_second * rate_factor
+        ))
+
+    def succeeded(self):
+        with self._thread_lock:
+            if not self._read_state().is_recovering:
+                return
+        with self._locked_state() as state:
+            state.succeeded()
+
+
+def parse_retry_after(value, now=None):
+    """ returns the number of seconds of a Retry-After header value (delay seconds or http date), None if invalid """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = now if now is not None else time.time()
+    return max(0.0, date.timestamp() - now)
+
+
+def get_scheduler(host) -> HostScheduler:
+    with _schedulers_lock:
+        if host not in _schedulers:
+            _schedulers[host] = HostScheduler(
+                host,
+                requests_per_second=HOST_REQUESTS_PER_SECOND.get(host, REQUESTS_PER_SECOND),
+                max_in_flight=MAX_CONNECTIONS_PER_HOST
+            )
+        return _schedulers[host]
+
+
+def _reset_schedulers():
+    """ a forked process should not use the thread locks and slots of the parent """
+    global _schedulers_lock
+    _schedulers.clear()
+    _schedulers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_schedulers)
@@ -0,0 +1,155 @@
+import copy
+import logging
+import os
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import scraper.cassette
+import scraper.politeness
+from scraper.settings import MAX_CONNECTIONS_PER_HOST
+from scraper.settings import MAX_RETRIES
+from scraper.settings import RETRY_BACKOFF_FACTOR
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'OpenKamer 1.0'
+RETRY_STATUS_CODES = (500, 502, 504)  # throttled responses (429, 503) are retried via the politeness scheduler
+
+_local = threading.local()
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+class HostCounter(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def __str__(self):
+        return 'requests: {}, errors: {}, bytes: {}'.format(self.requests, self.errors, self.bytes)
+
+
+def create_session():
+    """
+    Creates a session with a keep-alive connection pool per host and retries of connection and server errors with exponential backoff.
+    """
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=MAX_CONNECTIONS_PER_HOST, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+def get_session():
+    """ returns the session of the current thread, requests.Session is not guaranteed to be thread safe """
+    if not hasattr(_local, 'session'):
+        _local.session = create_session()
+    return _local.session
+
+
+def get(url, params=None, timeout=60, **kwargs):
+    """
+    GET using the shared session, counts the requests per host.
+    Waits for the request budget of the host, see scraper.politeness. Throttled responses are retried after the backoff.
+    Responses are recorded or replayed if a cassette is active, see scraper.cassette.
+    """
+    host = urllib.parse.urlparse(url).netloc
+    cassette = scraper.cassette.get_cassette()
+    if cassette is not None and cassette.is_replay:
+        try:
+            response = cassette.replay(url, params)
+        except scraper.cassette.CassetteMissError:
+            _count(host, error=True)
+            raise
+        _count(host, error=response.status_code >= 400, size=len(response.content))
+        return response
+    scheduler = scraper.politeness.get_scheduler(host)
+    tries = 0
+    while True:
+        tries += 1
+        with scheduler.slot():
+            try:
+                response = get_session().get(url, params=params, timeout=timeout, **kwargs)
+            except requests.RequestException:
+                _count(host, error=True)
+                raise
+        _count(host, error=response.status_code >= 400, size=len(response.content))
+        if cassette is not None:
+            cassette.record(url, params, response)
+        if response.status_code not in scraper.politeness.THROTTLE_STATUS_CODES:
+            scheduler.succeeded()
+            return response
+        scheduler.throttled(response.headers.get('Retry-After'))
+        if tries > MAX_RETRIES:
+            return response
+
+
+class RequestsModule(object):
+    """
+    Replaces the requests module in libraries that call requests.get directly (tkapi),
+    to send their requests via the shared session and politeness scheduler.
+    """
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    @staticmethod
+    def get(url, params=None, **kwargs):
+        return get(url, params=params, **kwargs)
+
+
+def install_library_hooks():
+    import tkapi.document
+    import tkapi.tkapi
+    import tkapi.util.document
+    for module in (tkapi.tkapi, tkapi.document, tkapi.util.document):
+        module.requests = RequestsModule()
+
+
+def _count(host, error=False, size=0):
+    with _counters_lock:
+        counter = _counters.setdefault(host, HostCounter())
+        counter.requests += 1
+        counter.bytes += size
+        if error:
+            counter.errors += 1
+
+
+def get_request_counters():
+    """ returns a copy of the request counters per host """
+    with _counters_lock:
+        return {host: copy.copy(counter) for host, counter in _counters.items()}
+
+
+def reset_request_counters():
+    with _counters_lock:
+        _counters.clear()
+
+
+def log_request_counters():
+    for host, counter in sorted(get_request_counters().items()):
+        logger.info('{} - {}'.format(host, counter))
+
+
+def _reset_sessions():
+    """ a forked process should not use the sessions and keep-alive connections of the parent """
+    global _local, _counters_lock
+    _local = threading.local()
+    _counters_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_sessions)
@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+from django.conf import settings
+
+MAX_CONNECTIONS_PER_HOST = getattr(settings, 'SCRAPER_MAX_CONNECTIONS_PER_HOST', 4)
+MAX_RETRIES = getattr(settings, 'SCRAPER_MAX_RETRIES', 3)
+RETRY_BACKOFF_FACTOR = getattr(settings, 'SCRAPER_RETRY_BACKOFF_FACTOR', 1.0)  # seconds, doubled after each retry
+REQUESTS_PER_SECOND = getattr(settings, 'SCRAPER_REQUESTS_PER_SECOND', 5.0)  # per host, for all threads and processes
+HOST_REQUESTS_PER_SECOND = getattr(settings, 'SCRAPER_HOST_REQUESTS_PER_SECOND', {})  # per host overrides
+THROTTLE_BACKOFF_MAX = getattr(settings, 'SCRAPER_THROTTLE_BACKOFF_MAX', 300)  # seconds
+POLITENESS_DIR = getattr(
+    settings, 'SCRAPER_POLITENESS_DIR', os.path.join(getattr(settings, 'OK_TMP_DIR', '') or tempfile.gettempdir(), 'politeness')
+)
+
+HTTP_CACHE_ENABLED = getattr(settings, 'HTTP_CACHE_ENABLED', True)
+HTTP_CACHE_DIR = getattr(
+    settings, 'HTTP_CACHE_DIR', os.path.join(getattr(settings, 'OK_TMP_DIR', tempfile.gettempdir()), 'http_cache')
+)
+HTTP_CACHE_MAX_SIZE = getattr(settings, 'HTTP_CACHE_MAX_SIZE', 2 * 1024 * 1024 * 1024)  # bytes
+
+CASSETTE_MODE = getattr(settings, 'SCRAPER_CASSETTE_MODE', None)  # None, 'record' or 'replay'
+CASSETTE_PATH = getattr(
+    settings, 'SCRAPER_CASSETTE_PATH', os.path.join(getattr(settings, 'OK_TMP_DIR', '') or tempfile.gettempdir(), 'cassette.sqlite3')
+)
+CASSETTE_LATENCY = getattr(settings, 'SCRAPER_CASSETTE_LATENCY', 0.0)  # seconds added to each replayed response
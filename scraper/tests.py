@@ -1,9 +1,20 @@
+import datetime
+import os
 import re
+import shutil
+import tempfile
+import zlib
+
+import requests
 
 from django.test import TestCase
 
+import scraper.cache
+import scraper.cassette
 import scraper.documents
 import scraper.persons
+import scraper.politeness
+import scraper.session
 
 
 class TestPersonInfoScraper(TestCase):
@@ -56,3 +67,197 @@ class TestDocumentScraper(TestCase):
         metadata = scraper.documents.get_metadata(document_id)
         self.assertEqual(metadata['publication_type'], 'Kamerstuk')
         self.assertEqual(metadata['dossier_ids'], '33037;34532')
+
+
+class TestHttpCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = scraper.cache.HttpCache(self.directory, max_size=100, evict_interval=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        url = 'https://zoek.officielebekendmakingen.nl/kst-34575-2'
+        final_url = 'https://zoek.officielebekendmakingen.nl/kst-34575-2.html'
+        self.assertIsNone(self.cache.get_entry(url))
+        self.cache.put(url, final_url, b'content', etag='"abc"')
+        entry = self.cache.get_entry(url)
+        self.assertEqual(entry.final_url, final_url)
+        self.assertEqual(entry.etag, '"abc"')
+        self.assertTrue(entry.has_validators)
+        self.assertEqual(self.cache.get_body(entry), b'content')
+
+    def test_content_addressed(self):
+        self.cache.put('https://a', 'https://a', b'same content')
+        self.cache.put('https://b', 'https://b', b'same content')
+        self.assertEqual(self.cache.get_entry('https://a').body_hash, self.cache.get_entry('https://b').body_hash)
+        self.assertEqual(self.cache.total_size(), len(b'same content'))
+
+    def test_evict_least_recently_used(self):
+        self.cache.put('https://a', 'https://a', b'a' * 40)
+        self.cache.put('https://b', 'https://b', b'b' * 40)
+        self.cache.touch(self.cache.get_entry('https://a'))
+        self.cache.put('https://c', 'https://c', b'c' * 40)
+        self.assertIsNotNone(self.cache.get_entry('https://a'))
+        self.assertIsNone(self.cache.get_entry('https://b'))
+        self.assertIsNotNone(self.cache.get_entry('https://c'))
+        self.assertLessEqual(self.cache.total_size(), 100)
+
+    def test_evict_interval(self):
+        cache = scraper.cache.HttpCache(self.directory, max_size=50, evict_interval=3)
+        cache.put('https://a', 'https://a', b'a' * 40)
+        cache.put('https://b', 'https://b', b'b' * 40)
+        self.assertEqual(cache.total_size(), 80)
+        cache.put('https://c', 'https://c', b'c' * 40)
+        self.assertLessEqual(cache.total_size(), 50)
+        self.assertIsNotNone(cache.get_entry('https://c'))
+
+
+class TestSession(TestCase):
+
+    def test_session_per_thread(self):
+        session = scraper.session.get_session()
+        self.assertIs(session, scraper.session.get_session())
+        self.assertIn('gzip', session.headers['Accept-Encoding'])
+        adapter = session.get_adapter('https://zoek.officielebekendmakingen.nl')
+        self.assertEqual(adapter.max_retries.total, scraper.session.MAX_RETRIES)
+        self.assertNotIn(429, adapter.max_retries.status_forcelist)  # retried by the politeness scheduler
+
+    def test_session_after_fork(self):
+        scraper.session.get_session()
+        cache = scraper.cache.HttpCache(tempfile.mkdtemp(), max_size=100)
+        cache.put('https://a', 'https://a', b'a')
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # the child reports whether it has its own session and cache connection
+            try:
+                own_session = not hasattr(scraper.session._local, 'session')
+                own_connection = cache.get_entry('https://a') is not None and cache._local.pid == os.getpid()
+                os.write(write_fd, b'1' if own_session and own_connection else b'0')
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        result = os.read(read_fd, 1)
+        os.waitpid(pid, 0)
+        os.close(read_fd)
+        shutil.rmtree(cache.directory)
+        self.assertEqual(result, b'1')
+        self.assertTrue(hasattr(scraper.session._local, 'session'))
+
+    def test_request_counters(self):
+        scraper.session.reset_request_counters()
+        scraper.session._count('www.wikidata.org', size=10)
+        scraper.session._count('www.wikidata.org', error=True)
+        counter = scraper.session.get_request_counters()['www.wikidata.org']
+        self.assertEqual(counter.requests, 2)
+        self.assertEqual(counter.errors, 1)
+        self.assertEqual(counter.bytes, 10)
+        scraper.session.reset_request_counters()
+        self.assertEqual(scraper.session.get_request_counters(), {})
+
+
+class TestPoliteness(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_token_bucket(self):
+        state = scraper.politeness.HostState()
+        now = 1000.0
+        for i in range(2):
+            self.assertEqual(0, state.take_token(now, rate=2.0, burst=2.0))
+        self.assertAlmostEqual(0.5, state.take_token(now, rate=2.0, burst=2.0))
+        self.assertEqual(0, state.take_token(now + 0.5, rate=2.0, burst=2.0))
+
+    def test_throttled_backoff(self):
+        state = scraper.politeness.HostState()
+        now = 1000.0
+        self.assertEqual(1.0, state.throttled(now))
+        self.assertEqual(2.0, state.throttled(now))
+        self.assertEqual(30.0, state.throttled(now, retry_after=30))
+        self.assertAlmostEqual(30.0, state.take_token(now, rate=2.0, burst=2.0))
+        self.assertEqual(1.0 / 8, state.rate_factor)
+        self.assertTrue(state.is_recovering)
+        state.succeeded()
+        self.assertEqual(0, state.backoff)
+        self.assertGreater(state.rate_factor, 1.0 / 8)
+        for i in range(20):
+            state.succeeded()
+        self.assertFalse(state.is_recovering)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(120, scraper.politeness.parse_retry_after('120'))
+        self.assertIsNone(scraper.politeness.parse_retry_after(''))
+        self.assertIsNone(scraper.politeness.parse_retry_after('soon'))
+        now = 784111777.0 - 60  # Sun, 06 Nov 1994 08:49:37 GMT
+        self.assertAlmostEqual(60, scraper.politeness.parse_retry_after('Sun, 06 Nov 1994 08:49:37 GMT', now=now))
+
+    def test_state_shared_between_schedulers(self):
+        """ schedulers of different processes share the state file """
+        scheduler_a = scraper.politeness.HostScheduler('example.org', requests_per_second=100, max_in_flight=2, state_dir=self.state_dir)
+        scheduler_b = scraper.politeness.HostScheduler('example.org', requests_per_second=100, max_in_flight=2, state_dir=self.state_dir)
+        scheduler_a.throttled(retry_after='60')
+        state = scheduler_b._read_state()
+        self.assertGreater(state.blocked_until, 0)
+        self.assertEqual(0.5, state.rate_factor)
+        scheduler_b.succeeded()
+        self.assertEqual(0, scheduler_a._read_state().backoff)
+
+    def test_in_flight_slots(self):
+        scheduler = scraper.politeness.HostScheduler('example.org', requests_per_second=100, max_in_flight=2, state_dir=self.state_dir)
+        with scheduler.slot():
+            with scheduler.slot():
+                self.assertEqual({0, 1}, scheduler._slots_in_use)
+        self.assertEqual(set(), scheduler._slots_in_use)
+
+    def test_library_hooks(self):
+        import tkapi.tkapi
+        self.assertIsInstance(tkapi.tkapi.requests, scraper.session.RequestsModule)
+        self.assertIs(tkapi.tkapi.requests.exceptions, requests.exceptions)
+
+
+class TestCassette(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cassette.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def create_response(url, content, status_code=200):
+        response = requests.Response()
+        response.url = url
+        response.status_code = status_code
+        response.reason = 'OK'
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response.headers['Content-Encoding'] = 'gzip'
+        response._content = content
+        response.elapsed = datetime.timedelta(seconds=0.2)
+        return response
+
+    def test_record_replay(self):
+        url = 'https://www.wikidata.org/w/api.php'
+        with scraper.cassette.use_cassette(self.path, scraper.cassette.Cassette.RECORD) as cassette:
+            response = self.create_response(url + '?action=wbgetentities&ids=Q55', 'Nederland'.encode('utf-8'))
+            cassette.record(url, {'ids': 'Q55', 'action': 'wbgetentities'}, response)
+            self.assertIs(cassette, scraper.cassette.get_cassette())
+        self.assertIsNot(cassette, scraper.cassette.get_cassette())
+        with scraper.cassette.use_cassette(self.path, scraper.cassette.Cassette.REPLAY) as cassette:
+            response = scraper.session.get(url, params={'action': 'wbgetentities', 'ids': 'Q55'})
+            self.assertEqual('Nederland', response.text)
+            self.assertEqual(url + '?action=wbgetentities&ids=Q55', response.url)
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual({'responses': 1, 'bytes': len(zlib.compress(b'Nederland'))}, cassette.get_stats())
+            with self.assertRaises(scraper.cassette.CassetteMissError):
+                scraper.session.get(url, params={'action': 'wbgetentities', 'ids': 'Q31'})
+
+    def test_replay_missing_cassette(self):
+        with self.assertRaises(FileNotFoundError):
+            scraper.cassette.Cassette(self.path, scraper.cassette.Cassette.REPLAY)
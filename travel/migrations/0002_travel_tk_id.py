@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travel', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='travel',
+            name='tk_id',
+            field=models.CharField(blank=True, db_index=True, max_length=200),
+        ),
+    ]
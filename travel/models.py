@@ -34,6 +34,7 @@ class Travel(models.Model):
     paid_by = models.CharField(max_length=1000, default='', blank=True)
     date_begin = models.DateField()
     date_end = models.DateField()
+    tk_id = models.CharField(max_length=200, blank=True, db_index=True)
 
     def save(self, *args, **kwargs):
         self.person_position, created = TravelPersonPosition.objects.get_or_create(
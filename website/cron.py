@@ -28,11 +28,16 @@ import openkamer.dossier
 import openkamer.gift
 import openkamer.kamervraag
 import openkamer.parliament
+import openkamer.parliament_swap
 import openkamer.travel
 import openkamer.verslagao
 
+import scraper.session
+
 import stats.models
 
+import wikidata.cache
+
 from website import settings
 
 logger = logging.getLogger(__name__)
@@ -47,6 +52,8 @@ class LockJob(CronJobBase):
 
     def do(self):
         logger.info('BEGIN: {}'.format(self.code))
+        scraper.session.reset_request_counters()
+        wikidata.cache.reset_stats()
         lockfilepath = os.path.join(settings.CRON_LOCK_DIR, 'tmp_{}_lockfile'.format(self.code))
         a_lock = fasteners.InterProcessLock(lockfilepath)
         gotten = a_lock.acquire(timeout=1.0)
@@ -58,6 +65,8 @@ class LockJob(CronJobBase):
         finally:
             if gotten:
                 a_lock.release()
+        scraper.session.log_request_counters()
+        wikidata.cache.log_stats()
         logger.info('END: {}'.format(self.code))
 
     def do_imp(self):
@@ -83,7 +92,7 @@ class UpdateParliamentAndGovernment(LockJob):
     def do_imp(self):
         logger.info('BEGIN')
         try:
-            openkamer.parliament.create_parliament_and_government()
+            openkamer.parliament_swap.update_parliament_and_government()
         except Exception as error:
             logger.exception(error)
             raise
@@ -98,7 +107,7 @@ class UpdateActiveDossiers(LockJob):
     def do_imp(self):
         # TODO: also update dossiers that have closed since last update
         logger.info('update active dossiers cronjob')
-        failed_dossiers = openkamer.dossier.create_wetsvoorstellen_active()
+        failed_dossiers = openkamer.dossier.create_wetsvoorstellen_active(incremental=True, only_changed=True)
         if failed_dossiers:
             logger.error('the following dossiers failed: ' + str(failed_dossiers))
 
@@ -118,7 +127,7 @@ class UpdateInactiveDossiers(LockJob):
                 year = int(year)
                 if year % self.DAYS_PER_WEEK == week_day:
                     logger.info('year: {}'.format(year))
-                    failed_dossiers = openkamer.dossier.create_wetsvoorstellen_inactive(year=year)
+                    failed_dossiers = openkamer.dossier.create_wetsvoorstellen_inactive(year=year, incremental=True, only_changed=True)
                     if failed_dossiers:
                         logger.error('the following dossiers failed: {}'.format(failed_dossiers))
         except:
@@ -65,6 +65,37 @@ CRON_CLASSES = [
 CONTACT_EMAIL = 'info@openkamer.org'
 OK_TMP_DIR = os.path.join(BASE_DIR, 'data/tmp/')
 CSV_EXPORT_PATH = os.path.join(BASE_DIR, STATIC_ROOT, 'csv/')
+DOCUMENT_FETCH_MAX_WORKERS = 8  # number of threads per import process that download documents in parallel
+DOSSIER_PREFETCH_BATCH_SIZE = 20  # number of dossiers of which the zaken, documents and besluiten are requested at once
+DOSSIER_SYNC_PROBE_BATCH_SIZE = 20  # number of dossiers checked for upstream changes per TK API request
+IMPORT_WORKERS = 1  # number of processes that import dossiers in parallel, not used for sqlite
+PARLIAMENT_SWAP_SEATS_TOLERANCE = 10  # the parliament update is not swapped in with fewer than 150 minus this current members
+PARLIAMENT_SWAP_MAX_REMOVED_FRACTION = 0.1  # the maximum fraction of the existing parliament members and parties an update may remove
+PARLIAMENT_SWAP_MAX_OVERLAPPING = 10  # the maximum number of overlapping parliament memberships of an update
+KAMERVRAAG_FETCH_CONCURRENCY = 8  # number of kamervraag documents that are downloaded at the same time, 1 to download one by one
+KAMERVRAAG_WRITE_BATCH_SIZE = 20  # number of kamervraag zaken that are saved in a single transaction
+
+# SCRAPER
+SCRAPER_MAX_CONNECTIONS_PER_HOST = 4
+SCRAPER_MAX_RETRIES = 3  # retries of connection errors, 429 and 5xx responses
+SCRAPER_RETRY_BACKOFF_FACTOR = 1.0  # seconds, doubled after each retry
+SCRAPER_REQUESTS_PER_SECOND = 5.0  # per host, shared by all threads and processes
+SCRAPER_HOST_REQUESTS_PER_SECOND = {}  # per host overrides, for example {'query.wikidata.org': 1.0}
+SCRAPER_THROTTLE_BACKOFF_MAX = 300  # max seconds to pause requests to a host that responds with 429 or 503
+SCRAPER_POLITENESS_DIR = os.path.join(OK_TMP_DIR, 'politeness')  # shared request budget state of all processes
+HTTP_CACHE_ENABLED = True  # cache officielebekendmakingen.nl responses on disk and revalidate with conditional requests
+HTTP_CACHE_DIR = os.path.join(OK_TMP_DIR, 'http_cache')
+HTTP_CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024  # bytes
+SCRAPER_CASSETTE_MODE = None  # 'record' to store all upstream responses, 'replay' to import offline from the stored responses
+SCRAPER_CASSETTE_PATH = os.path.join(OK_TMP_DIR, 'cassette.sqlite3')
+SCRAPER_CASSETTE_LATENCY = 0.0  # seconds added to each replayed response, to simulate the network
+
+# WIKIDATA
+WIKIDATA_CACHE_ENABLED = True  # cache wikidata entities, labels and image urls on disk, shared by all jobs
+WIKIDATA_CACHE_PATH = os.path.join(OK_TMP_DIR, 'wikidata_cache.sqlite3')
+WIKIDATA_CACHE_MAX_SIZE = 500 * 1024 * 1024  # bytes, the least recently used entries are removed above this size
+WIKIDATA_CACHE_TTL = 7 * 24 * 60 * 60  # seconds, after which an entity is requested again
+WIKIDATA_CACHE_LABEL_TTL = 30 * 24 * 60 * 60  # seconds, for labels and image urls
 
 # DOCUMENT
 NUMBER_OF_LATEST_DOSSIERS = 6
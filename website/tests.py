@@ -350,6 +350,35 @@ class TestDocumentLinks(TestCase):
         url_expected = '#anchor-1'
         self.check_url(url, url_expected)
 
+    def test_update_document_html_links(self):
+        content_html = '<div><a href="kst-33569-2.html">2</a><a href="kst-33569-4.html">4</a><a href="#noot1">1</a></div>'
+        content_html = openkamer.document.update_document_html_links(content_html)
+        self.assertIn('href="/kamerstuk/33569/2/"', content_html)
+        self.assertIn('href="https://zoek.officielebekendmakingen.nl/kst-33569-4.html"', content_html)
+        self.assertIn('href="#noot1"', content_html)
+        document = Document.objects.create(document_id='kst-33569-5', content_html=content_html)
+        self.assertEqual(0, openkamer.document.update_documents_html_links())
+        Kamerstuk.objects.create(document=document, id_main='33569', id_sub='4')
+        self.assertEqual(1, openkamer.document.update_documents_html_links(chunk_size=1))
+        document.refresh_from_db()
+        self.assertIn('href="/kamerstuk/33569/4/"', document.content_html)
+        self.assertEqual(0, openkamer.document.update_documents_html_links())
+        with self.assertNumQueries(5):  # no new kamerstukken or dossiers, the documents are not loaded
+            self.assertEqual(0, openkamer.document.update_documents_html_links())
+        self.assertEqual(0, openkamer.document.update_documents_html_links(full=True))
+
+    def test_update_document_html_links_dossier(self):
+        content_html = '<div><a href="/dossier/34000">dossier</a><a href="kst-34000-1.html">1</a></div>'
+        content_html = openkamer.document.update_document_html_links(content_html)
+        self.assertIn('href="https://zoek.officielebekendmakingen.nl/dossier/34000"', content_html)
+        document = Document.objects.create(document_id='kst-33569-6', content_html=content_html)
+        self.assertEqual(0, openkamer.document.update_documents_html_links())
+        Dossier.objects.create(dossier_id='34000')
+        self.assertEqual(1, openkamer.document.update_documents_html_links())
+        document.refresh_from_db()
+        self.assertIn('href="{}"'.format(reverse('dossier-timeline', args=('34000',))), document.content_html)
+        self.assertIn('href="https://zoek.officielebekendmakingen.nl/kst-34000-1.html"', document.content_html)
+
     def check_url(self, url, url_expected):
         new_url = openkamer.document.create_new_url(url)
         self.assertEqual(new_url, url_expected)
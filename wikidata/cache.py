@@ -0,0 +1,233 @@
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import scraper.cassette
+
+from wikidata.settings import WIKIDATA_CACHE_ENABLED
+from wikidata.settings import WIKIDATA_CACHE_MAX_SIZE
+from wikidata.settings import WIKIDATA_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# the parts of an entity that are used, other claims, labels and sitelinks are not stored
+ENTITY_CLAIMS = (
+    'P17', 'P18', 'P31', 'P39', 'P102', 'P131', 'P154', 'P279', 'P527', 'P569', 'P571', 'P576', 'P580', 'P582',
+    'P735', 'P856', 'P1749', 'P1813', 'P2002',
+)
+ENTITY_LANGUAGES = ('nl', 'en')
+ENTITY_SITELINKS = ('nlwiki', 'enwiki')
+SNAK_KEYS = ('property', 'datatype', 'datavalue')
+
+MEMORY_MAX_ITEMS = 5000
+TOUCH_INTERVAL = 60 * 60  # seconds, the last access time is updated at most once per interval
+EVICT_INTERVAL = 100  # number of puts between size checks
+
+
+def compact_entity(entity):
+    """ returns the entity with only the claims, labels and sitelinks that are used """
+    compact = {key: entity[key] for key in ('id', 'missing') if key in entity}
+    if 'labels' in entity:
+        compact['labels'] = {language: entity['labels'][language] for language in ENTITY_LANGUAGES if language in entity['labels']}
+    if 'sitelinks' in entity:
+        compact['sitelinks'] = {site: entity['sitelinks'][site] for site in ENTITY_SITELINKS if site in entity['sitelinks']}
+    if 'claims' in entity:
+        compact['claims'] = {
+            property_id: [compact_claim(claim) for claim in claims]
+            for property_id, claims in entity['claims'].items() if property_id in ENTITY_CLAIMS
+        }
+    return compact
+
+
+def compact_claim(claim):
+    compact = {'mainsnak': compact_snak(claim['mainsnak'])}
+    if 'qualifiers' in claim:
+        compact['qualifiers'] = {
+            property_id: [compact_snak(snak) for snak in snaks] for property_id, snaks in claim['qualifiers'].items()
+        }
+    return compact
+
+
+def compact_snak(snak):
+    return {key: snak[key] for key in SNAK_KEYS if key in snak}
+
+
+class EntityCache(object):
+    """
+    Cache of wikidata entities, labels and image urls, with a time to live per entry.
+    Stored as zlib compressed json in a sqlite file, shared by all jobs and processes.
+    The least recently used entries are removed when the total size exceeds max_size.
+    The most recently used entries are also kept in memory. Without a path, the cache is in memory only.
+    """
+
+    def __init__(self, path, max_size, memory_max_items=MEMORY_MAX_ITEMS):
+        self.path = path
+        self.max_size = max_size
+        self.memory_max_items = memory_max_items
+        self._memory = collections.OrderedDict()  # key to (value, expires, last_touched)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts = 0
+        self.stats = collections.Counter()
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with self._connection() as connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS entry ('
+                    'key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, last_access REAL)'
+                )
+                connection.execute('CREATE INDEX IF NOT EXISTS entry_last_access ON entry (last_access)')
+
+    def _connection(self):
+        # a sqlite connection can not be shared with threads or forked processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=60)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key, count_miss=True):
+        """
+        returns the value, or None if not cached or expired
+        :param count_miss: count a miss in the statistics, False if the value is looked up under another key as well
+        """
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                value, expires, last_touched = self._memory[key]
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    self.stats['hit_memory'] += 1
+                    if self.path and now - last_touched > TOUCH_INTERVAL:
+                        self._memory[key] = (value, expires, now)
+                        self._touch(key, now)
+                    return value
+                del self._memory[key]
+        if not self.path:
+            self._count_miss('miss', count_miss)
+            return None
+        row = self._connection().execute('SELECT value, expires, last_access FROM entry WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count_miss('miss', count_miss)
+            return None
+        value_zlib, expires, last_access = row
+        if expires <= now:
+            self._count_miss('expired', count_miss)
+            return None
+        value = json.loads(zlib.decompress(value_zlib).decode('utf-8'))
+        if now - last_access > TOUCH_INTERVAL:
+            self._touch(key, now)
+        with self._lock:
+            self.stats['hit_disk'] += 1
+            self._set_memory(key, value, expires, now)
+        return value
+
+    def put(self, key, value, ttl):
+        now = time.time()
+        expires = now + ttl
+        with self._lock:
+            self._set_memory(key, value, expires, now)
+            self.stats['put'] += 1
+            self._puts += 1
+            evict = self._puts % EVICT_INTERVAL == 0
+        if not self.path:
+            return
+        value_zlib = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO entry (key, value, size, expires, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, value_zlib, len(value_zlib), expires, now)
+            )
+        if evict:
+            self.evict()
+
+    def _set_memory(self, key, value, expires, now):
+        self._memory[key] = (value, expires, now)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_items:
+            self._memory.popitem(last=False)
+
+    def _count_miss(self, reason, count_miss):
+        if count_miss:
+            with self._lock:
+                self.stats[reason] += 1
+
+    def _touch(self, key, now):
+        with self._connection() as connection:
+            connection.execute('UPDATE entry SET last_access = ? WHERE key = ?', (now, key))
+
+    def total_size(self):
+        if not self.path:
+            return 0
+        return self._connection().execute('SELECT COALESCE(SUM(size), 0) FROM entry').fetchone()[0]
+
+    def evict(self):
+        """ removes the expired entries, and the least recently used entries until the cache is within its max size """
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM entry WHERE expires <= ?', (time.time(),))
+        total_size = self.total_size()
+        if total_size <= self.max_size:
+            return
+        rows = connection.execute('SELECT key, size FROM entry ORDER BY last_access').fetchall()
+        keys = []
+        for key, size in rows:
+            if total_size <= self.max_size:
+                break
+            keys.append((key,))
+            total_size -= size
+        with connection:
+            connection.executemany('DELETE FROM entry WHERE key = ?', keys)
+        logger.info('wikidata cache evicted {} entries, to {} bytes'.format(len(keys), total_size))
+
+    def get_stats(self):
+        with self._lock:
+            return collections.Counter(self.stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+
+    def log_stats(self):
+        stats = self.get_stats()
+        lookups = stats['hit_memory'] + stats['hit_disk'] + stats['miss'] + stats['expired']
+        if not lookups:
+            return
+        logger.info('wikidata cache: {} lookups, {} memory hits, {} disk hits, {} misses, {} expired, hit rate {:.1%}'.format(
+            lookups, stats['hit_memory'], stats['hit_disk'], stats['miss'], stats['expired'],
+            (stats['hit_memory'] + stats['hit_disk']) / lookups
+        ))
+
+
+_entity_cache = None
+_entity_cache_lock = threading.Lock()
+_memory_cache = None
+
+
+def get_entity_cache() -> EntityCache:
+    """ the disk cache if enabled, a memory only cache while a cassette is used, responses must be replayed """
+    global _entity_cache, _memory_cache
+    with _entity_cache_lock:
+        if not WIKIDATA_CACHE_ENABLED or scraper.cassette.get_cassette() is not None:
+            if _memory_cache is None:
+                _memory_cache = EntityCache(None, WIKIDATA_CACHE_MAX_SIZE)
+            return _memory_cache
+        if _entity_cache is None:
+            _entity_cache = EntityCache(WIKIDATA_CACHE_PATH, WIKIDATA_CACHE_MAX_SIZE)
+        return _entity_cache
+
+
+def log_stats():
+    for cache in (_entity_cache, _memory_cache):
+        if cache is not None:
+            cache.log_stats()
+
+
+def reset_stats():
+    for cache in (_entity_cache, _memory_cache):
+        if cache is not None:
+            cache.reset_stats()
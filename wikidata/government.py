@@ -24,6 +24,7 @@ class GovernmentMemberData:
 def get_government_members(government_wikidata_id, max_members=None) -> List[GovernmentMemberData]:
     logger.info('BEGIN')
     language = 'nl'
+    wikidata.WikidataItem.prefetch([government_wikidata_id])  # the members and their positions
     parts = wikidata.WikidataItem(government_wikidata_id).get_parts()
     members = []
     for part in parts:
@@ -0,0 +1,188 @@
+import collections
+import logging
+from typing import Dict, List
+
+from wikidata import wikidata
+
+logger = logging.getLogger(__name__)
+
+SPARQL_URL = 'https://query.wikidata.org/sparql?'
+SPARQL_PAGE_SIZE = 10000
+SPARQL_MAX_VALUES = 200
+ENTITY_URL_PREFIX = 'http://www.wikidata.org/entity/'
+YOUTH_PARTY_ITEM_ID = 'Q2493450'
+
+QUERY_POSITIONS = (
+    'SELECT ?person ?statement ?start ?end ?part_of ?group WHERE {{ '
+    '?person wdt:P31 wd:Q5 . '
+    '?person p:P39 ?statement . '
+    '?statement ps:P39 wd:{position_id} . '
+    'OPTIONAL {{ ?statement pq:P580 ?start . }} '
+    'OPTIONAL {{ ?statement pq:P582 ?end . }} '
+    'OPTIONAL {{ ?statement pq:P361 ?part_of . }} '
+    'OPTIONAL {{ ?statement pq:P4100 ?group . }} '
+    '}} ORDER BY ?statement LIMIT {limit} OFFSET {offset}'
+)
+
+QUERY_MEMBERSHIPS = (
+    'SELECT ?person ?statement ?party ?start ?end WHERE {{ '
+    '?person wdt:P31 wd:Q5 . '
+    'FILTER EXISTS {{ ?person p:P39/ps:P39 wd:{position_id} . }} '
+    '?person p:P102 ?statement . '
+    '?statement ps:P102 ?party . '
+    'OPTIONAL {{ ?statement pq:P580 ?start . }} '
+    'OPTIONAL {{ ?statement pq:P582 ?end . }} '
+    '}} ORDER BY ?statement LIMIT {limit} OFFSET {offset}'
+)
+
+QUERY_PARTIES = (
+    'SELECT ?party ?label ?local ?youth WHERE {{ '
+    'VALUES ?party {{ {values} }} '
+    'OPTIONAL {{ ?party rdfs:label ?label . FILTER(LANG(?label) = "nl") }} '
+    'BIND(EXISTS {{ ?party p:P131 ?located_in . }} AS ?local) '
+    'BIND(EXISTS {{ ?party p:P31/ps:P31 wd:{youth_party_id} . }} AS ?youth) '
+    '}}'
+)
+
+
+class PartyData:
+    def __init__(self, wikidata_id):
+        self.wikidata_id = wikidata_id
+        self.label = ''
+        self.is_local_party = False
+        self.is_youth_party = False
+
+
+class ParliamentData:
+    """
+    The Tweede Kamer positions held and party memberships of all parliament members,
+    and the parties they refer to, loaded with a few paged SPARQL queries instead of an entity request per person and party.
+    Positions and memberships have the same format as WikidataItem.get_positions_held and get_political_party_memberships.
+    """
+
+    def __init__(self):
+        self.positions = collections.defaultdict(list)  # person wikidata id to positions
+        self.memberships = collections.defaultdict(list)  # person wikidata id to party memberships
+        self.parties = {}  # party wikidata id to PartyData
+
+    def get_member_ids(self, with_start_date=False) -> List[str]:
+        """ returns the person ids with a position, ordered by the latest start date first, like the member id search """
+        latest_start = {}
+        for person_id, positions in self.positions.items():
+            start_times = [position['start_time'] for position in positions if position['start_time']]
+            if with_start_date and not start_times:
+                continue
+            latest_start[person_id] = max(start_times) if start_times else None
+        return sorted(latest_start, key=lambda person_id: (latest_start[person_id] is not None, latest_start[person_id]), reverse=True)
+
+    def has_person(self, person_wikidata_id):
+        return person_wikidata_id in self.positions
+
+    def add_position_bindings(self, bindings):
+        for statement, rows in group_by_statement(bindings).items():
+            person_id = get_binding_id(rows[0], 'person')
+            part_of_ids = get_binding_ids(rows, 'part_of') or get_binding_ids(rows, 'group')
+            if len(part_of_ids) > 1:
+                logger.warning('multiple part of for a single position for wikidata_id: {}'.format(person_id))
+            self.positions[person_id].append({
+                'id': wikidata.PARLIAMENT_MEMBER_DUTCH_ITEM_ID,
+                'start_time': get_binding_date(rows, 'start', person_id),
+                'end_time': get_binding_date(rows, 'end', person_id),
+                'part_of_id': part_of_ids[0] if part_of_ids else None,
+            })
+
+    def add_membership_bindings(self, bindings):
+        for statement, rows in group_by_statement(bindings).items():
+            person_id = get_binding_id(rows[0], 'person')
+            party_id = get_binding_id(rows[0], 'party')
+            if party_id is None:
+                logger.warning('no party value for membership of person with wikidata id: {}'.format(person_id))
+                continue
+            self.memberships[person_id].append({
+                'party_wikidata_id': party_id,
+                'start_date': get_binding_date(rows, 'start', person_id),
+                'end_date': get_binding_date(rows, 'end', person_id),
+            })
+
+    def add_party_bindings(self, bindings):
+        for row in bindings:
+            party = self.parties.setdefault(get_binding_id(row, 'party'), PartyData(get_binding_id(row, 'party')))
+            party.label = row['label']['value'] if 'label' in row else party.label
+            party.is_local_party = row['local']['value'] == 'true'
+            party.is_youth_party = row['youth']['value'] == 'true'
+
+    def get_party_ids(self):
+        party_ids = set()
+        for memberships in self.memberships.values():
+            party_ids.update(membership['party_wikidata_id'] for membership in memberships)
+        for positions in self.positions.values():
+            party_ids.update(position['part_of_id'] for position in positions if position['part_of_id'])
+        return party_ids
+
+    def sort(self):
+        for positions in self.positions.values():
+            positions.sort(key=lambda position: (position['start_time'] is not None, position['start_time']))
+        for memberships in self.memberships.values():
+            memberships.sort(key=lambda membership: (membership['start_date'] is not None, membership['start_date']))
+
+
+def load_parliament_data() -> ParliamentData:
+    logger.info('BEGIN')
+    data = ParliamentData()
+    position_id = wikidata.PARLIAMENT_MEMBER_DUTCH_ITEM_ID
+    data.add_position_bindings(query_sparql_paged(QUERY_POSITIONS, position_id=position_id))
+    data.add_membership_bindings(query_sparql_paged(QUERY_MEMBERSHIPS, position_id=position_id))
+    party_ids = sorted(data.get_party_ids())
+    for i in range(0, len(party_ids), SPARQL_MAX_VALUES):
+        values = ' '.join('wd:{}'.format(party_id) for party_id in party_ids[i:i + SPARQL_MAX_VALUES])
+        data.add_party_bindings(query_sparql(QUERY_PARTIES.format(values=values, youth_party_id=YOUTH_PARTY_ITEM_ID)))
+    data.sort()
+    logger.info('END: {} persons, {} memberships, {} parties'.format(
+        len(data.positions), sum(len(memberships) for memberships in data.memberships.values()), len(data.parties)
+    ))
+    return data
+
+
+def query_sparql(query) -> List[Dict]:
+    response = wikidata.request_wikidata(SPARQL_URL, {'query': query, 'format': 'json'})
+    return response.json()['results']['bindings']
+
+
+def query_sparql_paged(query, page_size=SPARQL_PAGE_SIZE, **kwargs) -> List[Dict]:
+    """ the result rows of all pages, the query needs an ORDER BY to page reliably """
+    bindings = []
+    offset = 0
+    while True:
+        page = query_sparql(query.format(limit=page_size, offset=offset, **kwargs))
+        bindings += page
+        if len(page) < page_size:
+            return bindings
+        offset += page_size
+
+
+def group_by_statement(bindings) -> Dict[str, List[Dict]]:
+    """ a statement with multiple qualifier values has a row per combination of values, possibly on different pages """
+    statements = collections.OrderedDict()
+    for row in bindings:
+        statements.setdefault(row['statement']['value'], []).append(row)
+    return statements
+
+
+def get_binding_id(row, name):
+    """ returns the item id, None for an unknown or no value, these are blank nodes instead of entities """
+    if name not in row or not row[name]['value'].startswith(ENTITY_URL_PREFIX):
+        return None
+    return row[name]['value'][len(ENTITY_URL_PREFIX):]
+
+
+def get_binding_ids(rows, name) -> List[str]:
+    return sorted(set(get_binding_id(row, name) for row in rows if get_binding_id(row, name)))
+
+
+def get_binding_date(rows, name, person_id):
+    values = sorted(set(row[name]['value'] for row in rows if name in row and row[name].get('type') == 'literal'))
+    if len(values) > 1:
+        logger.warning('multiple {} times for a single statement for wikidata_id: {}'.format(name, person_id))
+    if not values:
+        return None
+    return wikidata.WikidataItem.get_date('+' + values[0])
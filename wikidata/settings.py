@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+from django.conf import settings
+
+WIKIDATA_CACHE_ENABLED = getattr(settings, 'WIKIDATA_CACHE_ENABLED', True)
+WIKIDATA_CACHE_PATH = getattr(
+    settings, 'WIKIDATA_CACHE_PATH', os.path.join(getattr(settings, 'OK_TMP_DIR', '') or tempfile.gettempdir(), 'wikidata_cache.sqlite3')
+)
+WIKIDATA_CACHE_MAX_SIZE = getattr(settings, 'WIKIDATA_CACHE_MAX_SIZE', 500 * 1024 * 1024)  # bytes, compressed
+WIKIDATA_CACHE_TTL = getattr(settings, 'WIKIDATA_CACHE_TTL', 7 * 24 * 60 * 60)  # seconds, entities
+WIKIDATA_CACHE_LABEL_TTL = getattr(settings, 'WIKIDATA_CACHE_LABEL_TTL', 30 * 24 * 60 * 60)  # seconds, labels and image urls
@@ -1,9 +1,16 @@
 import logging
+import os
+import tempfile
+import time
 from unittest import TestCase
 import datetime
 
 from wikidata import wikidata
 from wikidata import government as wikidata_government
+from wikidata.parliament import ParliamentData
+from wikidata.cache import EntityCache
+from wikidata.cache import compact_entity
+from wikidata.cache import get_entity_cache
 
 logger = logging.getLogger(__name__)
 
@@ -172,3 +179,140 @@ class TestGovernmentScraper(TestCase):
         item = wikidata.WikidataItem(person_wikidata_id)
         parlement_id = item.get_parlement_and_politiek_id()
         self.assertEqual(parlement_id, expected_id)
+
+
+class TestPrefetch(TestCase):
+
+    @staticmethod
+    def create_claim(value_id, qualifiers=None):
+        claim = {'mainsnak': {'datavalue': {'value': {'entity-type': 'item', 'id': value_id}}}}
+        if qualifiers:
+            claim['qualifiers'] = {
+                property_id: [{'datavalue': {'value': value}}] for property_id, value in qualifiers.items()
+            }
+        return claim
+
+    def test_get_referenced_ids(self):
+        item = {
+            'claims': {
+                'P102': [self.create_claim('Q-party')],
+                'P39': [self.create_claim('Q18887908', {
+                    'P4100': {'entity-type': 'item', 'id': 'Q-fractie'},
+                    'P580': {'time': '+2017-03-23T00:00:00Z'},
+                    'P1365': {'entity-type': 'item', 'id': 'Q-replaces'},
+                })],
+                'P27': [self.create_claim('Q55')],
+            }
+        }
+        self.assertEqual({'Q-party', 'Q-fractie'}, wikidata.WikidataItem.get_referenced_ids(item))
+
+    def test_cached_items(self):
+        item = {'id': 'Q-cached', 'labels': {'nl': {'value': 'label'}}, 'claims': {}}
+        get_entity_cache().put('Q-cached-None', item, ttl=60)
+        wikidata.WikidataItem.prefetch(['Q-cached'])  # does not request the cached item
+        self.assertEqual('label', wikidata.WikidataItem.get_label_for_id('Q-cached'))
+        self.assertEqual(item, wikidata.WikidataItem('Q-cached').item)
+
+
+class TestParliamentData(TestCase):
+
+    @staticmethod
+    def entity(id):
+        return {'type': 'uri', 'value': 'http://www.wikidata.org/entity/{}'.format(id)}
+
+    @staticmethod
+    def time(date_str):
+        return {'type': 'literal', 'datatype': 'http://www.w3.org/2001/XMLSchema#dateTime', 'value': date_str}
+
+    def test_add_bindings(self):
+        data = ParliamentData()
+        data.add_position_bindings([
+            {'person': self.entity('Q1'), 'statement': self.entity('statement-2'), 'start': self.time('2017-03-23T00:00:00Z'), 'group': self.entity('Q-party-b')},
+            {'person': self.entity('Q1'), 'statement': self.entity('statement-1'), 'start': self.time('2012-09-20T00:00:00Z'),
+             'end': self.time('2017-03-22T00:00:00Z'), 'part_of': self.entity('Q-party-a'), 'group': self.entity('Q-party-b')},
+            {'person': self.entity('Q2'), 'statement': self.entity('statement-3'), 'end': {'type': 'bnode', 'value': 't1'}},
+        ])
+        data.add_membership_bindings([
+            {'person': self.entity('Q1'), 'statement': self.entity('statement-4'), 'party': self.entity('Q-party-a'), 'start': self.time('2010-01-01T00:00:00Z')},
+            {'person': self.entity('Q1'), 'statement': self.entity('statement-5'), 'party': {'type': 'bnode', 'value': 't2'}},
+        ])
+        data.add_party_bindings([
+            {'party': self.entity('Q-party-a'), 'label': {'xml:lang': 'nl', 'type': 'literal', 'value': 'Partij A'},
+             'local': {'type': 'literal', 'value': 'false'}, 'youth': {'type': 'literal', 'value': 'true'}},
+        ])
+        data.sort()
+        self.assertEqual(2, len(data.positions['Q1']))
+        self.assertEqual(
+            {'id': 'Q18887908', 'start_time': datetime.date(2012, 9, 20), 'end_time': datetime.date(2017, 3, 22), 'part_of_id': 'Q-party-a'},
+            data.positions['Q1'][0]
+        )
+        self.assertEqual('Q-party-b', data.positions['Q1'][1]['part_of_id'])
+        self.assertEqual(
+            {'id': 'Q18887908', 'start_time': None, 'end_time': None, 'part_of_id': None}, data.positions['Q2'][0]
+        )
+        self.assertEqual(
+            [{'party_wikidata_id': 'Q-party-a', 'start_date': datetime.date(2010, 1, 1), 'end_date': None}], data.memberships['Q1']
+        )
+        self.assertEqual({'Q-party-a', 'Q-party-b'}, data.get_party_ids())
+        self.assertEqual('Partij A', data.parties['Q-party-a'].label)
+        self.assertTrue(data.parties['Q-party-a'].is_youth_party)
+        self.assertFalse(data.parties['Q-party-a'].is_local_party)
+        self.assertEqual(['Q1', 'Q2'], data.get_member_ids())
+        self.assertEqual(['Q1'], data.get_member_ids(with_start_date=True))
+
+
+class TestEntityCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_put(self):
+        cache = EntityCache(self.path, max_size=1000000)
+        self.assertIsNone(cache.get('Q1-None'))
+        cache.put('Q1-None', {'id': 'Q1'}, ttl=60)
+        self.assertEqual({'id': 'Q1'}, cache.get('Q1-None'))
+        cache_other = EntityCache(self.path, max_size=1000000)  # another process
+        self.assertEqual({'id': 'Q1'}, cache_other.get('Q1-None'))
+        self.assertEqual({'miss': 1, 'put': 1, 'hit_memory': 1}, dict(cache.get_stats()))
+        self.assertEqual({'hit_disk': 1}, dict(cache_other.get_stats()))
+
+    def test_expired(self):
+        cache = EntityCache(self.path, max_size=1000000)
+        cache.put('Q1-None', {'id': 'Q1'}, ttl=-1)
+        self.assertIsNone(cache.get('Q1-None'))
+        self.assertIsNone(EntityCache(self.path, max_size=1000000).get('Q1-None'))
+
+    def test_evict_least_recently_used(self):
+        cache = EntityCache(self.path, max_size=1000000, memory_max_items=1)
+        for i in range(3):
+            cache.put('Q{}-None'.format(i), {'id': 'Q{}'.format(i), 'labels': os.urandom(100).hex()}, ttl=60)
+            time.sleep(0.01)
+        cache.max_size = cache.total_size() - 1
+        cache.evict()
+        cache_other = EntityCache(self.path, max_size=1000000)
+        self.assertIsNone(cache_other.get('Q0-None'))
+        self.assertIsNotNone(cache_other.get('Q1-None'))
+        self.assertIsNotNone(cache_other.get('Q2-None'))
+
+    def test_compact_entity(self):
+        entity = {
+            'id': 'Q1',
+            'labels': {'nl': {'value': 'nl'}, 'de': {'value': 'de'}},
+            'descriptions': {'nl': {'value': 'description'}},
+            'sitelinks': {'nlwiki': {'title': 'nl'}, 'dewiki': {'title': 'de'}},
+            'claims': {
+                'P102': [{'mainsnak': {'property': 'P102', 'hash': 'abc', 'datavalue': {'value': {'id': 'Q2'}}}, 'id': 'claim'}],
+                'P27': [{'mainsnak': {'property': 'P27', 'datavalue': {'value': {'id': 'Q55'}}}}],
+            }
+        }
+        compact = compact_entity(entity)
+        self.assertEqual({'nl': {'value': 'nl'}}, compact['labels'])
+        self.assertEqual({'nlwiki': {'title': 'nl'}}, compact['sitelinks'])
+        self.assertNotIn('descriptions', compact)
+        self.assertEqual(
+            {'P102': [{'mainsnak': {'property': 'P102', 'datavalue': {'value': {'id': 'Q2'}}}}]}, compact['claims']
+        )
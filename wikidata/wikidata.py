@@ -2,9 +2,13 @@ import datetime
 import logging
 import re
 import urllib.parse
-import time
 
-import requests
+import scraper.session
+
+from wikidata.cache import compact_entity
+from wikidata.cache import get_entity_cache
+from wikidata.settings import WIKIDATA_CACHE_LABEL_TTL
+from wikidata.settings import WIKIDATA_CACHE_TTL
 
 logger = logging.getLogger(__name__)
 
@@ -12,18 +16,13 @@ logger = logging.getLogger(__name__)
 PARLIAMENT_MEMBER_DUTCH_ITEM_ID = 'Q18887908'
 REQUEST_TIMEOUT = 60
 MAX_LAG = 60  # https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
+WBGETENTITIES_MAX_IDS = 50
 
 
 def request_wikidata(url, params, **kwargs):
-    headers = {'User-Agent': 'OpenKamer 1.0', 'Accept-Encoding': 'gzip'}
+    """ 429 (too many requests) and maxlag 503 responses are retried after Retry-After by the shared session """
     params['maxlag'] = MAX_LAG
-    response = requests.get(url, params, headers=headers, timeout=REQUEST_TIMEOUT, **kwargs)
-    if response.status_code == 429:
-        backoff = int(response.headers.get('retry-after', REQUEST_TIMEOUT))
-        logger.warning('too many requests for {}, waiting {} seconds before retry'.format(url, backoff))
-        time.sleep(backoff)
-        response = requests.get(url, params, headers=headers, timeout=REQUEST_TIMEOUT, **kwargs)
-    return response
+    return scraper.session.get(url, params, timeout=REQUEST_TIMEOUT, **kwargs)
 
 
 def search(search_str, language='en'):
@@ -114,23 +113,65 @@ def search_parliament_member_ids():
 
 
 class WikidataItem(object):
-    _cache = {}
+
+    # the items that are referenced by the claims of an item, and used by the per item code, loaded by prefetch:
+    # property id: (load the main value, the qualifier property ids to load, None for all qualifiers)
+    REFERENCES = {
+        'P102': (True, ()),  # member of political party
+        'P735': (True, ()),  # given name
+        'P39': (False, ('P361', 'P4100')),  # position held, part of and parliamentary group
+        'P527': (True, None),  # has part, for example the members of a government and their positions
+    }
 
     def __init__(self, wikidata_id, language='nl'):
         self.id = wikidata_id
         site = 'wiki' + language
         self.item = self.get_item(wikidata_id, sites=site)
 
+    @staticmethod
+    def _get_cached(id, props=None):
+        # the sites parameter does not change the entities of ids, an item with all props also serves a request for less props
+        cache = get_entity_cache()
+        if props is None:
+            return cache.get(WikidataItem._cache_key(id))
+        item = cache.get(WikidataItem._cache_key(id, props), count_miss=False)
+        if item is None:
+            item = cache.get(WikidataItem._cache_key(id))
+        return item
+
+    @staticmethod
+    def _cache_key(id, props=None):
+        return '{}-{}'.format(id, props)
+
     @staticmethod
     def get_item(id, sites=None, props=None):
-        item_hash = '{}-{}-{}'.format(id, sites, props)
-        if item_hash in WikidataItem._cache:
-            return WikidataItem._cache[item_hash]
+        item = WikidataItem._get_cached(id, props)
+        if item is not None:
+            return item
         assert id
+        return WikidataItem.get_items([id], sites=sites, props=props)[id]
+
+    @staticmethod
+    def get_items(ids, sites=None, props=None):
+        """ returns a dict of id to item, items that are not cached are requested with a maximum of 50 ids per request """
+        items = {}
+        ids_request = []
+        for id in dict.fromkeys(ids):
+            item = WikidataItem._get_cached(id, props)
+            if item is None:
+                ids_request.append(id)
+            else:
+                items[id] = item
+        for i in range(0, len(ids_request), WBGETENTITIES_MAX_IDS):
+            items.update(WikidataItem._request_items(ids_request[i:i + WBGETENTITIES_MAX_IDS], sites, props))
+        return items
+
+    @staticmethod
+    def _request_items(ids, sites=None, props=None):
         url = 'https://www.wikidata.org/w/api.php'
         params = {
             'action': 'wbgetentities',
-            'ids': id,
+            'ids': '|'.join(ids),
             'format': 'json'
         }
         if sites:
@@ -139,9 +180,55 @@ class WikidataItem(object):
             params['props'] = props
         response = request_wikidata(url, params)
         reponse_json = response.json()
-        item = reponse_json['entities'][id]
-        WikidataItem._cache[item_hash] = item
-        return item
+        if 'entities' not in reponse_json and len(ids) > 1:
+            # a single invalid id fails the whole request
+            logger.warning('wbgetentities error for {} ids, request the items one by one: {}'.format(len(ids), reponse_json.get('error')))
+            items = {}
+            for id in ids:
+                items.update(WikidataItem._request_items([id], sites, props))
+            return items
+        items = {}
+        ttl = WIKIDATA_CACHE_LABEL_TTL if props == 'labels' else WIKIDATA_CACHE_TTL
+        for id in ids:
+            item = compact_entity(reponse_json['entities'][id])
+            get_entity_cache().put(WikidataItem._cache_key(id, props), item, ttl)
+            items[id] = item
+        return items
+
+    @staticmethod
+    def prefetch(ids, follow_references=True):
+        """
+        Loads the items into the item cache, with a maximum of 50 ids per request,
+        to prevent a request per item when the WikidataItems are created.
+        :param follow_references: also loads the items that the items refer to, see REFERENCES
+        """
+        ids = list(ids)
+        logger.info('prefetch {} items'.format(len(ids)))
+        items = WikidataItem.get_items(ids)
+        if follow_references:
+            referenced_ids = set()
+            for item in items.values():
+                referenced_ids.update(WikidataItem.get_referenced_ids(item))
+            WikidataItem.prefetch(sorted(referenced_ids), follow_references=False)
+
+    @staticmethod
+    def get_referenced_ids(item):
+        ids = set()
+        claims = item.get('claims', {})
+        for property_id, (load_main_value, qualifier_property_ids) in WikidataItem.REFERENCES.items():
+            for claim in claims.get(property_id, []):
+                if load_main_value:
+                    ids.add(WikidataItem._get_value_id(claim['mainsnak']))
+                for qualifier_property_id, qualifiers in claim.get('qualifiers', {}).items():
+                    if qualifier_property_ids is None or qualifier_property_id in qualifier_property_ids:
+                        ids.update(WikidataItem._get_value_id(qualifier) for qualifier in qualifiers)
+        ids.discard(None)
+        return ids
+
+    @staticmethod
+    def _get_value_id(snak):
+        value = snak.get('datavalue', {}).get('value')
+        return value.get('id') if isinstance(value, dict) else None
 
     def get_claims(self):
         return self.item['claims']
@@ -285,6 +372,15 @@ class WikidataItem(object):
 
     @staticmethod
     def get_wikimedia_image_url(filename, image_width_px=220):
+        cache_key = 'image-{}-{}'.format(filename, image_width_px)
+        image_url = get_entity_cache().get(cache_key)
+        if image_url is None:
+            image_url = WikidataItem._request_wikimedia_image_url(filename, image_width_px)
+            get_entity_cache().put(cache_key, image_url, WIKIDATA_CACHE_LABEL_TTL)
+        return image_url
+
+    @staticmethod
+    def _request_wikimedia_image_url(filename, image_width_px):
         url = 'https://commons.wikimedia.org/w/api.php'
         params = {
             'action': 'query',